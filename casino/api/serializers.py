@@ -11,6 +11,14 @@ class SpinRequestSerializer(serializers.Serializer):
     bet = serializers.IntegerField(min_value=1, help_text="Amount to bet per spin")
     count = serializers.IntegerField(min_value=1, max_value=5, default=1, help_text="Number of spins (1-5)")
 
+class SpinBatchRequestSerializer(serializers.Serializer):
+    bet = serializers.IntegerField(min_value=1, help_text="Amount to bet per spin")
+    count = serializers.IntegerField(min_value=1, help_text="Number of spins (1-SLOTS_BATCH_MAX_SPINS)")
+    stream = serializers.BooleanField(
+        default=False,
+        help_text="Stream the summary and then one [left, middle, right, win] line per spin as NDJSON",
+    )
+
 class CoinflipRequestSerializer(serializers.Serializer):
     bet = serializers.IntegerField(min_value=1, help_text="Amount to bet")
     choice = serializers.IntegerField(min_value=0, max_value=1, help_text="0 or 1")
@@ -31,8 +39,39 @@ class SpinResponseSerializer(serializers.Serializer):
     total_win = serializers.IntegerField()
     error = serializers.CharField(required=False)
 
+class SpinBatchResponseSerializer(serializers.Serializer):
+    spins = serializers.IntegerField()
+    bet = serializers.IntegerField()
+    total_bet = serializers.IntegerField()
+    total_win = serializers.IntegerField()
+    wins = serializers.IntegerField(help_text="Number of winning spins")
+    biggest_win = serializers.IntegerField()
+    balance = serializers.IntegerField()
+    error = serializers.CharField(required=False)
+
 class CoinflipResponseSerializer(serializers.Serializer):
     result = serializers.IntegerField(help_text="0=loss, 1=win, 2=insufficient balance")
     balance = serializers.IntegerField()
     win = serializers.IntegerField()
-    flip_result = serializers.IntegerField(allow_null=True, help_text="0 or 1")
\ No newline at end of file
+    flip_result = serializers.IntegerField(allow_null=True, help_text="0 or 1")
+class RouletteRoundSerializer(serializers.Serializer):
+    round_number = serializers.IntegerField()
+    winning_color = serializers.CharField()
+    winning_slot = serializers.IntegerField()
+
+class RouletteRoundsResponseSerializer(serializers.Serializer):
+    room = serializers.CharField()
+    results = serializers.ListField(child=RouletteRoundSerializer())
+    next = serializers.IntegerField(allow_null=True, help_text="Pass as ?before= to get the next (older) page")
+
+class BalanceTransactionSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    delta = serializers.IntegerField()
+    balance_after = serializers.IntegerField()
+    reason = serializers.CharField()
+    game_ref = serializers.CharField()
+    created_at = serializers.DateTimeField()
+
+class BalanceStatementResponseSerializer(serializers.Serializer):
+    transactions = serializers.ListField(child=BalanceTransactionSerializer())
+    next = serializers.IntegerField(allow_null=True, help_text="Pass as ?before= to get the next (older) page")
@@ -1,9 +1,15 @@
+import json
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import override_settings
 
-from casino.base.models import User, History
+from casino.base.models import BalanceTransaction, User, History, UserStats
+from casino.roulette.models import GameRound
+from casino.roulette.results import ResultBuffer
 # Create your tests here.
 
 class AuthenticatedAPITestCase(APITestCase):
@@ -61,6 +67,13 @@ class SpinAPITests(AuthenticatedAPITestCase):
         self.assertEqual(response.data["balance"], 1000)
         self.assertEqual(response.data["total_win"], 0)
 
+    def test_spin_bet_beyond_balance_range(self):
+        response = self.client.post(reverse("spin_api"), {"bet": 10**19}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["error"], "Insufficient balance")
+        self.assertEqual(response.data["balance"], 1000)
+
     def test_spin_success_response_shape(self):
         response = self.client.post(
             reverse("spin_api"),
@@ -101,6 +114,50 @@ class SpinAPITests(AuthenticatedAPITestCase):
             0
         )
 
+class SpinBatchAPITests(AuthenticatedAPITestCase):
+
+    def test_batch_invalid_count(self):
+        response = self.client.post(reverse("spin_batch_api"), {"bet": 1, "count": 10001})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_insufficient_balance(self):
+        response = self.client.post(reverse("spin_batch_api"), {"bet": 1, "count": 1001})
+
+        self.assertEqual(response.data["error"], "Insufficient balance")
+        self.assertEqual(response.data["balance"], 1000)
+        self.assertFalse(BalanceTransaction.objects.filter(user=self.user).exists())
+
+    def test_batch_total_beyond_balance_range(self):
+        # Each bet fits a bigint, their total does not
+        response = self.client.post(reverse("spin_batch_api"), {"bet": 2**62, "count": 2}, format="json")
+
+        self.assertEqual(response.data["error"], "Insufficient balance")
+        self.assertEqual(response.data["balance"], 1000)
+
+    @patch("casino.api.views.play_batch", return_value=([(0, 0, 0), (5, 5, 5), (1, 2, 3)], [0, 4, 3]))
+    def test_batch_charged_once(self, mock_play):
+        response = self.client.post(reverse("spin_batch_api"), {"bet": 10, "count": 3})
+
+        self.assertEqual(response.data, {
+            "spins": 3, "bet": 10, "total_bet": 30, "total_win": 70,
+            "wins": 2, "biggest_win": 40, "balance": 1040,
+        })
+        self.assertEqual(
+            list(BalanceTransaction.objects.filter(user=self.user).order_by("id").values_list("delta", "reason")),
+            [(-30, "slots_bet"), (70, "slots_win")],
+        )
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual((stats.slots_bets, stats.total_won, stats.biggest_win), (3, 70, 40))
+
+    @patch("casino.api.views.play_batch", return_value=([(0, 0, 0), (5, 5, 5)], [0, 4]))
+    def test_batch_streamed(self, mock_play):
+        response = self.client.post(reverse("spin_batch_api"), {"bet": 10, "count": 2, "stream": "true"})
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(json.loads(lines[0])["total_win"], 40)
+        self.assertEqual([json.loads(line) for line in lines[1:]], [[0, 0, 0, 0], [5, 5, 5, 40]])
+
 class CoinflipAPITests(AuthenticatedAPITestCase):
 
     def test_coinflip_invalid_bet_type(self):
@@ -129,6 +186,13 @@ class CoinflipAPITests(AuthenticatedAPITestCase):
         self.assertEqual(response.data["win"], 0)
         self.assertIsNone(response.data["flip_result"])
 
+    def test_coinflip_bet_beyond_balance_range(self):
+        response = self.client.post(reverse("coinflip_api"), {"bet": 10**19, "choice": 1}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["result"], 2)
+        self.assertEqual(response.data["balance"], 1000)
+
     def test_coinflip_balance_updates(self):
         response = self.client.post(
             reverse("coinflip_api"),
@@ -160,3 +224,99 @@ class CoinflipDeterministicTests(AuthenticatedAPITestCase):
         self.assertTrue(
             History.objects.filter(u_id=self.user).exists()
         )
+
+
+class RouletteRoundsAPITests(AuthenticatedAPITestCase):
+    """Tests for the keyset-paginated roulette round history"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        GameRound.objects.bulk_create([
+            GameRound(room='table-1', round_number=n, status='COMPLETED',
+                      winning_color='RED', winning_slot=n % 54)
+            for n in range(1, 8)
+        ] + [GameRound(room='table-1', round_number=8, status='BETTING')])
+
+    def get(self, **params):
+        return self.client.get(reverse("roulette_rounds_api"), params)
+
+    def round_numbers(self, response):
+        return [result["round_number"] for result in response.data["results"]]
+
+    def test_pages_follow_cursor(self):
+        """Test pages are newest first and chained through next"""
+        first = self.get(limit=3)
+        second = self.get(limit=3, before=first.data["next"])
+        last = self.get(limit=3, before=second.data["next"])
+
+        self.assertEqual(self.round_numbers(first), [7, 6, 5])
+        self.assertEqual(self.round_numbers(second), [4, 3, 2])
+        self.assertEqual(self.round_numbers(last), [1])
+        self.assertIsNone(last.data["next"])
+
+    def test_unchanged_page_not_modified(self):
+        """Test a page requested with its ETag comes back as 304"""
+        response = self.get(limit=3)
+
+        again = self.client.get(
+            reverse("roulette_rounds_api"), {"limit": 3}, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_new_round_changes_etag(self):
+        """Test the newest page gets a new ETag once another round completes"""
+        etag = self.get(limit=3)["ETag"]
+        GameRound.objects.filter(round_number=8).update(status='COMPLETED', winning_color='GOLD')
+
+        self.assertNotEqual(self.get(limit=3)["ETag"], etag)
+
+    def test_buffered_pages_skip_database(self):
+        """Test pages covered by the published result buffer run no queries"""
+        buffer = ResultBuffer('table-1', size=5)
+        for n in range(3, 8):
+            buffer.add(n, 'GRAY', 0)
+        async_to_sync(buffer.publish)()
+
+        with self.assertNumQueries(0):
+            response = self.get(limit=3)
+        self.assertEqual(response.data["results"][0]["winning_color"], 'GRAY')
+
+        # Older than the buffer reaches: read from the database
+        with self.assertNumQueries(1):
+            response = self.get(limit=3, before=4)
+        self.assertEqual(self.round_numbers(response), [3, 2, 1])
+
+    def test_invalid_parameters(self):
+        """Test bad rooms, cursors and page sizes are rejected"""
+        for params in ({"room": "../x"}, {"before": "abc"}, {"limit": 0}, {"limit": 1000}):
+            self.assertEqual(self.get(**params).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsAPITests(APITestCase):
+    """Tests for the Prometheus metrics endpoint"""
+
+    def get(self, token=None):
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+        return self.client.get(reverse("metrics_api"), **headers)
+
+    @override_settings(METRICS_TOKEN="")
+    def test_disabled_without_token(self):
+        """Test the endpoint does not exist while METRICS_TOKEN is unset"""
+        self.assertEqual(self.get("anything").status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_requires_token(self):
+        """Test scrapes without the bearer token are rejected"""
+        self.assertEqual(self.get().status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.get("wrong").status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_prometheus_text(self):
+        """Test an authorized scrape gets the text exposition format"""
+        response = self.get("secret")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn(b"# TYPE db_sync_to_async_wait_seconds histogram", response.content)
@@ -3,7 +3,11 @@ import casino.api.views as v
 
 urlpatterns = [
     path("spin/", v.spin_api, name="spin_api"),
+    path("spin/batch/", v.spin_batch_api, name="spin_batch_api"),
     path("coinflip/", v.coinflip_api, name="coinflip_api"),
-    path("balance/", v.get_balance, name="my_balance")
+    path("balance/", v.get_balance, name="my_balance"),
+    path("balance/statement/", v.balance_statement_api, name="balance_statement_api"),
+    path("roulette/rounds/", v.roulette_rounds_api, name="roulette_rounds_api"),
+    path("metrics/", v.metrics, name="metrics_api"),
     # path("l/", v.login_user, name="login")
 ]
@@ -1,22 +1,40 @@
 
+import json
+import re
+from django.conf import settings
 from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotFound, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 
 from casino.base.models import User, History
-from casino.slots.views import simulate_spin, check_win
+from casino.slots.batch import play_batch
+from casino.slots.outcomes import spin
 from casino.api.serializers import (
     BalanceResponseSerializer,
+    BalanceStatementResponseSerializer,
     SpinRequestSerializer,
     SpinResponseSerializer,
+    SpinBatchRequestSerializer,
+    SpinBatchResponseSerializer,
     CoinflipRequestSerializer,
-    CoinflipResponseSerializer
+    CoinflipResponseSerializer,
+    RouletteRoundsResponseSerializer
 )
 from secrets import choice
-from casino.utils.balance_tracker import update_balance
+from casino.utils.balance_tracker import STATEMENT_PAGE_SIZE, apply_balance, get_statement
+from casino.utils.user_stats import record_bets, record_win
+from casino.roulette.results import get_results_page
+from casino.roulette.rooms import ROOM_PATTERN
+from casino.utils import metrics as process_metrics
+
+ROUNDS_PAGE_SIZE = 50
+ROUNDS_MAX_PAGE_SIZE = 200
+STATEMENT_MAX_PAGE_SIZE = 200
 
 @extend_schema(
     responses=BalanceResponseSerializer,
@@ -28,6 +46,31 @@ def get_balance(request):
     user = request.user
     return Response({"balance": user.balance})
 
+@extend_schema(
+    responses=BalanceStatementResponseSerializer,
+    parameters=[
+        OpenApiParameter("before", int, description="Transaction id to page back from (exclusive)"),
+        OpenApiParameter("limit", int, description=f"Page size (1-{STATEMENT_MAX_PAGE_SIZE})"),
+    ],
+    description="Get the current user's balance changes, newest first"
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def balance_statement_api(request):
+    try:
+        before = request.query_params.get("before")
+        before = int(before) if before is not None else None
+        limit = int(request.query_params.get("limit", STATEMENT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return Response({"error": "before and limit must be numbers."}, status=400)
+
+    if limit < 1 or limit > STATEMENT_MAX_PAGE_SIZE:
+        return Response({"error": f"Limit must be between 1 and {STATEMENT_MAX_PAGE_SIZE}"}, status=400)
+
+    transactions = get_statement(request.user.pk, before, limit)
+    next_before = transactions[-1]["id"] if len(transactions) == limit else None
+    return Response({"transactions": transactions, "next": next_before})
+
 @extend_schema(
     request=SpinRequestSerializer,
     responses=SpinResponseSerializer,
@@ -53,50 +96,47 @@ def spin_api(request):
 
     total_bet = bet * count
 
-    with transaction.atomic():
-        user = User.objects.select_for_update().get(pk=request.user.pk)
+    results = []
+    total_win = 0
+
+    for _ in range(count):
+        machine, win, strikes = spin(bet)
+
+        if win > 0:
+            total_win += win
+            results.append({
+                "machine": machine,
+                "strikes": strikes,
+                "win": win,
+                "result": 1
+            })
+        else:
+            results.append({
+                "machine": machine,
+                "strikes": strikes,
+                "win": 0,
+                "result": 0
+            })
 
-        if total_bet > user.balance:
+    # Bet and winnings in one conditional update: applied only if the balance covers the bet
+    changes = [(-total_bet, "slots_bet")]
+    if total_win > 0:
+        changes.append((total_win, "slots_win"))
+
+    with transaction.atomic():
+        user = request.user
+        if apply_balance(user, changes, game_ref=f"slots:{count}x{bet}") is None:
             return Response({
                 "results": [],
-                "balance": user.balance,
+                "balance": User.objects.values_list("balance", flat=True).get(pk=user.pk),
                 "total_win": 0,
                 "error": "Insufficient balance"
             })
 
-        # Deduct total bet first (atomic)
-        update_balance(user, -total_bet, f"slots_bet_{count}x{bet}", save=False)
-
-        results = []
-        total_win = 0
-
-        for _ in range(count):
-            machine = simulate_spin()
-            machine, win, strikes = check_win(machine, bet)
-
-            if win > 0:
-                total_win += win
-                results.append({
-                    "machine": machine,
-                    "strikes": strikes,
-                    "win": win,
-                    "result": 1
-                })
-            else:
-                results.append({
-                    "machine": machine,
-                    "strikes": strikes,
-                    "win": 0,
-                    "result": 0
-                })
-
-        # Add total winnings
+        record_bets(user, 'slots', total_bet, count)
         if total_win > 0:
-            update_balance(user, total_win, f"slots_win_{count}x{bet}_payout_{total_win}")
-            history_entry = History(u_id=user, amount=total_win, cashout_time=timezone.now())
-            history_entry.save()
-        else:
-            user.save()
+            record_win(user, total_win)
+            History.objects.create(u_id=user, amount=total_win, cashout_time=timezone.now())
 
     return Response({
         "results": results,
@@ -104,6 +144,85 @@ def spin_api(request):
         "total_win": total_win
     })
 
+@extend_schema(
+    request=SpinBatchRequestSerializer,
+    responses=SpinBatchResponseSerializer,
+    description=(
+        f"Spin the slot machine up to {settings.SLOTS_BATCH_MAX_SPINS} times at once for autoplay. "
+        "The balance is charged and credited once and a summary is returned; with stream, the summary "
+        "is the first line of an NDJSON stream followed by one [left, middle, right, win] line per spin "
+        "(reel stops, see casino.slots.views.REELS)."
+    )
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def spin_batch_api(request):
+    try:
+        bet = int(request.data.get("bet"))
+        count = int(request.data.get("count"))
+    except (TypeError, ValueError):
+        return Response({"error": "Bet and count must be numbers."}, status=400)
+
+    if bet <= 0:
+        return Response({"error": "Invalid bet"}, status=400)
+
+    if count < 1 or count > settings.SLOTS_BATCH_MAX_SPINS:
+        return Response({"error": f"Count must be between 1 and {settings.SLOTS_BATCH_MAX_SPINS}"}, status=400)
+
+    stream = str(request.data.get("stream", "")).lower() in ("1", "true")
+
+    stops, multipliers = play_batch(count)
+    total_bet = bet * count
+    total_win = bet * sum(multipliers)
+    biggest_win = bet * max(multipliers)
+
+    changes = [(-total_bet, "slots_bet")]
+    if total_win > 0:
+        changes.append((total_win, "slots_win"))
+
+    with transaction.atomic():
+        user = request.user
+        if apply_balance(user, changes, game_ref=f"slots:batch:{count}x{bet}") is None:
+            return Response({
+                "spins": 0,
+                "bet": bet,
+                "total_bet": 0,
+                "total_win": 0,
+                "wins": 0,
+                "biggest_win": 0,
+                "balance": User.objects.values_list("balance", flat=True).get(pk=user.pk),
+                "error": "Insufficient balance"
+            })
+
+        record_bets(user, 'slots', total_bet, count)
+        if total_win > 0:
+            record_win(user, total_win, biggest=biggest_win)
+            History.objects.create(u_id=user, amount=total_win, cashout_time=timezone.now())
+
+    summary = {
+        "spins": count,
+        "bet": bet,
+        "total_bet": total_bet,
+        "total_win": total_win,
+        "wins": sum(1 for value in multipliers if value),
+        "biggest_win": biggest_win,
+        "balance": user.balance,
+    }
+    if not stream:
+        return Response(summary)
+    return StreamingHttpResponse(
+        stream_spins(summary, stops, multipliers, bet), content_type="application/x-ndjson"
+    )
+
+def stream_spins(summary, stops, multipliers, bet, chunk=500):
+    """NDJSON lines: the summary, then [left, middle, right, win] per spin, `chunk` spins per write"""
+    yield json.dumps(summary) + "\n"
+    for start in range(0, len(stops), chunk):
+        yield "".join(
+            f"[{left},{middle},{right},{bet * value}]\n"
+            for (left, middle, right), value in zip(stops[start:start + chunk], multipliers[start:start + chunk])
+        )
+
 @extend_schema(
     request=CoinflipRequestSerializer,
     responses=CoinflipResponseSerializer,
@@ -127,35 +246,83 @@ def coinflip_api(request):
     if usr_choice not in [0, 1]:
         return Response({"error": "Invalid choice"}, status=400)
 
-    with transaction.atomic():
-        user = User.objects.select_for_update().get(pk=request.user.pk)
+    flip_result = choice([0, 1])
+    if flip_result == usr_choice:
+        result = 1
+        win = bet * 2  # Return bet + win
+        changes = [(-bet, "coinflip_bet"), (win, "coinflip_win")]
+    else:
+        result = 0
+        win = 0
+        changes = [(-bet, "coinflip_bet")]
 
-        if bet > user.balance:
+    with transaction.atomic():
+        user = request.user
+        if apply_balance(user, changes, game_ref="coinflip:api") is None:
             return Response({
                 "result": 2,
-                "balance": user.balance,
+                "balance": User.objects.values_list("balance", flat=True).get(pk=user.pk),
                 "win": 0,
                 "flip_result": None
             })
 
-        # Deduct bet first (atomic)
-        update_balance(user, -bet, f"coinflip_api_bet_{bet}", save=False)
-
-        flip_result = choice([0, 1])
-        if flip_result == usr_choice:
-            win = bet * 2  # Return bet + win
-            update_balance(user, win, f"coinflip_api_win_{bet}")
-            result = 1
-            history_entry = History(u_id=user, amount=bet, cashout_time=timezone.now())
-            history_entry.save()
-        else:
-            result = 0
-            win = 0
-            user.save()
+        record_bets(user, 'coinflip', bet)
+        if result == 1:
+            record_win(user, bet)
+            History.objects.create(u_id=user, amount=bet, cashout_time=timezone.now())
 
     return Response({
         "result": result,
         "balance": user.balance,
         "win": win,
         "flip_result": flip_result
-    })
\ No newline at end of file
+    })
+
+@extend_schema(
+    parameters=[
+        OpenApiParameter("room", str, description="Roulette room (default: the first configured one)"),
+        OpenApiParameter("before", int, description="Only rounds with a lower round_number (the previous page's next)"),
+        OpenApiParameter("limit", int, description=f"Page size (1-{ROUNDS_MAX_PAGE_SIZE})"),
+    ],
+    responses=RouletteRoundsResponseSerializer,
+    description="Completed roulette rounds of a room, newest first. Keyset-paginated on round_number; supports If-None-Match."
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def roulette_rounds_api(request):
+    room = request.query_params.get("room", settings.ROULETTE_ROOMS[0])
+    if not re.fullmatch(ROOM_PATTERN, room):
+        return Response({"error": "Invalid room"}, status=400)
+
+    try:
+        before = request.query_params.get("before")
+        before = int(before) if before is not None else None
+        limit = int(request.query_params.get("limit", ROUNDS_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return Response({"error": "before and limit must be numbers."}, status=400)
+
+    if limit < 1 or limit > ROUNDS_MAX_PAGE_SIZE:
+        return Response({"error": f"Limit must be between 1 and {ROUNDS_MAX_PAGE_SIZE}"}, status=400)
+
+    results = get_results_page(room, before, limit)
+    next_before = results[-1]["round_number"] if len(results) == limit else None
+
+    # Completed rounds never change, so a page is identified by the rounds it spans
+    span = f"{results[0]['round_number']}-{results[-1]['round_number']}x{len(results)}" if results else "empty"
+    etag = f'"{room}:{before}:{limit}:{span}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    response = Response({"room": room, "results": results, "next": next_before})
+    response["ETag"] = etag
+    return response
+
+
+def metrics(request):
+    """Prometheus metrics of this process; scraped with METRICS_TOKEN as a bearer token"""
+    if not settings.METRICS_TOKEN:
+        return HttpResponseNotFound()
+    if not process_metrics.is_authorized(request.headers.get("Authorization")):
+        return HttpResponse(status=401, headers={"WWW-Authenticate": "Bearer"})
+    return HttpResponse(process_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
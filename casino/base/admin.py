@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.contenttypes.models import ContentType
 from auditlog.models import LogEntry
-from .models import Codes, UsedCodes, History
+from .models import BalanceTransaction, Codes, UsedCodes, History, UserStats
 
 
 @admin.register(Codes)
@@ -59,3 +59,31 @@ class HistoryAdmin(admin.ModelAdmin):
                 object_id=object_id
             ).order_by('-timestamp')[:20]
         return super().changeform_view(request, object_id, form_url, extra_context)
+
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'total_wagered', 'total_won', 'biggest_win',
+                    'roulette_bets', 'slots_bets', 'coinflip_bets', 'backfilled']
+    list_filter = ['backfilled']
+    search_fields = ['user__username']
+    raw_id_fields = ['user']
+
+
+@admin.register(BalanceTransaction)
+class BalanceTransactionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'delta', 'balance_after', 'reason', 'game_ref', 'created_at']
+    list_filter = ['reason']
+    search_fields = ['user__username', 'game_ref']
+    date_hierarchy = 'created_at'
+    raw_id_fields = ['user']
+
+    # The ledger is append-only; corrections go through the user's balance
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
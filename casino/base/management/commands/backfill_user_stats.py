@@ -0,0 +1,86 @@
+"""
+Add activity from before incremental tracking to the per-user stats.
+
+Users are walked in primary-key order, --chunk-size at a time (keyset, no
+OFFSET). For each chunk the History and roulette Bet rows older than each
+user's stats row (tracked_since) are aggregated in the database, added to
+the row, and the row is marked backfilled. Finished users are skipped, so
+the command can be interrupted and run again.
+
+Slots and coinflip stakes were never stored, so for those games only the
+wins (History) are backfilled.
+
+Run with: python manage.py backfill_user_stats --chunk-size 1000
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from casino.base.models import History, UserStats
+from casino.login.models import User
+from casino.roulette.models import Bet
+from casino.utils.user_stats import ensure_stats
+
+BACKFILLED_FIELDS = ['total_wagered', 'total_won', 'biggest_win', 'roulette_bets', 'backfilled']
+
+
+class Command(BaseCommand):
+    help = 'Backfills per-user stats from existing History and roulette Bet rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Users processed per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        backfilled = 0
+        while True:
+            user_ids = list(
+                User.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:chunk_size]
+            )
+            if not user_ids:
+                break
+            backfilled += self.backfill(user_ids)
+            last_pk = user_ids[-1]
+            self.stdout.write(f'  users up to #{last_pk}: {backfilled} backfilled')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled stats of {backfilled} users'))
+
+    def backfill(self, user_ids):
+        """Backfill one chunk of users in one transaction; returns how many were not done yet"""
+        with transaction.atomic():
+            ensure_stats(user_ids)
+            stats = {
+                row.user_id: row
+                for row in UserStats.objects.select_for_update().filter(user_id__in=user_ids, backfilled=False)
+            }
+            if not stats:
+                return 0
+
+            wins = (
+                History.objects
+                .filter(u_id__in=list(stats), cashout_time__lt=F('u_id__stats__tracked_since'))
+                .values('u_id').annotate(total=Sum('amount'), biggest=Max('amount'))
+            )
+            for row in wins:
+                user_stats = stats[row['u_id']]
+                user_stats.total_won += row['total']
+                user_stats.biggest_win = max(user_stats.biggest_win, row['biggest'])
+
+            bets = (
+                Bet.objects
+                .filter(user_id__in=list(stats), placed_at__lt=F('user__stats__tracked_since'))
+                .exclude(round__status='REFUNDED')
+                .values('user_id').annotate(wagered=Sum('amount'), count=Count('pk'))
+            )
+            for row in bets:
+                user_stats = stats[row['user_id']]
+                user_stats.total_wagered += row['wagered']
+                user_stats.roulette_bets += row['count']
+
+            for user_stats in stats.values():
+                user_stats.backfilled = True
+            UserStats.objects.bulk_update(stats.values(), BACKFILLED_FIELDS)
+        return len(stats)
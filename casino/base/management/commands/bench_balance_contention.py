@@ -0,0 +1,127 @@
+"""
+Benchmark concurrent slot spins on one account.
+
+Every thread spins the slot machine against the same user, so all of them
+contend for a single balance row. Compares the previous read-modify-write
+(SELECT ... FOR UPDATE, compute in Python, write the balance back) with the
+balance service's single conditional UPDATE ... RETURNING, and checks that
+the final balance matches the ledger (no lost updates). Runs on a throwaway
+test database; contention is only meaningful on PostgreSQL.
+
+Run with: python manage.py bench_balance_contention --threads 16 --spins 200
+"""
+
+import statistics
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from casino.base.models import BalanceTransaction
+from casino.login.models import User
+from casino.slots.outcomes import spin
+from casino.utils.balance_tracker import apply_balance
+from casino.utils.bench import benchmark_database
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks locked versus conditional balance updates under contention on one account'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Concurrent spinners on the same account')
+        parser.add_argument('--spins', type=int, default=200,
+                            help='Spins per thread')
+        parser.add_argument('--bet', type=int, default=10)
+        parser.add_argument('--balance', type=int, default=10 ** 9,
+                            help='Starting balance of the account')
+        parser.add_argument('--mode', choices=['both', 'locked', 'conditional'], default='both')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and options['threads'] > 1:
+            raise CommandError('SQLite locks the whole database; use PostgreSQL or --threads 1')
+
+        modes = ['locked', 'conditional'] if options['mode'] == 'both' else [options['mode']]
+        with benchmark_database():
+            self.stdout.write(
+                f'{"mode":>12} {"spins/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8} '
+                f'{"rejected":>9} {"errors":>7} {"consistent":>11}'
+            )
+            for mode in modes:
+                user = User.objects.create(username=f'bench_{mode}', balance=options['balance'])
+                spin = self.spin_locked if mode == 'locked' else self.spin_conditional
+                stats = self.run(spin, user, options)
+
+                user.refresh_from_db()
+                ledger = BalanceTransaction.objects.filter(user=user).aggregate(total=Sum('delta'))['total'] or 0
+                latencies = sorted(stats['latencies']) or [float('nan')]
+                self.stdout.write(
+                    f'{mode:>12} {len(stats["latencies"]) / stats["elapsed"]:>9.0f} '
+                    f'{statistics.median(latencies):>8.2f} '
+                    f'{latencies[int(len(latencies) * 0.99)] if len(latencies) > 1 else latencies[0]:>8.2f} '
+                    f'{latencies[-1]:>8.2f} {stats["rejected"]:>9} {stats["errors"]:>7} '
+                    f'{str(user.balance == options["balance"] + ledger):>11}'
+                )
+
+    def run(self, spin, user, options):
+        """Spin from every thread at once; returns latencies (ms), rejections, errors and wall time"""
+        stats = {'latencies': [], 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        start_line = threading.Barrier(options['threads'])
+
+        def worker():
+            latencies, rejected, errors = [], 0, 0
+            start_line.wait()
+            try:
+                for _ in range(options['spins']):
+                    start = time.perf_counter()
+                    try:
+                        if not spin(user.pk, options['bet']):
+                            rejected += 1
+                    except Exception:
+                        errors += 1
+                    latencies.append((time.perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+            with lock:
+                stats['latencies'] += latencies
+                stats['rejected'] += rejected
+                stats['errors'] += errors
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats['elapsed'] = time.perf_counter() - start
+        return stats
+
+    @staticmethod
+    def play(bet):
+        _, win, _ = spin(bet)
+        return win
+
+    def spin_locked(self, user_id, bet):
+        """The previous spin_api: lock the row, check and compute in Python, write the balance back"""
+        with transaction.atomic():
+            user = User.objects.select_for_update().get(pk=user_id)
+            if bet > user.balance:
+                return False
+            user.balance -= bet
+            BalanceTransaction.objects.create(user_id=user_id, delta=-bet, balance_after=user.balance,
+                                              reason='slots_bet', game_ref='bench')
+            win = self.play(bet)
+            if win:
+                user.balance += win
+                BalanceTransaction.objects.create(user_id=user_id, delta=win, balance_after=user.balance,
+                                                  reason='slots_win', game_ref='bench')
+            User.objects.filter(pk=user_id).update(balance=user.balance)
+            return True
+
+    def spin_conditional(self, user_id, bet):
+        """The balance service: play first, then one conditional UPDATE ... RETURNING"""
+        win = self.play(bet)
+        changes = [(-bet, 'slots_bet')] + ([(win, 'slots_win')] if win else [])
+        with transaction.atomic():
+            return apply_balance(User(pk=user_id, username='bench'), changes, game_ref='bench') is not None
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.10 on 2026-10-18 02:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_alter_codes_value_alter_history_amount'),
+        ('login', '0004_alter_user_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_wagered', models.BigIntegerField(default=0)),
+                ('total_won', models.BigIntegerField(default=0)),
+                ('biggest_win', models.BigIntegerField(default=0)),
+                ('roulette_bets', models.BigIntegerField(default=0)),
+                ('slots_bets', models.BigIntegerField(default=0)),
+                ('coinflip_bets', models.BigIntegerField(default=0)),
+                ('tracked_since', models.DateTimeField(auto_now_add=True)),
+                ('backfilled', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
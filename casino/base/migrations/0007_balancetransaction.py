@@ -0,0 +1,32 @@
+# Generated by Django 5.2.10 on 2026-10-18 02:22
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_userstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceTransaction',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('delta', models.BigIntegerField()),
+                ('balance_after', models.BigIntegerField()),
+                ('reason', models.CharField(choices=[('slots_bet', 'Slots bet'), ('slots_win', 'Slots win'), ('coinflip_bet', 'Coinflip bet'), ('coinflip_win', 'Coinflip win'), ('coinflip_loss', 'Coinflip loss'), ('roulette_bet', 'Roulette bet'), ('roulette_win', 'Roulette win'), ('roulette_refund', 'Roulette refund'), ('mining_payout', 'Mining payout'), ('debug_button', 'Debug button'), ('admin_adjustment', 'Admin adjustment')], max_length=20)),
+                ('game_ref', models.CharField(blank=True, default='', max_length=64)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_transactions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-id'], name='balance_tx_statement_idx')],
+            },
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from casino.login.models import User
 from auditlog.registry import auditlog
 
@@ -20,6 +21,57 @@ class History(models.Model):
     amount = models.BigIntegerField()
     cashout_time = models.DateTimeField()
 
+class UserStats(models.Model):
+    """Per-user totals kept up to date with every bet and win (see casino.utils.user_stats)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_wagered = models.BigIntegerField(default=0)
+    total_won = models.BigIntegerField(default=0)
+    biggest_win = models.BigIntegerField(default=0)
+    roulette_bets = models.BigIntegerField(default=0)
+    slots_bets = models.BigIntegerField(default=0)
+    coinflip_bets = models.BigIntegerField(default=0)
+    # Activity before this moment is added by the backfill_user_stats command
+    tracked_since = models.DateTimeField(auto_now_add=True)
+    backfilled = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Stats of {self.user_id}: wagered {self.total_wagered}, won {self.total_won}"
+
+
+class BalanceTransaction(models.Model):
+    """
+    One change of a user's balance (append-only, see casino.utils.balance_tracker).
+    Summing delta over a user's rows gives their balance since the ledger started.
+    """
+    REASON_CHOICES = [
+        ('slots_bet', 'Slots bet'),
+        ('slots_win', 'Slots win'),
+        ('coinflip_bet', 'Coinflip bet'),
+        ('coinflip_win', 'Coinflip win'),
+        ('coinflip_loss', 'Coinflip loss'),
+        ('roulette_bet', 'Roulette bet'),
+        ('roulette_win', 'Roulette win'),
+        ('roulette_refund', 'Roulette refund'),
+        ('mining_payout', 'Mining payout'),
+        ('debug_button', 'Debug button'),
+        ('admin_adjustment', 'Admin adjustment'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_transactions')
+    delta = models.BigIntegerField()
+    balance_after = models.BigIntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    # What the change belongs to, e.g. 'roulette:table-1:42' or 'slots:3x10'
+    game_ref = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-id'], name='balance_tx_statement_idx')]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.delta:+} ({self.reason}) -> {self.balance_after}"
+
 
 auditlog.register(Codes)
 auditlog.register(UsedCodes)
@@ -2,8 +2,8 @@ from secrets import choice
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render
 from django.db import transaction
-from casino.login.models import User
 from casino.utils.balance_tracker import update_balance
+from casino.utils.user_stats import record_bets, record_win
 
 
 @login_required(login_url='/login/')
@@ -23,21 +23,21 @@ def coinflip(request):
             request.session["bet"] = quantity
             request.session["choice"] = usr_choice
 
-            # Use transaction with row-level locking to prevent race conditions
-            with transaction.atomic():
-                # Lock the user row for update
-                locked_user = User.objects.select_for_update().get(pk=user.pk)
+            rand = choice([0, 1])
+            # A win or a loss of the stake, applied only if the balance covers the stake
+            if rand == usr_choice:
+                change = (quantity, "coinflip_win")
+            else:
+                change = (-quantity, "coinflip_loss")
 
-                if quantity > locked_user.balance or locked_user.balance <= 0:
+            with transaction.atomic():
+                if quantity <= 0 or update_balance(user, *change, game_ref="coinflip:web", required=quantity) is None:
                     result = 2
-                if result != 2:
-                    rand = choice([0, 1])
-                    if rand == usr_choice:
-                        result = 1
-                        update_balance(locked_user, quantity, f"coinflip_win_{quantity}")
-                    else:
-                        result = 0
-                        update_balance(locked_user, -quantity, f"coinflip_loss_{quantity}")
+                else:
+                    result = 1 if rand == usr_choice else 0
+                    record_bets(user, 'coinflip', quantity)
+                    if result == 1:
+                        record_win(user, quantity)
 
             # Refresh user to get updated balance after transaction
             user.refresh_from_db()
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from auditlog.admin import LogEntryAdmin
 from auditlog.models import LogEntry
+from django.db import transaction
+from casino.utils.balance_tracker import update_balance
 from .models import User
 
 
@@ -11,6 +13,29 @@ class UserAdmin(admin.ModelAdmin):
     search_fields = ['username']
     readonly_fields = ['last_login']
 
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_dbfield(db_field, request, **kwargs)
+        if db_field.name == 'balance':
+            # Post back the balance the form showed, so changed_data means the admin edited it
+            formfield.show_hidden_initial = True
+        return formfield
+
+    def save_model(self, request, obj, form, change):
+        """Record a balance edit as an adjustment in the balance ledger, not the audit log"""
+        if not change:
+            return super().save_model(request, obj, form, change)
+
+        new_balance = obj.balance
+        with transaction.atomic():
+            # Keep bets and wins that landed while the form was open; an edit is
+            # relative to the balance at save time, not the one the form showed
+            obj.balance = User.objects.select_for_update().values_list('balance', flat=True).get(pk=obj.pk)
+            super().save_model(request, obj, form, change)
+            if 'balance' in form.changed_data and new_balance != obj.balance:
+                # required=0: an admin may set any balance, including a negative one
+                update_balance(obj, new_balance - obj.balance, 'admin_adjustment', actor=request.user,
+                               game_ref=f'admin:{request.user.username}', required=0)
+
     def get_queryset(self, request):
         """Optimize queries."""
         qs = super().get_queryset(request)
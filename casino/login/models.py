@@ -39,4 +39,5 @@ class User(AbstractBaseUser):
         return self.is_staff
 
 
-auditlog.register(User)
+# Balance changes go to casino.base.models.BalanceTransaction, not the audit log
+auditlog.register(User, exclude_fields=['balance'])
@@ -1,13 +1,13 @@
 from django.contrib import admin
 from django.contrib.contenttypes.models import ContentType
 from auditlog.models import LogEntry
-from .models import GameRound, Bet
+from .models import GameRound, Bet, WorkerLease
 
 
 @admin.register(GameRound)
 class GameRoundAdmin(admin.ModelAdmin):
-    list_display = ['round_number', 'status', 'winning_color', 'winning_slot', 'created_at']
-    list_filter = ['status', 'winning_color', 'created_at']
+    list_display = ['round_number', 'room', 'status', 'winning_color', 'winning_slot', 'created_at']
+    list_filter = ['room', 'status', 'winning_color', 'created_at']
     search_fields = ['round_number']
     readonly_fields = ['created_at', 'spin_time']
     date_hierarchy = 'created_at'
@@ -43,3 +43,9 @@ class BetAdmin(admin.ModelAdmin):
                 object_id=object_id
             ).order_by('-timestamp')[:20]
         return super().changeform_view(request, object_id, form_url, extra_context)
+
+
+@admin.register(WorkerLease)
+class WorkerLeaseAdmin(admin.ModelAdmin):
+    list_display = ['name', 'holder', 'acquired_at', 'renewed_at', 'expires_at', 'takeover_latency']
+    readonly_fields = ['acquired_at', 'renewed_at', 'takeover_latency']
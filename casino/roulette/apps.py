@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RuletteConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'casino.roulette'
+
+    def ready(self):
+        """Connect the session cache's revocation signal handlers"""
+        import casino.utils.session_cache  # noqa: F401
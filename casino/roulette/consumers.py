@@ -4,12 +4,31 @@ Handles player connections, bet placement, and round updates.
 """
 
 import json
+import time
+from datetime import timedelta
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
 from django.utils import timezone
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .engine import BET_EVENTS_CHANNEL, user_group_name
+from .ledger import INSUFFICIENT_FUNDS, ROUND_CLOSED, get_ledger, ledger_enabled
 from .models import GameRound, Bet
+from .outbound import OutboundQueue
+from .protocol import select_codec
+from .rooms import aget_active_rooms, assign_room, connection_closed, connection_opened, room_group_name
+from .results import get_results_page
+from .snapshot import HISTORY_SIZE, TOP_BETS, load_snapshot, invalidate_local_copy, round_state_message
 from casino.utils.balance_tracker import update_balance
+from casino.utils.metrics import counter, gauge, measured_database_sync_to_async as database_sync_to_async
+from casino.utils.session_cache import is_session_valid
+from casino.utils.user_stats import record_bets
+
+# Client message types; anything else is counted as 'unknown' to keep label values bounded
+CLIENT_MESSAGES = frozenset({'place_bet', 'get_state', 'get_bets', 'ack'})
+
+SOCKETS_CONNECTED = gauge('roulette_sockets_connected', 'Open roulette WebSockets in this process')
+MESSAGES_IN = counter('roulette_messages_in_total', 'Messages received from clients', labels=('type',))
 
 
 class RouletteConsumer(AsyncWebsocketConsumer):
@@ -18,65 +37,108 @@ class RouletteConsumer(AsyncWebsocketConsumer):
 
     Message Types Sent to Client:
         - round_state: Current game round info (on connect + round changes)
-        - bet_placed: Notification when any player places a bet
+        - bets_delta: Bets placed since the last frame plus per-color totals
         - round_spinning: Round entering spin phase (2s before result)
-        - round_result: Winning color and payouts
+        - round_result: Winning color (one shared frame for the whole room)
+        - round_payout: The user's payout and balance (bettors only)
+        - round_bets: One page of a round's bets (answer to get_bets)
+        - slow_consumer: The socket is being closed for not keeping up;
+          reconnect after retry_after seconds (get_state resyncs)
         - balance_update: User's balance changed
         - error: Error message
 
     Message Types Received from Client:
         - place_bet: Player wants to place a bet
         - get_state: Request current game state
+        - get_bets: Request a page of a round's bets
+        - ack: Number of frames received so far (outbound flow control)
+
+    Messages are JSON objects unless the client offers the compact
+    subprotocol (see protocol.py). Outgoing frames pass through a
+    flow-controlled queue (see outbound.py).
     """
 
+    # Close code telling the client its room is gone and it should reload
+    ROOM_CLOSED = 4004
+    # Close code for sockets that fell too far behind, and the advised reconnect delay
+    SLOW_CONSUMER = 4008
+    SLOW_RETRY_AFTER = 5
+
+    BETS_PAGE_SIZE = 100
+
     async def connect(self):
-        """Handle new WebSocket connection"""
-        self.room_group_name = 'roulette_game'
+        """Handle new WebSocket connection to ws/roulette/[<room>/]"""
+        self.room = None
+        self.outbound = OutboundQueue(self.send_text)
+        self.closing_slow = False
 
         if not self.scope['user'].is_authenticated:
             await self.close()
             return
 
+        rooms = await aget_active_rooms()
+        room = self.scope.get('url_route', {}).get('kwargs', {}).get('room')
+        if room is None:
+            room = assign_room(self.scope['user'].pk, rooms)
+        elif room not in rooms:
+            await self.close(code=self.ROOM_CLOSED)
+            return
+
+        self.room = room
+        self.room_group_name = room_group_name(room)
+        self.user_group_name = user_group_name(self.room_group_name, self.scope['user'].pk)
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        await self.channel_layer.group_add(
+            self.user_group_name,
+            self.channel_name
+        )
 
-        await self.accept()
-
-        current_round = await self.get_current_round()
-        history = await self.get_history()
+        self.codec = select_codec(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=self.codec.subprotocol)
+        SOCKETS_CONNECTED.inc()
+        await connection_opened(room)
 
-        if current_round:
-            await self.send(text_data=json.dumps({
-                'type': 'round_state',
-                'round_number': current_round['round_number'],
-                'status': current_round['status'],
-                'time_remaining': current_round['time_remaining'],
-                'total_bets': current_round['total_bets'],
-                'history': history,
-                'bets': current_round['bets'],
-            }))
+        await self.send_round_state()
 
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
+        if self.room is None:
+            return
+
+        SOCKETS_CONNECTED.dec()
+        await connection_closed(self.room)
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        await self.channel_layer.group_discard(
+            self.user_group_name,
+            self.channel_name
+        )
 
     async def receive(self, text_data):
         """
         Handle messages from WebSocket client
         """
         try:
-            data = json.loads(text_data)
+            data = self.codec.decode(text_data)
             message_type = data.get('type')
+            MESSAGES_IN.inc(type=message_type if isinstance(message_type, str) and message_type in CLIENT_MESSAGES
+                            else 'unknown')
 
             if message_type == 'place_bet':
                 await self.handle_place_bet(data)
             elif message_type == 'get_state':
                 await self.handle_get_state()
+            elif message_type == 'get_bets':
+                await self.handle_get_bets(data)
+            elif message_type == 'ack':
+                if not await self.outbound.ack(data.get('seq')):
+                    await self.close_slow()
             else:
                 await self.send_error('Unknown message type')
 
@@ -103,7 +165,7 @@ class RouletteConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
-        color = data.get('color', '').upper()
+        color = (data.get('color') or '').upper()
         amount = data.get('amount')
 
         if color not in ['GRAY', 'RED', 'BLUE', 'GOLD']:
@@ -112,97 +174,174 @@ class RouletteConsumer(AsyncWebsocketConsumer):
 
         try:
             amount = float(amount)
-            if amount <= 0:
+            if not amount > 0:
                 raise ValueError()
-        except (TypeError, ValueError):
+            whole = int(amount)
+        except (TypeError, ValueError, OverflowError):
             await self.send_error('Invalid bet amount')
             return
 
-        result = await self.place_bet(user, color, amount)
+        # Balances and stakes are whole numbers; fractions would debit something other than the stored bet
+        if whole != amount:
+            await self.send_error('Bet amount must be a whole number')
+            return
+        amount = whole
+
+        if ledger_enabled():
+            # Reservations are checked against the balance, so read it fresh
+            user = await self.get_active_user(user.pk)
+            if user is None:
+                await self.send_error('Account is disabled')
+                return
+            result = await self.reserve_bet(user, color, amount)
+        else:
+            result = await self.place_bet(user, color, amount)
 
         if result['success']:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'bet_placed_broadcast',
-                    'username': user.username,
-                    'color': color,
-                    'amount': amount,
-                    'round_number': result['round_number'],
-                }
-            )
+            await self.report_bet(user.username, color, amount, result['round_number'])
 
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'balance_update',
                 'balance': result['new_balance'],
-            }))
+            })
         else:
             await self.send_error(result['error'])
 
     async def handle_get_state(self):
         """Send current game state to requesting client"""
+        await self.send_round_state()
+
+    async def handle_get_bets(self, data):
+        """
+        Send one page of a round's bets, in placement order.
+
+        Expected data format:
+        {
+            'type': 'get_bets',
+            'round_number': 42,
+            'after': null        # 'next' of the previous page
+        }
+
+        Read from the database, so with the ledger intake a round's bets
+        are listed once it has spun.
+        """
+        round_number = data.get('round_number')
+        after = data.get('after') or 0
+        if not isinstance(round_number, int) or not isinstance(after, int):
+            await self.send_error('Invalid bets page')
+            return
+
+        bets, next_after = await self.get_bets_page(round_number, after)
+        await self.send_message({
+            'type': 'round_bets',
+            'round_number': round_number,
+            'bets': bets,
+            'next': next_after,
+        })
+
+    async def send_round_state(self):
+        """
+        Send round_state built from the game loop's snapshot.
+        Falls back to the database until the loop has published one.
+        """
+        snapshot = await load_snapshot(self.room)
+        if snapshot is not None:
+            if snapshot['status'] in ('BETTING', 'SPINNING'):
+                await self.send_message(round_state_message(snapshot))
+            return
+
         current_round = await self.get_current_round()
         history = await self.get_history()
 
         if current_round:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'round_state',
                 'round_number': current_round['round_number'],
                 'status': current_round['status'],
                 'time_remaining': current_round['time_remaining'],
                 'total_bets': current_round['total_bets'],
+                'totals': current_round['totals'],
                 'history': history,
                 'bets': current_round['bets'],
-            }))
-
-    # Channel layer broadcast handlers
-    async def bet_placed_broadcast(self, event):
-        """Forward bet_placed event to WebSocket"""
-        await self.send(text_data=json.dumps({
-            'type': 'bet_placed',
-            'username': event['username'],
-            'color': event['color'],
-            'amount': event['amount'],
-            'round_number': event['round_number'],
-        }))
+                'betting_ends_at': current_round['betting_ends_at'],
+                'spin_ends_at': current_round['spin_ends_at'],
+                'counts': current_round['counts'],
+                'liability': current_round['liability'],
+            })
+
+    async def report_bet(self, username, color, amount, round_number):
+        """
+        Tell the game loop about an accepted bet; it updates the snapshot and
+        includes the bet in the room's next bets_delta frame.
+        """
+        try:
+            await self.channel_layer.send(BET_EVENTS_CHANNEL, {
+                'type': 'roulette.bet',
+                'room': self.room,
+                'username': username,
+                'color': color,
+                'amount': amount,
+                'round_number': round_number,
+            })
+        except ChannelFull:
+            # The bet itself is stored; only the live feed misses it
+            pass
+
+    # Channel layer broadcast handlers: the producer serialized the frame once
+    async def bets_delta_broadcast(self, event):
+        """Forward bets_delta frame to WebSocket"""
+        await self.send_frame(event)
 
     async def round_starting_broadcast(self, event):
-        """Forward round_starting event to WebSocket"""
-        await self.send(text_data=json.dumps({
-            'type': 'round_starting',
-            'round_number': event['round_number'],
-            'time_remaining': event['time_remaining'],
-        }))
+        """Forward round_starting frame to WebSocket"""
+        invalidate_local_copy(self.room)
+        await self.send_frame(event)
 
     async def round_spinning_broadcast(self, event):
-        """Forward round_spinning event to WebSocket"""
-        await self.send(text_data=json.dumps({
-            'type': 'round_spinning',
-            'round_number': event['round_number'],
-            'winning_color': event['winning_color'],
-            'winning_slot': event['winning_slot'],
-        }))
+        """Forward round_spinning frame to WebSocket"""
+        invalidate_local_copy(self.room)
+        await self.send_frame(event)
 
     async def round_result_broadcast(self, event):
-        """Forward round_result event to WebSocket"""
-        user = self.scope['user']
-        user_payout = await self.get_user_payout(user, event['round_number'])
-
-        await self.send(text_data=json.dumps({
-            'type': 'round_result',
-            'round_number': event['round_number'],
-            'winning_color': event['winning_color'],
-            'winning_slot': event['winning_slot'],
-            'your_payout': user_payout['total_payout'],
-            'your_balance': user_payout['new_balance'],
-        }))
+        """Forward round_result frame to WebSocket"""
+        invalidate_local_copy(self.room)
+        await self.send_frame(event)
+
+    async def round_payout_broadcast(self, event):
+        """Forward this user's round_payout frame to WebSocket"""
+        await self.send_frame(event)
+
+    async def send_message(self, message):
+        """Encode a message for this socket's codec and send it"""
+        await self.push(message['type'], self.codec.encode(message))
+
+    async def send_frame(self, event):
+        """Send the copy of a broadcast the producer encoded for this socket's codec"""
+        await self.push(event['type'].removesuffix('_broadcast'), event['frames'][self.codec.name])
+
+    async def push(self, frame_type, text):
+        """Hand a frame to the outbound queue; close the socket if it cannot keep up"""
+        if not await self.outbound.push(frame_type, text):
+            await self.close_slow()
+
+    async def send_text(self, text):
+        await self.send(text_data=text)
+
+    async def close_slow(self):
+        """Close a slow socket once, telling the client when to come back"""
+        if self.closing_slow:
+            return
+        self.closing_slow = True
+        # Past the queue: it is this socket's last frame
+        await self.send_text(self.codec.encode({'type': 'slow_consumer', 'retry_after': self.SLOW_RETRY_AFTER}))
+        await self.close(code=self.SLOW_CONSUMER)
 
     async def send_error(self, message):
         """Send error message to client"""
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'error',
             'message': message,
-        }))
+        })
 
     BETTING_TIME = 15
 
@@ -211,47 +350,47 @@ class RouletteConsumer(AsyncWebsocketConsumer):
         """
         Re-verify user authentication by checking session validity.
         Returns the user if still authenticated, None otherwise.
-        """
-        from django.contrib.sessions.models import Session
-        from casino.login.models import User
 
-        # Get session key from scope
+        Validity comes from the session cache, which logout and session
+        deletion revoke, so this is normally a single cache lookup.
+        """
         session = self.scope.get('session')
-        if not session or not session.session_key:
+        user = self.scope.get('user')
+        if not session or not user or not user.is_authenticated:
             return None
 
-        try:
-            # Check if session still exists in database
-            Session.objects.get(session_key=session.session_key)
-
-            # Refresh user from database
-            user = self.scope.get('user')
-            if user and user.is_authenticated:
-                return User.objects.get(pk=user.pk, is_active=True)
-        except (Session.DoesNotExist, User.DoesNotExist):
+        if not is_session_valid(session.session_key):
             return None
+        return user
+
+    @database_sync_to_async
+    def get_active_user(self, user_id):
+        """Fresh copy of an active user (current balance), or None"""
+        from casino.login.models import User
 
-        return None
+        return User.objects.filter(pk=user_id, is_active=True).first()
 
     @database_sync_to_async
     def get_current_round(self):
         """Get the current active game round"""
         try:
             round_obj = GameRound.objects.filter(
+                room=self.room,
                 status__in=['BETTING', 'SPINNING']
             ).order_by('-round_number').first()
 
             if not round_obj:
                 return None
 
-            now = timezone.now()
-            elapsed = (now - round_obj.created_at).total_seconds()
-            time_remaining = max(0, self.BETTING_TIME - elapsed)
-
-            total_bets = round_obj.bets.count()
+            # Rounds from before scheduled deadlines only know their start
+            betting_ends_at = round_obj.betting_ends_at or (
+                round_obj.created_at + timedelta(seconds=self.BETTING_TIME)
+            )
+            time_remaining = max(0, (betting_ends_at - timezone.now()).total_seconds())
 
+            # Running aggregates plus the largest bets; the rest is paged with get_bets
             bets = []
-            for bet in round_obj.bets.select_related('user').all():
+            for bet in round_obj.bets.select_related('user').order_by('-amount', 'id')[:TOP_BETS]:
                 bets.append({
                     'username': bet.user.username,
                     'color': bet.color,
@@ -262,8 +401,10 @@ class RouletteConsumer(AsyncWebsocketConsumer):
                 'round_number': round_obj.round_number,
                 'status': round_obj.status,
                 'time_remaining': time_remaining,
-                'total_bets': total_bets,
+                **round_obj.aggregates(),
                 'bets': bets,
+                'betting_ends_at': betting_ends_at.timestamp(),
+                'spin_ends_at': round_obj.spin_ends_at and round_obj.spin_ends_at.timestamp(),
             }
         except Exception:
             return None
@@ -273,84 +414,107 @@ class RouletteConsumer(AsyncWebsocketConsumer):
         """
         Place a bet for a user on the current round
 
+        The round row is never written: the balance is debited with a
+        conditional UPDATE, and the round is only share-locked by the final
+        check that it is still BETTING, so bets do not queue behind each
+        other. A bet that loses the race against a spin or refund is rolled
+        back; the round's color counters are stored when betting closes.
+
         Returns dict with 'success' boolean and additional data
         """
         try:
-            # Use transaction with row-level locking to prevent race conditions
             with transaction.atomic():
-                # Lock the user row for update to prevent concurrent balance modifications
-                from casino.login.models import User
-                user = User.objects.select_for_update().get(pk=user.pk)
-
-                round_obj = GameRound.objects.filter(status='BETTING').order_by('-round_number').first()
+                round_obj = GameRound.objects.filter(
+                    room=self.room, status='BETTING'
+                ).order_by('-round_number').only('id', 'room', 'round_number').first()
 
                 if not round_obj:
                     return {'success': False, 'error': 'No active betting round'}
 
-                if user.balance < amount:
+                new_balance = update_balance(user, -amount, "roulette_bet",
+                                             game_ref=f"{round_obj.balance_ref}:{color}", active_only=True)
+                if new_balance is None:
+                    from casino.login.models import User
+                    if not User.objects.filter(pk=user.pk, is_active=True).exists():
+                        return {'success': False, 'error': 'Account is disabled'}
                     return {'success': False, 'error': 'Insufficient balance'}
 
-                existing_bet = Bet.objects.filter(
-                    user=user,
-                    round=round_obj,
-                    color=color
-                ).first()
-
-                update_balance(
-                    user,
-                    -amount,
-                    f"roulette_bet_round_{round_obj.round_number}_{color}"
-                )
-
-                if existing_bet:
-                    existing_bet.amount += amount
-                    existing_bet.save()
-                else:
-                    Bet.objects.create(
-                        user=user,
-                        round=round_obj,
-                        color=color,
-                        amount=amount,
-                    )
+                created = False
+                bets = Bet.objects.filter(user_id=user.pk, round=round_obj, color=color)
+                if not bets.update(amount=F('amount') + amount):
+                    try:
+                        with transaction.atomic():
+                            Bet.objects.create(
+                                user_id=user.pk,
+                                round=round_obj,
+                                color=color,
+                                amount=amount,
+                            )
+                        created = True
+                    except IntegrityError:
+                        # Another bet of this user on this color created the row meanwhile
+                        bets.update(amount=F('amount') + amount)
+                # Stats count Bet rows, as refunds and ledger flushes do: a merged bet adds only its amount
+                record_bets(user, 'roulette', amount, count=int(created))
+
+                # Checked last; the share lock keeps advance() from closing betting until this commits
+                if not round_obj.accepts_bets():
+                    transaction.set_rollback(True)
+                    return {'success': False, 'error': 'No active betting round'}
 
                 return {
                     'success': True,
                     'round_number': round_obj.round_number,
-                    'new_balance': user.balance,
+                    'new_balance': new_balance,
                 }
 
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
-    @database_sync_to_async
-    def get_user_payout(self, user, round_number):
-        """Get user's total payout for a completed round"""
-        try:
-            round_obj = GameRound.objects.get(round_number=round_number)
-            user_bets = Bet.objects.filter(user=user, round=round_obj)
+    async def reserve_bet(self, user, color, amount):
+        """
+        Reserve a bet in the write-behind ledger (ROULETTE_BET_INTAKE = 'ledger').
+        The game loop writes it to the database when the round spins.
+        """
+        if amount != int(amount):
+            return {'success': False, 'error': 'Bet amount must be a whole number'}
 
-            total_payout = sum(bet.payout for bet in user_bets)
-            user.refresh_from_db()
+        snapshot = await load_snapshot(self.room)
+        if (snapshot is None or snapshot['status'] != 'BETTING'
+                or time.time() >= snapshot['betting_ends_at']):
+            return {'success': False, 'error': 'No active betting round'}
 
-            return {
-                'total_payout': total_payout,
-                'new_balance': user.balance,
-            }
-        except Exception:
-            return {
-                'total_payout': 0,
-                'new_balance': user.balance,
-            }
+        remaining = await get_ledger().reserve(
+            self.room, snapshot['round_number'],
+            user.pk, user.username, color, int(amount), user.balance,
+        )
+        if remaining == INSUFFICIENT_FUNDS:
+            return {'success': False, 'error': 'Insufficient balance'}
+        if remaining == ROUND_CLOSED:
+            return {'success': False, 'error': 'No active betting round'}
+
+        return {
+            'success': True,
+            'round_number': snapshot['round_number'],
+            'new_balance': remaining,
+        }
+
+    @database_sync_to_async
+    def get_bets_page(self, round_number, after):
+        """Bets of a round in this room with id > after; returns (bets, next after or None)"""
+        rows = list(
+            Bet.objects.filter(round__room=self.room, round__round_number=round_number, id__gt=after)
+            .order_by('id')
+            .values_list('id', 'user__username', 'color', 'amount')[:self.BETS_PAGE_SIZE + 1]
+        )
+        page = rows[:self.BETS_PAGE_SIZE]
+        bets = [{'username': username, 'color': color, 'amount': amount} for _, username, color, amount in page]
+        return bets, page[-1][0] if len(rows) > self.BETS_PAGE_SIZE else None
 
     @database_sync_to_async
     def get_history(self):
-        """Get last 10 completed rounds with winning colors"""
+        """Get last 10 completed rounds with winning colors (from the result buffer if published)"""
         try:
-            completed_rounds = GameRound.objects.filter(
-                status='COMPLETED',
-                winning_color__isnull=False
-            ).order_by('-round_number')[:10]
-
-            return [r.winning_color for r in completed_rounds]
+            return [result['winning_color'] for result in get_results_page(self.room, limit=HISTORY_SIZE)]
         except Exception:
             return []
@@ -0,0 +1,513 @@
+"""
+Asyncio roulette game engine.
+
+Each RouletteRoom runs the SCHEDULED -> BETTING -> SPINNING -> COMPLETED
+cycle for one room (table) and its channel-layer group. Rounds are pipelined:
+the next round is created with its deadlines during the current spin and
+opens the moment the spin ends, while the finished round settles in the
+background. Phase transitions are planned against absolute monotonic
+deadlines on a shared TimerWheel, so one process can host many rooms and no
+room drifts because of slow database writes or broadcasts.
+
+Every phase change is persisted through GameRound.advance together with the
+work it stands for. A room that starts, or recovers from an error, first
+closes the rounds left open: SPINNING rounds already have a drawn result and
+are settled, BETTING rounds never spun and their bets are refunded.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .game_logic import spin_wheel
+from .ledger import flush_entries, get_ledger, ledger_enabled
+from .models import GameRound
+from .protocol import encode_frames
+from .results import ResultBuffer, query_results
+from .rooms import publish_rooms, room_group_name, room_to_open
+from .settlement import refund_round, settle_round
+from .snapshot import RoundSnapshot, HISTORY_SIZE
+from casino.utils.metrics import counter, histogram, measured_database_sync_to_async
+
+# Consumers report accepted bets here so the loop can maintain its snapshots
+BET_EVENTS_CHANNEL = 'roulette.bets'
+
+PHASE_SECONDS = histogram(
+    'roulette_phase_seconds', 'Actual length of a round phase', labels=('phase',),
+    buckets=(1, 2, 3, 5, 10, 14, 15, 16, 20, 30),
+)
+TRANSITION_SECONDS = histogram(
+    'roulette_phase_transition_seconds', 'Work done when a phase starts (database writes, publish, broadcast)',
+    labels=('transition',),
+)
+SCHEDULE_DRIFT = histogram(
+    'roulette_schedule_drift_seconds', 'How late a phase started against its planned deadline',
+    labels=('transition',), buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+SETTLEMENT_SECONDS = histogram('roulette_settlement_seconds', 'Time to settle a round in the database')
+ROUND_BETS = histogram(
+    'roulette_round_bets', 'Bets settled per round', buckets=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000),
+)
+ROUND_PAYOUT = histogram(
+    'roulette_round_payout', 'Total paid out per round', buckets=(0, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7),
+)
+BROADCAST_SECONDS = histogram(
+    'roulette_broadcast_seconds', 'Time to hand a frame to the channel layer', labels=('type',),
+)
+ROUND_ERRORS = counter('roulette_round_errors_total', 'Rounds that failed and went through recovery')
+
+
+def user_group_name(room, user_id):
+    """Channel-layer group holding one user's sockets in a room"""
+    return f'{room}_user_{user_id}'
+
+
+def frame_event(message_type, data):
+    """
+    Channel-layer event carrying a client frame serialized once per codec
+    by the producer; consumers write event['frames'][codec] as is.
+    """
+    return {
+        'type': f'{message_type}_broadcast',
+        'frames': encode_frames({'type': message_type, **data}),
+    }
+
+
+def db_call(func):
+    """Run a blocking ORM function in the thread pool without serializing rooms"""
+    return measured_database_sync_to_async(func, thread_sensitive=False)
+
+
+class RouletteRoom:
+    """
+    Drives the rounds of one roulette room.
+
+    Args:
+        room: Room name; its broadcasts go to room_group_name(room)
+        wheel: TimerWheel shared by every room of the process
+        channel_layer: Channel layer used for broadcasts
+        stdout: Optional OutputWrapper (management command stdout)
+        style: Optional color style matching stdout
+    """
+
+    # Timing constants (in seconds)
+    BETTING_TIME = 15
+    SPIN_ANIMATION_TIME = 3
+    ERROR_BACKOFF = 1
+
+    def __init__(self, room, wheel, channel_layer, stdout=None, style=None):
+        self.room = room
+        self.group_name = room_group_name(room)
+        self.wheel = wheel
+        self.channel_layer = channel_layer
+        self.stdout = stdout
+        self.style = style
+        self.current_round_number = None
+        self.running = False
+        self.snapshot = RoundSnapshot(room)
+        self.results = ResultBuffer(room)
+        self.snapshot_dirty = False
+        self.pending_bets = []
+        self.bets_flush_interval = settings.ROULETTE_BETS_FLUSH_INTERVAL
+        # Round scheduled during the current spin, and the previous round's settlement task
+        self.next_round = None
+        self.settlement = None
+
+    def write(self, message, style_name=None):
+        if self.stdout is None:
+            return
+        if style_name and self.style is not None:
+            message = getattr(self.style, style_name)(message)
+        self.stdout.write(message)
+
+    async def prepare(self):
+        """Load the room's last round number and latest results from the database"""
+        last_round = await db_call(self.get_last_round)()
+        self.current_round_number = last_round.round_number + 1 if last_round else 1
+        self.results = ResultBuffer(self.room, await db_call(self.get_results)())
+        self.snapshot = RoundSnapshot(self.room, self.results.colors(HISTORY_SIZE))
+        self.snapshot_dirty = False
+        self.pending_bets = []
+
+    async def run(self):
+        """Run rounds back to back until stop() is called"""
+        self.running = True
+        await self.recover()
+        await self.prepare()
+        await self.results.publish()
+
+        round_start = self.wheel.now()
+        while self.running:
+            try:
+                round_start = await self.run_game_round(round_start)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.write(f'Error in game loop: {e}', 'ERROR')
+                ROUND_ERRORS.inc()
+                await asyncio.sleep(self.ERROR_BACKOFF)
+                await self.recover_after_error()
+                round_start = self.wheel.now()
+
+        try:
+            await self.finish_settlement()
+            if self.next_round is not None:
+                await db_call(self.next_round.delete)()
+                self.next_round = None
+        except Exception as e:
+            # Whatever is left open is recovered by the next start
+            self.write(f'Error in game loop: {e}', 'ERROR')
+
+    def stop(self):
+        self.running = False
+
+    async def run_game_round(self, round_start):
+        """
+        Execute a single game round starting at `round_start`.
+
+        Returns the monotonic time at which the next round starts, which is
+        the planned end of this round rather than the moment it finished.
+        The round is still settling in self.settlement when this returns.
+        """
+        betting_ends = round_start + self.BETTING_TIME
+        spin_ends = betting_ends + self.SPIN_ANIMATION_TIME
+
+        # Phase 1: Open the round scheduled during the previous spin (BETTING phase)
+        opened = self.wheel.now()
+        SCHEDULE_DRIFT.observe(max(0, opened - round_start), transition='open')
+        round_obj, self.next_round = self.next_round, None
+        if round_obj is None:
+            round_obj = await db_call(self.create_new_round)(round_start)
+            self.current_round_number += 1
+        await db_call(self.open_betting)(round_obj)
+        self.write(f'[{self.room}] Round {round_obj.round_number} - BETTING phase started')
+
+        deadlines = {
+            'betting_ends_at': round_obj.betting_ends_at.timestamp(),
+            'spin_ends_at': round_obj.spin_ends_at.timestamp(),
+        }
+        self.snapshot.start_round(round_obj.round_number, **deadlines)
+        self.pending_bets = []
+        await self.snapshot.publish()
+
+        await self.broadcast_message('round_starting', {
+            'round_number': round_obj.round_number,
+            'time_remaining': max(0, betting_ends - self.wheel.now()),
+            **deadlines,
+        })
+        TRANSITION_SECONDS.observe(self.wheel.now() - opened, transition='open')
+
+        await self.wheel.sleep_until(betting_ends)
+
+        # Phase 2: Lock bets and spin (SPINNING phase)
+        spun = self.wheel.now()
+        SCHEDULE_DRIFT.observe(spun - betting_ends, transition='spin')
+        PHASE_SECONDS.observe(spun - opened, phase='betting')
+        winning_color, winning_slot = spin_wheel()
+        entries = None
+        if ledger_enabled():
+            entries = await get_ledger().seal(self.room, round_obj.round_number)
+        await db_call(self.start_spin)(round_obj, winning_color, winning_slot, entries)
+        if entries is not None:
+            await get_ledger().discard(self.room, round_obj.round_number)
+        self.write(f'[{self.room}] Round {round_obj.round_number} - SPINNING: {winning_color} (slot {winning_slot})')
+
+        self.snapshot.start_spin()
+        await self.snapshot.publish()
+
+        # Broadcast spin with result so client can animate to correct position
+        await self.broadcast_message('round_spinning', {
+            'round_number': round_obj.round_number,
+            'winning_color': winning_color,
+            'winning_slot': winning_slot,
+            'spin_ends_at': deadlines['spin_ends_at'],
+        })
+        TRANSITION_SECONDS.observe(self.wheel.now() - spun, transition='spin')
+
+        # Schedule the next round while the wheel spins, so opening it is one UPDATE
+        self.next_round = await db_call(self.create_new_round)(spin_ends)
+        self.current_round_number += 1
+
+        await self.wheel.sleep_until(spin_ends)
+
+        # Phase 3: Show the result, then settle in the background while the next round takes bets
+        ended = self.wheel.now()
+        SCHEDULE_DRIFT.observe(ended - spin_ends, transition='result')
+        PHASE_SECONDS.observe(ended - spun, phase='spinning')
+        self.snapshot.complete(winning_color)
+        await self.snapshot.publish()
+        await self.broadcast_result(round_obj.round_number, winning_color, winning_slot)
+        TRANSITION_SECONDS.observe(self.wheel.now() - ended, transition='result')
+
+        # Settlements run one at a time; a failed one fails this round for recovery
+        await self.finish_settlement()
+        self.settlement = asyncio.create_task(self.settle(round_obj, winning_color, winning_slot))
+        return spin_ends
+
+    async def settle(self, round_obj, winning_color, winning_slot):
+        """Pay a spun round out, record its result and send each bettor their payout"""
+        start = time.perf_counter()
+        result = await db_call(self.complete_round)(round_obj, winning_color)
+        SETTLEMENT_SECONDS.observe(time.perf_counter() - start)
+        ROUND_BETS.observe(result['total_bets'])
+        ROUND_PAYOUT.observe(result['total_payout'])
+        self.write(
+            f'  Processed {result["total_bets"]} bets, {len(result["winners"])} winners, '
+            f'total payout: ${result["total_payout"]:.2f}'
+        )
+        self.results.add(round_obj.round_number, winning_color, winning_slot)
+        await self.results.publish()
+        await self.send_payouts(round_obj.round_number, result['payouts'])
+        self.write(f'[{self.room}] Round {round_obj.round_number} - COMPLETED', 'SUCCESS')
+
+    async def finish_settlement(self):
+        """Wait for the previous round's settlement, re-raising its error"""
+        settlement, self.settlement = self.settlement, None
+        if settlement is not None:
+            await settlement
+
+    def wall_clock(self, deadline):
+        """Convert a monotonic deadline into a Unix timestamp for other processes"""
+        return time.time() + (deadline - self.wheel.now())
+
+    def wall_datetime(self, deadline):
+        """Convert a monotonic deadline into an aware datetime for the database"""
+        return datetime.fromtimestamp(self.wall_clock(deadline), tz=dt_timezone.utc)
+
+    def on_bet(self, message):
+        """Apply a bet reported by a consumer and schedule the next bets flush"""
+        added = self.snapshot.add_bet(
+            message['round_number'], message['username'], message['color'], message['amount']
+        )
+        if not added:
+            return
+        self.pending_bets.append(
+            {'username': message['username'], 'color': message['color'], 'amount': message['amount']}
+        )
+        if not self.snapshot_dirty:
+            self.snapshot_dirty = True
+            self.wheel.call_later(self.bets_flush_interval, self.publish_bets)
+
+    async def publish_bets(self):
+        """
+        Publish the snapshot and send every bet since the last flush as one
+        bets_delta frame, so fan-out grows with time rather than bet volume.
+        """
+        self.snapshot_dirty = False
+        bets, self.pending_bets = self.pending_bets, []
+        await self.snapshot.publish()
+        if bets:
+            await self.broadcast_message('bets_delta', {
+                'round_number': self.snapshot.round_number,
+                'totals': dict(self.snapshot.totals),
+                'bets': bets,
+            })
+
+    def get_last_round(self):
+        return GameRound.objects.filter(room=self.room).order_by('-round_number').first()
+
+    def get_results(self):
+        """Latest completed rounds for the result buffer, newest first"""
+        return query_results(self.room, limit=self.results.size)
+
+    def create_new_round(self, round_start):
+        """Schedule the next GameRound to open for bets at monotonic `round_start`"""
+        betting_ends = round_start + self.BETTING_TIME
+        return GameRound.objects.create(
+            room=self.room,
+            round_number=self.current_round_number,
+            status='SCHEDULED',
+            betting_ends_at=self.wall_datetime(betting_ends),
+            spin_ends_at=self.wall_datetime(betting_ends + self.SPIN_ANIMATION_TIME),
+        )
+
+    def open_betting(self, round_obj):
+        """Start accepting bets on a scheduled round"""
+        with transaction.atomic():
+            round_obj.advance('BETTING')
+
+    def start_spin(self, round_obj, winning_color, winning_slot, entries=None):
+        """Close betting, flush ledger entries (if any) and store the spin result"""
+        with transaction.atomic():
+            if entries is not None:
+                flushed, dropped = flush_entries(round_obj, entries)
+                self.write(f'  Flushed {len(flushed)} ledger bets ({len(dropped)} dropped)')
+            round_obj.advance(
+                'SPINNING',
+                spin_time=timezone.now(),
+                winning_color=winning_color,
+                winning_slot=winning_slot,
+            )
+
+    async def recover(self):
+        """Clear leftover ledger rounds, then close rounds left open in the database"""
+        if ledger_enabled():
+            await self.reconcile_ledger()
+        for round_obj, result in await db_call(self.recover_rounds)():
+            if round_obj.status == 'COMPLETED':
+                self.write(
+                    f'[{self.room}] Round {round_obj.round_number} - recovered: settled '
+                    f'{result["total_bets"]} bets, {len(result["winners"])} winners', 'WARNING'
+                )
+            else:
+                self.write(
+                    f'[{self.room}] Round {round_obj.round_number} - recovered: refunded '
+                    f'{result["total_bets"]} bets (${result["total_refund"]})', 'WARNING'
+                )
+
+    async def recover_after_error(self):
+        """Close the rounds a failed phase left open; retried after the next error if this fails too"""
+        self.next_round = None
+        try:
+            await self.finish_settlement()
+        except Exception as e:
+            # Its round is still SPINNING and gets settled below
+            self.write(f'[{self.room}] Settlement failed: {e}', 'ERROR')
+        try:
+            await self.recover()
+            await self.prepare()
+            await self.results.publish()
+        except Exception as e:
+            self.write(f'[{self.room}] Recovery failed: {e}', 'ERROR')
+
+    def recover_rounds(self):
+        """
+        Settle or refund every open round of the room, oldest first.
+
+        Must only run while no round of the room is in progress (before the
+        loop starts or after a round failed). Scheduled rounds never took a
+        bet and are dropped. Returns (round, result) pairs.
+        """
+        GameRound.objects.filter(room=self.room, status='SCHEDULED').delete()
+        recovered = []
+        orphans = GameRound.objects.filter(
+            room=self.room, status__in=GameRound.OPEN_STATUSES
+        ).order_by('round_number')
+        for round_obj in orphans:
+            if round_obj.status == 'SPINNING':
+                result = self.complete_round(round_obj, round_obj.winning_color)
+            else:
+                result = self.cancel_round(round_obj)
+            recovered.append((round_obj, result))
+        return recovered
+
+    async def reconcile_ledger(self):
+        """
+        Clear ledger rounds left behind by a crashed worker.
+
+        Flushed rounds are already in the database; unflushed ones never
+        spun and nothing was debited, so their reservations are voided.
+        """
+        ledger = get_ledger()
+        for round_number in await ledger.open_rounds(self.room):
+            if not await db_call(self.is_flushed)(round_number):
+                self.write(f'[{self.room}] Round {round_number} - voiding unflushed ledger bets', 'WARNING')
+            await ledger.discard(self.room, round_number)
+
+    def is_flushed(self, round_number):
+        return GameRound.objects.filter(
+            room=self.room, round_number=round_number, bets_flushed_at__isnull=False
+        ).exists()
+
+    def complete_round(self, round_obj, winning_color):
+        """Settle all bets and mark the round COMPLETED"""
+        with transaction.atomic():
+            # Advancing first locks the round row for the rest of the transaction
+            round_obj.advance('COMPLETED')
+            result = settle_round(round_obj, winning_color)
+        return result
+
+    def cancel_round(self, round_obj):
+        """Return the stakes of a round that never spun and mark it REFUNDED"""
+        with transaction.atomic():
+            # Bets committed before this are refunded; later ones fail place_bet's BETTING check
+            round_obj.advance('REFUNDED')
+            result = refund_round(round_obj)
+        return result
+
+    async def broadcast_result(self, round_number, winning_color, winning_slot):
+        """Send the round result as one frame shared by the room"""
+        await self.broadcast_message('round_result', {
+            'round_number': round_number,
+            'winning_color': winning_color,
+            'winning_slot': winning_slot,
+        })
+
+    async def send_payouts(self, round_number, payouts):
+        """Send a personal round_payout frame to each bettor's user group"""
+        start = time.perf_counter()
+        for user_id, payout in payouts.items():
+            await self.channel_layer.group_send(
+                user_group_name(self.group_name, user_id),
+                frame_event('round_payout', {
+                    'round_number': round_number,
+                    'your_payout': payout['payout'],
+                    'your_balance': payout['balance'],
+                })
+            )
+        BROADCAST_SECONDS.observe(time.perf_counter() - start, type='round_payout')
+
+    async def broadcast_message(self, message_type, data):
+        """Send a client frame of `message_type` to all WebSocket clients in the room"""
+        start = time.perf_counter()
+        await self.channel_layer.group_send(self.group_name, frame_event(message_type, data))
+        BROADCAST_SECONDS.observe(time.perf_counter() - start, type=message_type)
+
+
+async def consume_bet_events(channel_layer, rooms):
+    """Feed bets reported by consumers into their room's snapshot"""
+    while True:
+        message = await channel_layer.receive(BET_EVENTS_CHANNEL)
+        room = rooms.get(message.get('room'))
+        if room is not None:
+            room.on_bet(message)
+
+
+async def balance_rooms(wheel, rooms, open_room, interval):
+    """
+    Every `interval` seconds, open another room if the hosted ones are full
+    (see rooms.room_to_open). `open_room(name)` starts and returns the room.
+    """
+    while True:
+        await wheel.sleep_until(wheel.now() + interval)
+        name = await sync_to_async(room_to_open, thread_sensitive=False)(list(rooms))
+        if name is not None:
+            rooms[name] = open_room(name)
+            await sync_to_async(publish_rooms, thread_sensitive=False)(list(rooms))
+
+
+async def run_rooms(wheel, rooms, channel_layer=None, room_factory=None, balance_interval=5):
+    """
+    Drive the wheel and every room until all rooms have stopped.
+
+    The hosted rooms are published for views and consumers. With
+    `room_factory` (name -> RouletteRoom), rooms are opened on demand.
+    """
+    hosted = {room.room: room for room in rooms}
+    running = {asyncio.create_task(room.run()) for room in rooms}
+    await sync_to_async(publish_rooms, thread_sensitive=False)(list(hosted))
+
+    tasks = [asyncio.create_task(wheel.run())]
+    if channel_layer is not None:
+        tasks.append(asyncio.create_task(consume_bet_events(channel_layer, hosted)))
+    if room_factory is not None:
+        def open_room(name):
+            room = room_factory(name)
+            running.add(asyncio.create_task(room.run()))
+            return room
+
+        tasks.append(asyncio.create_task(balance_rooms(wheel, hosted, open_room, balance_interval)))
+
+    try:
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            running.difference_update(done)
+            for task in done:
+                task.result()
+    finally:
+        wheel.stop()
+        for task in tasks + list(running):
+            task.cancel()
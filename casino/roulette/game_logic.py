@@ -69,3 +69,19 @@ def get_color_probabilities() -> Dict[str, float]:
         color: (config['slots'] / 54) * 100
         for color, config in WHEEL_CONFIG.items()
     }
+
+
+def color_liability(totals: Dict[str, float]) -> Dict[str, float]:
+    """
+    Payout owed if each color wins, given the total staked on each color.
+
+    Args:
+        totals: Dictionary mapping color to the total staked on it
+
+    Returns:
+        Dictionary mapping color to total stake * multiplier
+    """
+    return {
+        color: totals.get(color, 0) * config['multiplier']
+        for color, config in WHEEL_CONFIG.items()
+    }
@@ -0,0 +1,153 @@
+"""
+Lease-based leader election for the roulette game loop.
+
+Every run_roulette_game process competes for one WorkerLease row. The
+holder renews it every RENEW_INTERVAL seconds; the others stay warm as
+standbys and poll it. Once the leader stops renewing, its lease expires
+after LEASE_TTL and the first standby to poll takes over. That happens well
+within one round (BETTING_TIME + SPIN_ANIMATION_TIME). A leader that cannot
+renew stops its rooms before the lease can pass to someone else. Takeover
+latency is exported as the roulette_leader_takeover_seconds histogram.
+"""
+
+import asyncio
+import os
+import socket
+import uuid
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .engine import db_call
+from .models import WorkerLease
+from casino.utils.metrics import LEADER_TAKEOVER
+
+LEASE_NAME = 'roulette'
+
+
+def default_holder():
+    """Identifies this process in the lease row"""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def acquire_lease(name, holder, ttl):
+    """
+    Take or renew the lease `name` for `ttl` seconds.
+
+    Returns None if another holder's lease is still valid, otherwise the
+    lease row. Its takeover_latency is set when it was just taken over from
+    a previous holder.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            lease, created = WorkerLease.objects.select_for_update().get_or_create(
+                name=name, defaults={'holder': holder, 'acquired_at': now, 'expires_at': now},
+            )
+            if lease.holder != holder:
+                if lease.expires_at > now:
+                    return None
+                # Measured from the last renewal: when the old leader was last alive
+                if lease.holder and lease.renewed_at:
+                    lease.takeover_latency = (now - lease.renewed_at).total_seconds()
+                lease.holder = holder
+                lease.acquired_at = now
+            lease.renewed_at = now
+            lease.expires_at = now + timedelta(seconds=ttl)
+            lease.save()
+            return lease
+    except IntegrityError:
+        # Another process created the row at the same moment
+        return None
+
+
+def release_lease(name, holder):
+    """Expire our lease right away so a standby takes over on its next poll"""
+    WorkerLease.objects.filter(name=name, holder=holder).update(expires_at=timezone.now())
+
+
+class LeaderElection:
+    """
+    Runs `lead()` only while this process holds the lease.
+
+    Args:
+        name: Lease name shared by the competing processes
+        holder: This process's identity (default_holder() if None)
+        stdout: Optional OutputWrapper (management command stdout)
+        style: Optional color style matching stdout
+    """
+
+    LEASE_TTL = 6
+    RENEW_INTERVAL = 2
+
+    def __init__(self, name=LEASE_NAME, holder=None, stdout=None, style=None):
+        self.name = name
+        self.holder = holder or default_holder()
+        self.stdout = stdout
+        self.style = style
+        self.is_leader = False
+
+    def write(self, message, style_name=None):
+        if self.stdout is None:
+            return
+        if style_name and self.style is not None:
+            message = getattr(self.style, style_name)(message)
+        self.stdout.write(message)
+
+    async def acquire(self):
+        """Take or renew the lease; None if someone else holds it or the database failed"""
+        try:
+            return await db_call(acquire_lease)(self.name, self.holder, self.LEASE_TTL)
+        except Exception as e:
+            # Without a confirmed renewal we must assume the lease is gone
+            self.write(f'Lease check failed: {e}', 'ERROR')
+            return None
+
+    async def run(self, lead):
+        """
+        Stand by until elected, then run the `lead` coroutine function while
+        renewing the lease. Losing the lease cancels it and returns to
+        standby. Returns once `lead()` finishes on its own.
+        """
+        while True:
+            lease = await self.acquire()
+            if lease is None:
+                await asyncio.sleep(self.RENEW_INTERVAL)
+                continue
+
+            self.elected(lease)
+            task = asyncio.create_task(lead())
+            try:
+                lost = await self.hold(task)
+            except asyncio.CancelledError:
+                # Shutting down: hand over now rather than after LEASE_TTL
+                await self.stop_leading(task)
+                await db_call(release_lease)(self.name, self.holder)
+                raise
+
+            await self.stop_leading(task)
+            if not lost:
+                await db_call(release_lease)(self.name, self.holder)
+                task.result()
+                return
+
+    async def hold(self, task):
+        """Renew the lease until `task` finishes; returns True if the lease was lost"""
+        while not task.done():
+            await asyncio.wait({task}, timeout=self.RENEW_INTERVAL)
+            if not task.done() and await self.acquire() is None:
+                self.write(f'Lost the {self.name} lease, standing by', 'WARNING')
+                return True
+        return False
+
+    async def stop_leading(self, task):
+        self.is_leader = False
+        if not task.done():
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    def elected(self, lease):
+        self.is_leader = True
+        if lease.takeover_latency is not None and lease.acquired_at == lease.renewed_at:
+            LEADER_TAKEOVER.observe(lease.takeover_latency, lease=self.name)
+            self.write(f'Took over {self.name} after {lease.takeover_latency:.3f}s')
+        self.write(f'Elected {self.name} leader as {self.holder}', 'SUCCESS')
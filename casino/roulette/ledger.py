@@ -0,0 +1,229 @@
+"""
+Write-behind bet ledger for the roulette betting phase.
+
+With ROULETTE_BET_INTAKE = 'ledger', consumers do not touch the database when
+a bet arrives. Funds are reserved and the bet recorded in a fast atomic store
+instead, and the game loop flushes the whole round to Bet and User in bulk
+when it flips to SPINNING.
+
+Crash safety: nothing is debited before the flush, and the flush runs in the
+same transaction that marks the round SPINNING (bets_flushed_at). Leftover
+ledger rounds found at startup were either flushed already or never spun, so
+they are discarded without any money changing hands.
+
+Backends:
+    redis - Lua scripts on a shared Redis (production, many processes)
+    local - in-process single writer (tests, single-process setups)
+"""
+
+import logging
+import threading
+from django.conf import settings
+from django.utils import timezone
+from casino.utils.balance_tracker import apply_balance_changes
+from casino.utils.user_stats import ensure_stats, record_bets_of
+from .models import Bet
+
+logger = logging.getLogger('auditlog')
+
+INSUFFICIENT_FUNDS = -1
+ROUND_CLOSED = -2
+
+FLUSH_BATCH_SIZE = 500
+
+# KEYS: reserved, bets, names, sealed, rounds
+# ARGV: user_id, color, amount, balance, username, round_number
+RESERVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[4]) == 1 then
+    return -2
+end
+local amount = tonumber(ARGV[3])
+local reserved = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local available = tonumber(ARGV[4]) - reserved
+if amount > available then
+    return -1
+end
+redis.call('HINCRBY', KEYS[1], ARGV[1], amount)
+redis.call('HINCRBY', KEYS[2], ARGV[1] .. ':' .. ARGV[2], amount)
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[5])
+redis.call('SADD', KEYS[5], ARGV[6])
+return available - amount
+"""
+
+# KEYS: bets, names, sealed
+SEAL_SCRIPT = """
+redis.call('SET', KEYS[3], 1)
+return {redis.call('HGETALL', KEYS[1]), redis.call('HGETALL', KEYS[2])}
+"""
+
+
+class LocalBetLedger:
+    """In-process ledger; every operation runs under one lock (single writer)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rounds = {}
+
+    def _round(self, room, round_number):
+        return self.rounds.setdefault((room, round_number), {
+            'reserved': {}, 'bets': {}, 'names': {}, 'sealed': False,
+        })
+
+    async def reserve(self, room, round_number, user_id, username, color, amount, balance):
+        """
+        Reserve `amount` against `balance` and record the bet.
+
+        Returns the balance left after all of the user's reservations in this
+        round, or INSUFFICIENT_FUNDS / ROUND_CLOSED.
+        """
+        with self.lock:
+            state = self._round(room, round_number)
+            if state['sealed']:
+                return ROUND_CLOSED
+            available = balance - state['reserved'].get(user_id, 0)
+            if amount > available:
+                return INSUFFICIENT_FUNDS
+            state['reserved'][user_id] = state['reserved'].get(user_id, 0) + amount
+            key = (user_id, color)
+            state['bets'][key] = state['bets'].get(key, 0) + amount
+            state['names'][user_id] = username
+            return available - amount
+
+    async def seal(self, room, round_number):
+        """Close a round to new reservations and return its entries"""
+        with self.lock:
+            state = self._round(room, round_number)
+            state['sealed'] = True
+            return [
+                {'user_id': user_id, 'username': state['names'][user_id], 'color': color, 'amount': amount}
+                for (user_id, color), amount in state['bets'].items()
+            ]
+
+    async def open_rounds(self, room):
+        with self.lock:
+            return sorted(number for (r, number) in self.rounds if r == room)
+
+    async def discard(self, room, round_number):
+        with self.lock:
+            self.rounds.pop((room, round_number), None)
+
+
+class RedisBetLedger:
+    """Ledger kept in Redis; reservations and sealing are atomic Lua scripts"""
+
+    KEY_PREFIX = 'roulette:ledger'
+    KEY_TTL = 60 * 60
+
+    def __init__(self, url):
+        import redis.asyncio as redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.reserve_script = self.redis.register_script(RESERVE_SCRIPT)
+        self.seal_script = self.redis.register_script(SEAL_SCRIPT)
+
+    def keys(self, room, round_number):
+        base = f'{self.KEY_PREFIX}:{room}:{round_number}'
+        return [f'{base}:reserved', f'{base}:bets', f'{base}:names', f'{base}:sealed']
+
+    def rounds_key(self, room):
+        return f'{self.KEY_PREFIX}:{room}:rounds'
+
+    async def reserve(self, room, round_number, user_id, username, color, amount, balance):
+        keys = self.keys(room, round_number)
+        result = await self.reserve_script(
+            keys=keys + [self.rounds_key(room)],
+            args=[user_id, color, amount, balance, username, round_number],
+        )
+        if result >= 0:
+            pipe = self.redis.pipeline(transaction=False)
+            for key in keys[:3]:
+                pipe.expire(key, self.KEY_TTL)
+            await pipe.execute()
+        return int(result)
+
+    async def seal(self, room, round_number):
+        keys = self.keys(room, round_number)
+        bets, names = await self.seal_script(keys=[keys[1], keys[2], keys[3]])
+        names = dict(zip(names[::2], names[1::2]))
+        entries = []
+        for field, amount in zip(bets[::2], bets[1::2]):
+            user_id, color = field.split(':')
+            entries.append({'user_id': int(user_id), 'username': names.get(user_id, ''),
+                            'color': color, 'amount': int(amount)})
+        return entries
+
+    async def open_rounds(self, room):
+        return sorted(int(n) for n in await self.redis.smembers(self.rounds_key(room)))
+
+    async def discard(self, room, round_number):
+        pipe = self.redis.pipeline()
+        pipe.delete(*self.keys(room, round_number))
+        pipe.srem(self.rounds_key(room), round_number)
+        await pipe.execute()
+
+
+_ledger = None
+
+
+def get_ledger():
+    """The process-wide ledger selected by ROULETTE_LEDGER_BACKEND"""
+    global _ledger
+    if _ledger is None:
+        if settings.ROULETTE_LEDGER_BACKEND == 'local':
+            _ledger = LocalBetLedger()
+        else:
+            _ledger = RedisBetLedger(settings.ROULETTE_LEDGER_URL)
+    return _ledger
+
+
+def ledger_enabled():
+    return settings.ROULETTE_BET_INTAKE == 'ledger'
+
+
+def flush_entries(round_obj, entries):
+    """
+    Write sealed ledger entries to the database in bulk.
+
+    Must run inside the transaction that moves the round to SPINNING; the
+    bets_flushed_at marker and the round's color counters are saved with it.
+    Users who spent the reserved funds elsewhere since betting are skipped.
+
+    Returns (flushed_entries, dropped_entries).
+    """
+    totals = {}
+    for entry in entries:
+        totals[entry['user_id']] = totals.get(entry['user_id'], 0) + entry['amount']
+
+    # Conditional debits: users whose balance no longer covers their stake are left out
+    debited = set(apply_balance_changes(
+        {uid: -total for uid, total in totals.items()}, 'roulette_bet', round_obj.balance_ref,
+    ))
+
+    flushed = [e for e in entries if e['user_id'] in debited]
+    dropped = [e for e in entries if e['user_id'] not in debited]
+
+    # Stats rows first: anything older than a row is left to the backfill
+    ensure_stats(debited)
+    now = timezone.now()
+    Bet.objects.bulk_create(
+        [Bet(user_id=e['user_id'], round=round_obj, color=e['color'], amount=e['amount'])
+         for e in flushed],
+        batch_size=FLUSH_BATCH_SIZE,
+    )
+    record_bets_of(Bet.objects.filter(round=round_obj), 'roulette')
+    # The color counters are stored from these rows when the round advances
+    round_obj.bets_flushed_at = now
+    round_obj.save(update_fields=['bets_flushed_at'])
+
+    if flushed:
+        logger.info(
+            f"[BALANCE] roulette round {round_obj.round_number}: debited {len(debited)} bettors "
+            f"(-{sum(e['amount'] for e in flushed)}) | Reason: roulette_bet_round_{round_obj.round_number}"
+        )
+    for entry in dropped:
+        logger.warning(
+            f"[BALANCE] roulette round {round_obj.round_number}: dropped {entry['username']}'s "
+            f"{entry['amount']} on {entry['color']} (reserved funds spent elsewhere)"
+        )
+    return flushed, dropped
+
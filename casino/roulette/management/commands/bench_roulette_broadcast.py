@@ -0,0 +1,89 @@
+"""
+Benchmark the per-event CPU cost of fanning a broadcast out to sockets.
+
+Compares frames serialized once by the producer (frame_event, forwarded as
+is by every consumer) with the previous handlers that rebuilt the dict and
+ran json.dumps for each socket. Socket writes are stubbed out, so only the
+consumer-side work (including the outbound queue) is measured. No database is needed.
+
+Run with: python manage.py bench_roulette_broadcast --sockets 1000,10000,50000
+"""
+
+import asyncio
+import json
+import time
+from secrets import choice
+from django.core.management.base import BaseCommand
+from casino.roulette.consumers import RouletteConsumer
+from casino.roulette.engine import frame_event
+from casino.roulette.outbound import OutboundQueue
+from casino.roulette.game_logic import WHEEL_CONFIG
+from casino.roulette.protocol import JSON
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks roulette broadcast fan-out CPU cost versus socket count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', default='1000,10000,50000',
+                            help='Comma-separated numbers of connected sockets')
+        parser.add_argument('--bets', type=int, default=50,
+                            help='Bets carried by the bets_delta frame')
+
+    def handle(self, *args, **options):
+        sizes = [int(n) for n in options['sockets'].split(',')]
+        colors = list(WHEEL_CONFIG)
+        events = {
+            'round_spinning': {'round_number': 1, 'winning_color': 'RED', 'winning_slot': 7},
+            'bets_delta': {
+                'round_number': 1,
+                'totals': dict.fromkeys(colors, 1000),
+                'bets': [{'username': f'player_{i}', 'color': choice(colors), 'amount': 100}
+                         for i in range(options['bets'])],
+            },
+        }
+
+        self.stdout.write(f'{"event":<16} {"sockets":>8} {"once ms":>9} {"per-socket ms":>14} {"speedup":>8}')
+        for message_type, data in events.items():
+            for size in sizes:
+                consumers = [self.make_consumer() for _ in range(size)]
+                once = asyncio.run(self.fan_out(consumers, self.serialize_once, message_type, data))
+                legacy = asyncio.run(self.fan_out(consumers, self.serialize_per_socket, message_type, data))
+                self.stdout.write(
+                    f'{message_type:<16} {size:>8} {once * 1000:>9.1f} {legacy * 1000:>14.1f} '
+                    f'{legacy / once:>7.1f}x'
+                )
+
+    def make_consumer(self):
+        consumer = RouletteConsumer()
+        consumer.room = 'bench'
+        consumer.room_group_name = 'bench'
+        consumer.codec = JSON
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            pass
+
+        consumer.send = send
+        consumer.outbound = OutboundQueue(consumer.send_text)
+        consumer.closing_slow = False
+        return consumer
+
+    async def fan_out(self, consumers, deliver, message_type, data):
+        """CPU seconds spent producing one event and handing it to every consumer"""
+        start = time.process_time()
+        await deliver(consumers, message_type, data)
+        return time.process_time() - start
+
+    async def serialize_once(self, consumers, message_type, data):
+        event = frame_event(message_type, data)
+        for consumer in consumers:
+            await getattr(consumer, event['type'])(event)
+
+    async def serialize_per_socket(self, consumers, message_type, data):
+        """The previous handlers: the event carried fields, each consumer dumped its own frame"""
+        event = {'type': f'{message_type}_broadcast', **data}
+        for consumer in consumers:
+            await consumer.send(text_data=json.dumps({
+                'type': message_type,
+                **{key: value for key, value in event.items() if key != 'type'},
+            }))
@@ -0,0 +1,96 @@
+"""
+Benchmark roulette bet intake throughput.
+
+Compares the direct path (RouletteConsumer.place_bet: one transaction of
+conditional updates per bet) with the write-behind ledger (reserve per bet,
+one bulk flush when the round spins). Runs on a throwaway test database.
+
+Run with: python manage.py bench_roulette_intake --bets 5000 --users 500
+"""
+
+import asyncio
+import time
+from secrets import choice
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from casino.login.models import User
+from casino.roulette.consumers import RouletteConsumer
+from casino.roulette.game_logic import WHEEL_CONFIG
+from casino.roulette.ledger import LocalBetLedger, RedisBetLedger, flush_entries
+from casino.roulette.models import GameRound
+from casino.utils.bench import benchmark_database
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks direct roulette bet intake against the write-behind ledger'
+
+    ROOM = 'bench'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bets', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Bets in flight at once')
+        parser.add_argument('--backend', choices=['local', 'redis'], default='local')
+        parser.add_argument('--redis-url', default='redis://127.0.0.1:6379/15')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            users = User.objects.bulk_create(
+                [User(username=f'bench_{i}', balance=10 ** 12) for i in range(options['users'])]
+            )
+            colors = list(WHEEL_CONFIG)
+            bets = [(choice(users), choice(colors), 10) for _ in range(options['bets'])]
+
+            direct_round = GameRound.objects.create(round_number=1, status='BETTING')
+            direct_s = async_to_sync(self.run_direct)(bets, options['concurrency'])
+            direct_round.status = 'COMPLETED'
+            direct_round.save()
+
+            if options['backend'] == 'redis':
+                ledger = RedisBetLedger(options['redis_url'])
+            else:
+                ledger = LocalBetLedger()
+            ledger_round = GameRound.objects.create(round_number=2, status='BETTING')
+            ledger_s, entries = async_to_sync(self.run_ledger)(ledger, bets, options['concurrency'])
+
+            start = time.perf_counter()
+            with transaction.atomic():
+                flush_entries(ledger_round, entries)
+                ledger_round.save()
+            flush_s = time.perf_counter() - start
+            async_to_sync(ledger.discard)(self.ROOM, ledger_round.round_number)
+
+        total = len(bets)
+        self.stdout.write(f'{"path":<10} {"bets":>7} {"seconds":>9} {"bets/s":>10}')
+        self.stdout.write(f'{"direct":<10} {total:>7} {direct_s:>9.3f} {total / direct_s:>10.0f}')
+        self.stdout.write(f'{"ledger":<10} {total:>7} {ledger_s:>9.3f} {total / ledger_s:>10.0f}')
+        self.stdout.write(f'ledger flush of {len(entries)} entries: {flush_s * 1000:.1f} ms')
+
+    async def run_direct(self, bets, concurrency):
+        consumer = RouletteConsumer()
+
+        async def place(user, color, amount):
+            await consumer.place_bet(user, color, amount)
+
+        return await self.run_concurrently(place, bets, concurrency)
+
+    async def run_ledger(self, ledger, bets, concurrency):
+        async def reserve(user, color, amount):
+            await ledger.reserve(self.ROOM, 2, user.pk, user.username, color, amount, user.balance)
+
+        elapsed = await self.run_concurrently(reserve, bets, concurrency)
+        entries = await ledger.seal(self.ROOM, 2)
+        return elapsed, entries
+
+    async def run_concurrently(self, func, bets, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(bet):
+            async with semaphore:
+                await func(*bet)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run(bet) for bet in bets))
+        return time.perf_counter() - start
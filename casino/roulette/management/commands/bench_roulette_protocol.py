@@ -0,0 +1,63 @@
+"""
+Benchmark the roulette wire codecs over one simulated round.
+
+A round is what one spectator socket receives: round_starting, one
+bets_delta per flush interval of the betting phase, round_spinning and
+round_result, plus the round_payout a bettor gets. Reports bytes per round
+and encode time for every codec in protocol.CODECS. No database is needed.
+
+Run with: python manage.py bench_roulette_protocol --deltas 150 --bets-per-delta 5
+"""
+
+import time
+from secrets import choice, randbelow
+from django.core.management.base import BaseCommand
+from casino.roulette.protocol import CODECS, COLORS
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks bytes per round and encode time of the roulette wire codecs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--deltas', type=int, default=150,
+                            help='bets_delta frames per round')
+        parser.add_argument('--bets-per-delta', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=200,
+                            help='Rounds encoded per codec for the timing')
+
+    def handle(self, *args, **options):
+        messages = self.build_round(options['deltas'], options['bets_per_delta'])
+
+        self.stdout.write(f'{"codec":<10} {"frames":>7} {"bytes/round":>12} {"encode us/round":>16}')
+        baseline = None
+        for codec in CODECS:
+            size = sum(len(codec.encode(message).encode()) for message in messages)
+
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                for message in messages:
+                    codec.encode(message)
+            elapsed_us = (time.perf_counter() - start) / options['repeat'] * 1e6
+
+            baseline = baseline or size
+            self.stdout.write(
+                f'{codec.name:<10} {len(messages):>7} {size:>12} {elapsed_us:>16.0f}'
+                f'  ({size / baseline:.0%} of {CODECS[0].name})'
+            )
+
+    def build_round(self, deltas, bets_per_delta):
+        totals = dict.fromkeys(COLORS, 0)
+        messages = [{'type': 'round_starting', 'round_number': 1234, 'time_remaining': 14.98}]
+        for i in range(deltas):
+            bets = []
+            for j in range(bets_per_delta):
+                bet = {'username': f'player_{i}_{j}', 'color': choice(COLORS), 'amount': 10 * (1 + randbelow(100))}
+                totals[bet['color']] += bet['amount']
+                bets.append(bet)
+            messages.append({'type': 'bets_delta', 'round_number': 1234, 'totals': dict(totals), 'bets': bets})
+        messages += [
+            {'type': 'round_spinning', 'round_number': 1234, 'winning_color': 'RED', 'winning_slot': 13},
+            {'type': 'round_result', 'round_number': 1234, 'winning_color': 'RED', 'winning_slot': 13},
+            {'type': 'round_payout', 'round_number': 1234, 'your_payout': 300, 'your_balance': 10300},
+        ]
+        return messages
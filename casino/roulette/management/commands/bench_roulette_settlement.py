@@ -0,0 +1,77 @@
+"""
+Benchmark roulette settlement against the number of bets in a round.
+
+Compares the set-based settle_round with the previous per-bet loop
+(bet.save + update_balance + History.objects.create for every bet).
+Runs on a throwaway test database.
+
+Run with: python manage.py bench_roulette_settlement --bets 100,1000,5000
+"""
+
+from secrets import choice
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from casino.base.models import History
+from casino.login.models import User
+from casino.roulette.game_logic import WHEEL_CONFIG, calculate_payout
+from casino.roulette.models import GameRound, Bet
+from casino.roulette.settlement import settle_round
+from casino.utils.balance_tracker import update_balance
+from casino.utils.bench import benchmark_database, measure
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks roulette round settlement versus bet count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bets', default='10,100,1000,5000',
+                            help='Comma-separated bet counts per round')
+        parser.add_argument('--skip-legacy', action='store_true',
+                            help='Only time the set-based settlement')
+
+    def handle(self, *args, **options):
+        sizes = [int(n) for n in options['bets'].split(',')]
+
+        with benchmark_database():
+            self.stdout.write(f'{"bets":>8} {"set ms":>10} {"set q":>6} {"loop ms":>10} {"loop q":>7}')
+            for size in sizes:
+                round_obj = self.create_round(size)
+                with measure() as fast:
+                    settle_round(round_obj, 'GRAY')
+
+                slow = {'ms': float('nan'), 'queries': 0}
+                if not options['skip_legacy']:
+                    round_obj = self.create_round(size)
+                    with measure() as slow:
+                        self.settle_per_bet(round_obj, 'GRAY')
+
+                self.stdout.write(
+                    f'{size:>8} {fast["ms"]:>10.1f} {fast["queries"]:>6} '
+                    f'{slow["ms"]:>10.1f} {slow["queries"]:>7}'
+                )
+
+    def create_round(self, size):
+        """Create a BETTING round with `size` bets from distinct users"""
+        last = GameRound.objects.order_by('-round_number').first()
+        round_obj = GameRound.objects.create(
+            round_number=last.round_number + 1 if last else 1,
+            status='SPINNING',
+        )
+        start = User.objects.count()
+        users = User.objects.bulk_create(
+            [User(username=f'bench_{start + i}', balance=0) for i in range(size)]
+        )
+        colors = list(WHEEL_CONFIG)
+        Bet.objects.bulk_create(
+            [Bet(user=user, round=round_obj, color=choice(colors), amount=100) for user in users]
+        )
+        return round_obj
+
+    def settle_per_bet(self, round_obj, winning_color):
+        """The per-bet settlement loop settle_round replaced"""
+        for bet in Bet.objects.filter(round=round_obj).select_related('user'):
+            bet.payout = calculate_payout(bet.amount, bet.color, winning_color)
+            bet.save()
+            if bet.payout > 0:
+                update_balance(bet.user, bet.payout, 'roulette_win', game_ref=round_obj.balance_ref)
+                History.objects.create(u_id=bet.user, amount=bet.payout, cashout_time=timezone.now())
@@ -0,0 +1,568 @@
+"""
+Load-test the roulette WebSocket with thousands of synthetic players.
+
+Two modes:
+
+    in-process   (default) The game loop and the clients run in this process
+                 and drive RouletteConsumer through channels' test
+                 communicator, against the configured channel layer, cache
+                 and database: settings_test gives InMemoryChannelLayer,
+                 LocMemCache and SQLite, the normal settings a local Redis and
+                 PostgreSQL (use a spare Redis database, rooms and connection
+                 counts are published there). Users and rounds live in a
+                 throwaway test database. Measures the consumer and the game
+                 loop, not a server.
+    --url        Real WebSocket clients (autobahn on the asyncio Twisted
+                 reactor that daphne installs) connect to a running Daphne,
+                 e.g. --url ws://127.0.0.1:8000, whose run_roulette_game
+                 plays the rounds. This answers how many players one Daphne
+                 process holds. The command must use
+                 the server's settings: players and their sessions are created
+                 in its database (deleted again afterwards, so use a staging
+                 deployment) and the active rooms are read from its cache.
+                 Fan-out lag compares server timestamps with local receipt,
+                 so run it on the same host or with synchronized clocks.
+
+Every client connects to ws/roulette/ like a browser, then in each round
+places bets with the configured probability, colors and amounts at a random
+moment of the betting phase. Measured:
+
+    connect      handshake until accepted
+    first_state  handshake until the first round_state arrived
+    bet_ack      place_bet until balance_update (or error)
+    fanout       receipt of each phase broadcast versus the moment the server
+                 planned it: round_starting (sent at betting_ends_at -
+                 time_remaining), round_spinning (betting_ends_at), round_result
+                 and round_payout (spin_ends_at)
+
+The report is JSON (latencies in ms) so runs can be compared across commits.
+
+Run with: python manage.py loadtest_roulette --clients 2000 --rounds 3 --output report.json
+      or: python manage.py loadtest_roulette --url ws://127.0.0.1:8000 --clients 2000 --output report.json
+"""
+
+import asyncio
+import json
+import random
+import secrets
+import time
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlparse
+from asgiref.sync import async_to_sync
+from autobahn.twisted.websocket import WebSocketClientFactory, WebSocketClientProtocol, connectWS
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from casino.login.models import User
+from casino.roulette import engine
+from casino.roulette.game_logic import WHEEL_CONFIG
+from casino.roulette.protocol import COMPACT_SUBPROTOCOL, COMPACT, JSON
+from casino.roulette.rooms import ROOMS_KEY, assign_room, next_room_name
+from casino.roulette.routing import websocket_urlpatterns
+from casino.roulette.scheduler import TimerWheel
+from casino.utils.bench import benchmark_database
+
+# Phase broadcasts whose fan-out lag is measured
+PHASES = ('round_starting', 'round_spinning', 'round_result', 'round_payout')
+
+
+def summarize(samples):
+    """Count and percentiles (ms) of latency samples in seconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 2)
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 2),
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': round(ordered[-1] * 1000, 2),
+    }
+
+
+class CommunicatorSocket:
+    """In-process transport: the consumer driven through channels' WebsocketCommunicator"""
+
+    def __init__(self, harness, user, session_key):
+        self.communicator = WebsocketCommunicator(
+            harness.application, '/ws/roulette/', subprotocols=harness.subprotocols,
+        )
+        self.communicator.scope['user'] = user
+        self.communicator.scope['session'] = SessionStore(session_key=session_key)
+
+    async def connect(self, timeout):
+        connected, _ = await self.communicator.connect(timeout=timeout)
+        return connected
+
+    async def receive(self, timeout):
+        return await self.communicator.receive_from(timeout=timeout)
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def close(self, timeout):
+        await self.communicator.disconnect(timeout=timeout)
+
+
+class _ClientProtocol(WebSocketClientProtocol):
+    """Hands autobahn's callbacks to the NetworkSocket of its factory"""
+
+    def onOpen(self):
+        self.factory.socket.protocol = self
+        self.factory.socket.opened.set_result(True)
+
+    def onMessage(self, payload, isBinary):
+        self.factory.socket.frames.put_nowait(payload.decode('utf8'))
+
+    def onClose(self, wasClean, code, reason):
+        socket = self.factory.socket
+        if not socket.opened.done():
+            socket.opened.set_result(False)
+        if not socket.closed.done():
+            socket.closed.set_result(code)
+        socket.frames.put_nowait(None)
+
+
+class _ClientFactory(WebSocketClientFactory):
+    protocol = _ClientProtocol
+
+    def clientConnectionFailed(self, connector, reason):
+        if not self.socket.opened.done():
+            self.socket.opened.set_exception(reason.value)
+
+
+class NetworkSocket:
+    """A real WebSocket connection to a running server, authenticated by session cookie"""
+
+    def __init__(self, harness, user, session_key):
+        self.factory = _ClientFactory(
+            harness.url, origin=harness.origin, protocols=harness.subprotocols or None,
+            headers={'Cookie': f'{settings.SESSION_COOKIE_NAME}={session_key}'},
+        )
+        self.factory.socket = self
+        self.protocol = None
+        self.frames = asyncio.Queue()
+
+    async def connect(self, timeout):
+        loop = asyncio.get_running_loop()
+        self.opened, self.closed = loop.create_future(), loop.create_future()
+        connectWS(self.factory, timeout=timeout)
+        return await asyncio.wait_for(self.opened, timeout)
+
+    async def receive(self, timeout):
+        frame = await asyncio.wait_for(self.frames.get(), timeout)
+        if frame is None:
+            raise ConnectionError(f'closed by the server ({self.closed.result()})')
+        return frame
+
+    async def send(self, text):
+        self.protocol.sendMessage(text.encode('utf8'))
+
+    async def close(self, timeout):
+        if self.protocol is not None and not self.closed.done():
+            self.protocol.sendClose()
+            await asyncio.wait_for(self.closed, timeout)
+
+
+class LoadClient:
+    """One synthetic player: a WebSocket plus a betting pattern"""
+
+    ACK_TIMEOUT = 30
+    # Acknowledge received frames like roulette.js does (outbound flow control)
+    ACK_EVERY = 8
+
+    def __init__(self, harness, user, session_key):
+        self.harness = harness
+        self.user = user
+        self.session_key = session_key
+        self.socket = harness.transport(harness, user, session_key)
+        self.received = 0
+        self.acked = 0
+        self.ack = None
+        self.room = assign_room(user.pk, harness.room_names)
+        # round_number -> spin_ends_at; payouts arrive after the next round opened
+        self.spin_deadlines = {}
+        self.betting = None
+
+    async def connect(self):
+        harness = self.harness
+        start = time.perf_counter()
+        connected = await self.socket.connect(harness.timeout)
+        if not connected:
+            harness.errors['connect refused'] += 1
+            return False
+        harness.samples['connect'].append(time.perf_counter() - start)
+
+        message = await self.receive()
+        harness.samples['first_state'].append(time.perf_counter() - start)
+        self.handle(message)
+        return True
+
+    async def receive(self):
+        text = await self.socket.receive(self.harness.timeout)
+        self.harness.messages += 1
+        self.received += 1
+        if self.received - self.acked >= self.ACK_EVERY:
+            self.acked = self.received
+            await self.socket.send(self.harness.codec.encode({'type': 'ack', 'seq': self.acked}))
+        return self.harness.codec.decode(text)
+
+    async def listen(self):
+        while True:
+            self.handle(await self.receive())
+
+    def handle(self, message):
+        harness = self.harness
+        now = time.time()
+        message_type = message.get('type')
+
+        if message_type == 'round_state':
+            if message['status'] == 'BETTING':
+                self.start_betting(message['round_number'], message['time_remaining'])
+        elif message_type == 'round_starting':
+            sent_at = message['betting_ends_at'] - message['time_remaining']
+            harness.samples['round_starting'].append(now - sent_at)
+            for number in [n for n in self.spin_deadlines if n < message['round_number'] - 1]:
+                del self.spin_deadlines[number]
+            self.spin_deadlines[message['round_number']] = message['spin_ends_at']
+            self.start_betting(message['round_number'], message['time_remaining'])
+        elif message_type == 'round_spinning':
+            harness.samples['round_spinning'].append(now - (message['spin_ends_at'] - harness.spin_time))
+            self.spin_deadlines[message['round_number']] = message['spin_ends_at']
+        elif message_type == 'round_result':
+            spin_ends_at = self.spin_deadlines.get(message['round_number'])
+            if spin_ends_at is not None:
+                harness.samples['round_result'].append(now - spin_ends_at)
+            harness.round_finished(self.room, message['round_number'])
+        elif message_type == 'round_payout':
+            spin_ends_at = self.spin_deadlines.pop(message['round_number'], None)
+            if spin_ends_at is not None:
+                harness.samples['round_payout'].append(now - spin_ends_at)
+        elif message_type == 'slow_consumer':
+            harness.errors['closed as slow consumer'] += 1
+        elif message_type in ('balance_update', 'error'):
+            if message_type == 'error':
+                harness.errors[message['message']] += 1
+            if self.ack is not None and not self.ack.done():
+                self.ack.set_result(message_type)
+
+    def start_betting(self, round_number, time_remaining):
+        harness = self.harness
+        if self.betting is not None and not self.betting.done():
+            return
+        if harness.rng.random() >= harness.bet_probability:
+            return
+        # Leave the last tenth of the phase free so bets do not race the spin
+        delays = sorted(harness.rng.uniform(0, time_remaining * 0.9) for _ in range(harness.bets_per_round))
+        self.betting = asyncio.create_task(self.place_bets(delays))
+
+    async def place_bets(self, delays):
+        harness = self.harness
+        start = time.perf_counter()
+        for delay in delays:
+            await asyncio.sleep(max(0, delay - (time.perf_counter() - start)))
+            color = harness.rng.choices(harness.colors, harness.color_weights)[0]
+            amount = harness.rng.choice(harness.amounts)
+
+            self.ack = asyncio.get_running_loop().create_future()
+            sent = time.perf_counter()
+            await self.socket.send(harness.codec.encode(
+                {'type': 'place_bet', 'color': color, 'amount': amount}
+            ))
+            try:
+                await asyncio.wait_for(self.ack, self.ACK_TIMEOUT)
+            except asyncio.TimeoutError:
+                harness.errors['bet ack timeout'] += 1
+                continue
+            harness.samples['bet_ack'].append(time.perf_counter() - sent)
+
+    async def close(self, listener):
+        for task in (listener, self.betting):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*(t for t in (listener, self.betting) if t is not None), return_exceptions=True)
+        try:
+            await self.socket.close(self.harness.timeout)
+        except Exception:
+            pass
+
+
+class Command(BaseCommand):
+    help = 'Load-tests the roulette WebSocket with synthetic players and writes a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=None,
+                            help='Connect real WebSocket clients to a running server, e.g. ws://127.0.0.1:8000')
+        parser.add_argument('--origin', default=None,
+                            help='Origin header sent with --url (default: http://<host of --url>)')
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--rooms', type=int, default=1,
+                            help='Rooms hosted by the in-process game loop (players are spread by the hash ring)')
+        parser.add_argument('--rounds', type=int, default=3,
+                            help='Rounds every room plays before the run stops')
+        parser.add_argument('--betting-time', type=float, default=None,
+                            help='In-process: phase length (default 5). With --url: the server\'s, if not the default')
+        parser.add_argument('--spin-time', type=float, default=None,
+                            help='In-process: phase length (default 2). With --url: the server\'s, if not the default')
+        parser.add_argument('--bet-probability', type=float, default=0.5,
+                            help='Chance that a client bets in a round')
+        parser.add_argument('--bets-per-round', type=int, default=1,
+                            help='Bets of a client that bets in a round')
+        parser.add_argument('--amounts', default='10,50,100',
+                            help='Comma-separated bet amounts, picked uniformly')
+        parser.add_argument('--color-weights', default=','.join(
+            f'{color}={config["slots"]}' for color, config in WHEEL_CONFIG.items()
+        ), help='Comma-separated COLOR=weight (default: wheel slots)')
+        parser.add_argument('--codec', choices=['json', 'compact'], default='json')
+        parser.add_argument('--intake', choices=['direct', 'ledger'], default=None,
+                            help='Override ROULETTE_BET_INTAKE')
+        parser.add_argument('--connect-concurrency', type=int, default=100,
+                            help='Handshakes in flight at once')
+        parser.add_argument('--timeout', type=float, default=120.0,
+                            help='Seconds to wait for any single response')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--label', default='',
+                            help='Free text stored in the report, e.g. the commit')
+        parser.add_argument('--output', default=None,
+                            help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        self.configure(options)
+        intake = options['intake'] or settings.ROULETTE_BET_INTAKE
+        if self.url:
+            started, elapsed = self.load_server(options)
+        else:
+            started, elapsed = self.load_in_process(options, intake)
+
+        report = {
+            'label': options['label'],
+            'started_at': started.isoformat(),
+            'duration_s': round(elapsed, 3),
+            'config': {
+                'target': self.url or 'in-process',
+                'settings': settings.SETTINGS_MODULE,
+                'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'],
+                'database': connection.vendor,
+                'intake': intake,
+                'codec': options['codec'],
+                **{key: options[key] for key in (
+                    'clients', 'rooms', 'rounds', 'betting_time', 'spin_time',
+                    'bet_probability', 'bets_per_round', 'amounts', 'color_weights', 'seed',
+                )},
+            },
+            'connected': len(self.samples['connect']),
+            'messages_received': self.messages,
+            'connect': summarize(self.samples['connect']),
+            'first_state': summarize(self.samples['first_state']),
+            'bet_ack': summarize(self.samples['bet_ack']),
+            'fanout': {phase: summarize(self.samples[phase]) for phase in PHASES},
+            'errors': dict(self.errors),
+        }
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+            self.write_summary(report)
+        else:
+            self.stdout.write(text)
+
+    def load_in_process(self, options, intake):
+        """Game loop and clients in this process, on a throwaway database"""
+        with benchmark_database(), override_settings(ROULETTE_BET_INTAKE=intake):
+            self.create_players(options['clients'])
+            serial = connection.vendor == 'sqlite'
+            db_call = engine.db_call
+            if serial:
+                # In-memory SQLite cannot take the loop's writes from other threads
+                engine.db_call = database_sync_to_async
+            try:
+                started = timezone.now()
+                return started, async_to_sync(self.run)(options)
+            finally:
+                engine.db_call = db_call
+
+    def load_server(self, options):
+        """Clients against a running server, sharing its database and cache"""
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError('--url needs the server\'s settings: an in-memory database is not shared with it')
+        self.room_names = cache.get(ROOMS_KEY)
+        if not self.room_names:
+            raise CommandError('No rooms published in the cache: is run_roulette_game running with these settings?')
+        options['rooms'] = len(self.room_names)
+
+        self.create_players(options['clients'])
+        try:
+            started = timezone.now()
+            return started, self.run_on_reactor(options)
+        finally:
+            Session.objects.filter(session_key__in=[key for _, key in self.players]).delete()
+            User.objects.filter(pk__in=[user.pk for user, _ in self.players]).delete()
+
+    def run_on_reactor(self, options):
+        """run() inside the Twisted reactor, which drives autobahn's connections"""
+        from twisted.internet import reactor
+        outcome = []
+
+        def start():
+            run = asyncio.ensure_future(self.run(options))
+            run.add_done_callback(lambda done: (outcome.append(done), reactor.stop()))
+
+        # Called from the running loop: startup triggers fire before it runs
+        reactor.callLater(0, start)
+        reactor.run()
+        return outcome[0].result()
+
+    def configure(self, options):
+        if options['clients'] < 1 or options['rooms'] < 1 or options['rounds'] < 1:
+            raise CommandError('--clients, --rooms and --rounds must be positive')
+        self.url = options['url']
+        if self.url:
+            parsed = urlparse(self.url)
+            if parsed.scheme not in ('ws', 'wss') or not parsed.hostname:
+                raise CommandError('--url must look like ws://host:port')
+            if options['intake']:
+                raise CommandError('--intake applies to the in-process game loop; set ROULETTE_BET_INTAKE on the server')
+            if parsed.path in ('', '/'):
+                self.url = parsed._replace(path='/ws/roulette/').geturl()
+            self.origin = options['origin'] or f'http://{parsed.hostname}'
+            self.transport = NetworkSocket
+            defaults = engine.RouletteRoom.BETTING_TIME, engine.RouletteRoom.SPIN_ANIMATION_TIME
+        else:
+            self.transport = CommunicatorSocket
+            self.application = URLRouter(websocket_urlpatterns)
+            defaults = 5.0, 2.0
+        for key, default in zip(('betting_time', 'spin_time'), defaults):
+            if options[key] is None:
+                options[key] = default
+        try:
+            self.amounts = [int(a) for a in options['amounts'].split(',')]
+            weights = dict(item.split('=') for item in options['color_weights'].split(','))
+            self.colors = list(weights)
+            self.color_weights = [float(w) for w in weights.values()]
+        except ValueError:
+            raise CommandError('Invalid --amounts or --color-weights')
+        if not set(self.colors) <= set(WHEEL_CONFIG):
+            raise CommandError(f'--color-weights colors must be among {", ".join(WHEEL_CONFIG)}')
+
+        self.rng = random.Random(options['seed'])  # nosec B311 - load pattern, not security
+        self.bet_probability = options['bet_probability']
+        self.bets_per_round = options['bets_per_round']
+        self.spin_time = options['spin_time']
+        self.timeout = options['timeout']
+        self.codec = COMPACT if options['codec'] == 'compact' else JSON
+        self.subprotocols = [COMPACT_SUBPROTOCOL] if options['codec'] == 'compact' else []
+        self.room_names = []
+        for _ in range(options['rooms']):
+            self.room_names.append(next_room_name(self.room_names))
+        self.samples = {name: [] for name in ('connect', 'first_state', 'bet_ack', *PHASES)}
+        self.errors = Counter()
+        self.messages = 0
+
+    def create_players(self, count):
+        """Users with a practically unlimited balance, each logged in with a live session"""
+        run = secrets.token_hex(4)
+        users = User.objects.bulk_create(
+            [User(username=f'load_{run}_{i}', balance=10 ** 15) for i in range(count)]
+        )
+        expires = timezone.now() + timedelta(days=1)
+        store = SessionStore()
+        sessions = Session.objects.bulk_create([
+            Session(session_key=secrets.token_hex(16), expire_date=expires, session_data=store.encode({
+                SESSION_KEY: str(user.pk),
+                BACKEND_SESSION_KEY: settings.AUTHENTICATION_BACKENDS[0],
+                HASH_SESSION_KEY: user.get_session_auth_hash(),
+            }))
+            for user in users
+        ])
+        self.players = list(zip(users, [s.session_key for s in sessions]))
+
+    async def run(self, options):
+        names = self.room_names
+        self.rounds_seen = {name: set() for name in names}
+        self.rounds_wanted = options['rounds']
+        self.done = asyncio.Event()
+
+        start = time.perf_counter()
+        rooms = []
+        if not self.url:
+            wheel = TimerWheel()
+            channel_layer = get_channel_layer()
+            rooms = [engine.RouletteRoom(name, wheel, channel_layer) for name in names]
+            for room in rooms:
+                room.BETTING_TIME = options['betting_time']
+                room.SPIN_ANIMATION_TIME = options['spin_time']
+            loop_task = asyncio.create_task(engine.run_rooms(wheel, rooms, channel_layer))
+            while sorted(await cache.aget(ROOMS_KEY) or []) != sorted(names):
+                await asyncio.sleep(0.05)
+
+        semaphore = asyncio.Semaphore(options['connect_concurrency'])
+        clients = [LoadClient(self, user, session_key) for user, session_key in self.players]
+
+        async def join(client):
+            async with semaphore:
+                try:
+                    connected = await client.connect()
+                except Exception as e:
+                    self.errors[f'connect: {type(e).__name__}'] += 1
+                    return None
+            return asyncio.create_task(client.listen()) if connected else None
+
+        listeners = await asyncio.gather(*(join(client) for client in clients))
+        if not any(listeners):
+            self.done.set()
+        try:
+            await asyncio.wait_for(self.done.wait(), self.timeout + options['rounds'] * (
+                options['betting_time'] + options['spin_time']
+            ))
+        except asyncio.TimeoutError:
+            self.errors['run timeout'] += 1
+        elapsed = time.perf_counter() - start
+
+        for room in rooms:
+            room.stop()
+        await asyncio.gather(*(
+            client.close(listener) for client, listener in zip(clients, listeners) if listener is not None
+        ))
+        if rooms:
+            await loop_task
+        return elapsed
+
+    def round_finished(self, room, round_number):
+        """Called for every round_result a client receives"""
+        seen = self.rounds_seen.get(room)
+        if seen is None:
+            return
+        seen.add(round_number)
+        if all(len(rounds) >= self.rounds_wanted for rounds in self.rounds_seen.values()):
+            self.done.set()
+
+    def write_summary(self, report):
+        self.stdout.write(f'{report["connected"]}/{report["config"]["clients"]} clients, '
+                          f'{report["messages_received"]} messages in {report["duration_s"]}s')
+        self.stdout.write(f'{"metric":<16} {"count":>8} {"p50 ms":>9} {"p99 ms":>9} {"max ms":>9}')
+        rows = [('connect', report['connect']), ('first_state', report['first_state']),
+                ('bet_ack', report['bet_ack'])] + list(report['fanout'].items())
+        for name, stats in rows:
+            self.stdout.write(
+                f'{name:<16} {stats["count"]:>8} {stats.get("p50", "-"):>9} '
+                f'{stats.get("p99", "-"):>9} {stats.get("max", "-"):>9}'
+            )
+        for message, count in report['errors'].items():
+            self.stdout.write(self.style.WARNING(f'{count} x {message}'))
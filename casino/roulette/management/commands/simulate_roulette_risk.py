@@ -0,0 +1,88 @@
+"""
+Simulate the house's roulette risk over millions of rounds.
+
+Replays the per-color bet mixes of recent completed rounds against spins
+drawn from WHEEL, in vectorized NumPy batches that can be spread over a
+process pool. Reports the simulated and theoretical RTP, the distribution of
+the house's loss per hour of play and the worst-case liability of one round.
+Reads the live database but never writes to it.
+
+Requires NumPy. Run with: python manage.py simulate_roulette_risk --rounds 10000000 --workers 4
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from casino.roulette.engine import RouletteRoom
+from casino.roulette.risk import COLORS, load_bet_mix, simulate_batch, theoretical_rtp, worst_case_liability
+
+
+class Command(BaseCommand):
+    help = 'Simulates roulette RTP, hourly loss distribution and worst-case liability'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=1_000_000,
+                            help='Rounds to simulate')
+        parser.add_argument('--batch-size', type=int, default=200_000,
+                            help='Rounds per vectorized batch (rounded to whole hours)')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes to spread the batches over')
+        parser.add_argument('--days', type=int, default=30,
+                            help='Replay bet mixes of rounds from the last DAYS days')
+        parser.add_argument('--percentiles', default='50,90,99,99.9',
+                            help='Comma-separated percentiles of the hourly loss')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            import numpy as np
+        except ImportError:
+            raise CommandError('simulate_roulette_risk requires NumPy (pip install numpy)')
+
+        since = timezone.now() - timedelta(days=options['days'])
+        mix = load_bet_mix(since)
+        if not mix:
+            raise CommandError(f'No completed rounds with bets since {since:%Y-%m-%d}')
+
+        rounds_per_hour = round(3600 / (RouletteRoom.BETTING_TIME + RouletteRoom.SPIN_ANIMATION_TIME))
+        batch = max(1, options['batch_size'] // rounds_per_hour) * rounds_per_hour
+        hours = max(1, options['rounds'] // rounds_per_hour)
+        batches = [batch] * (hours * rounds_per_hour // batch)
+        if hours * rounds_per_hour % batch:
+            batches.append(hours * rounds_per_hour % batch)
+        seeds = np.random.SeedSequence(options['seed']).spawn(len(batches))
+
+        self.stdout.write(
+            f'Replaying {len(mix)} rounds since {since:%Y-%m-%d} over {sum(batches)} simulated rounds '
+            f'({hours} h at {rounds_per_hour} rounds/h)'
+        )
+        start = time.perf_counter()
+        jobs = ([mix] * len(batches), batches, [rounds_per_hour] * len(batches), seeds)
+        if options['workers'] > 1:
+            with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(simulate_batch, *jobs))
+        else:
+            results = list(map(simulate_batch, *jobs))
+        elapsed = time.perf_counter() - start
+
+        wagered = sum(result[0] for result in results)
+        paid = sum(result[1] for result in results)
+        losses = -np.concatenate([result[2] for result in results])
+
+        rtp = theoretical_rtp()
+        stakes = np.asarray(mix, dtype=np.int64).sum(axis=0)
+        expected_rtp = sum(stakes[i] * rtp[color] for i, color in enumerate(COLORS)) / stakes.sum()
+
+        self.stdout.write(f'Simulated in {elapsed:.1f}s ({sum(batches) / elapsed:,.0f} rounds/s)')
+        self.stdout.write(f'RTP: {paid / wagered:.4%} simulated, {expected_rtp:.4%} expected for this mix')
+        self.stdout.write(f'House edge: {wagered - paid} on {wagered} wagered')
+        self.stdout.write(f'Hours the house lost: {(losses > 0).mean():.2%}')
+
+        self.stdout.write(f'{"percentile":>10} {"loss/hour":>12}')
+        percentiles = [float(p) for p in options['percentiles'].split(',')]
+        for p, loss in zip(percentiles, np.percentile(losses, percentiles)):
+            self.stdout.write(f'{p:>10g} {loss:>12.0f}')
+        self.stdout.write(f'Worst simulated hour: {losses.max():.0f}')
+        self.stdout.write(f'Worst-case liability of one round: {worst_case_liability(mix)}')
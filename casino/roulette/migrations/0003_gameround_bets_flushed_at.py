@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roulette', '0002_alter_bet_amount_alter_bet_payout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameround',
+            name='bets_flushed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roulette', '0003_gameround_bets_flushed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameround',
+            name='room',
+            field=models.CharField(default='table-1', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='gameround',
+            name='round_number',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='gameround',
+            unique_together={('room', 'round_number')},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roulette', '0005_workerlease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bet',
+            name='settled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='gameround',
+            name='status',
+            field=models.CharField(choices=[('BETTING', 'Betting Phase'), ('SPINNING', 'Spinning Phase'), ('COMPLETED', 'Completed'), ('REFUNDED', 'Refunded')], default='BETTING', max_length=10),
+        ),
+    ]
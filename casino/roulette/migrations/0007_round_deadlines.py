@@ -0,0 +1,28 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roulette', '0006_round_phases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameround',
+            name='betting_ends_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='gameround',
+            name='spin_ends_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='gameround',
+            name='status',
+            field=models.CharField(choices=[('SCHEDULED', 'Scheduled'), ('BETTING', 'Betting Phase'), ('SPINNING', 'Spinning Phase'), ('COMPLETED', 'Completed'), ('REFUNDED', 'Refunded')], default='BETTING', max_length=10),
+        ),
+    ]
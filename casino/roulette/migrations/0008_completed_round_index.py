@@ -0,0 +1,17 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roulette', '0007_round_deadlines'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gameround',
+            index=models.Index(condition=models.Q(('status', 'COMPLETED')), fields=['room', '-round_number'], include=('winning_color', 'winning_slot'), name='roulette_completed_round_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.10 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+import casino.roulette.models
+
+
+def fill_open_rounds(apps, schema_editor):
+    """Rounds still taking or awaiting settlement need their totals; finished ones are never read"""
+    GameRound = apps.get_model('roulette', 'GameRound')
+    Bet = apps.get_model('roulette', 'Bet')
+    colors = list(casino.roulette.models.COLORS)
+    for round_obj in GameRound.objects.filter(status__in=['BETTING', 'SPINNING']):
+        stats = casino.roulette.models.empty_color_stats()
+        rows = Bet.objects.filter(round=round_obj).values('color').annotate(count=Count('id'), total=Sum('amount'))
+        for row in rows:
+            stats[colors.index(row['color'])] = [row['count'], row['total']]
+        round_obj.color_stats = stats
+        round_obj.save(update_fields=['color_stats'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roulette', '0008_completed_round_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameround',
+            name='color_stats',
+            field=models.JSONField(default=casino.roulette.models.empty_color_stats),
+        ),
+        migrations.RunPython(fill_open_rounds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.10 on 2026-10-18 02:51
+
+from django.db import migrations, models
+
+COLORS = ['GRAY', 'RED', 'BLUE', 'GOLD']
+
+
+def copy_open_rounds(apps, schema_editor):
+    """Carry the JSON aggregates of rounds still taking or awaiting settlement over to the counters"""
+    GameRound = apps.get_model('roulette', 'GameRound')
+    for round_obj in GameRound.objects.filter(status__in=['BETTING', 'SPINNING']):
+        fields = {}
+        for color, (count, total) in zip(COLORS, round_obj.color_stats):
+            fields[f'{color.lower()}_count'] = count
+            fields[f'{color.lower()}_total'] = total
+        GameRound.objects.filter(pk=round_obj.pk).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roulette', '0009_gameround_color_stats'),
+    ]
+
+    operations = [
+        *(
+            migrations.AddField(
+                model_name='gameround',
+                name=f'{color.lower()}_{counter}',
+                field=models.BigIntegerField(default=0),
+            )
+            for color in COLORS for counter in ('count', 'total')
+        ),
+        migrations.RunPython(copy_open_rounds, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='gameround',
+            name='color_stats',
+        ),
+    ]
@@ -1,17 +1,43 @@
-from django.db import models
+from django.db import connection, models
 from casino.login.models import User
 from auditlog.registry import auditlog
+from .game_logic import WHEEL_CONFIG, color_liability
+
+COLORS = list(WHEEL_CONFIG)
+
+
+class PhaseError(Exception):
+    """A round was asked to move to a phase it cannot reach from its current one"""
+
+
+def empty_color_stats():
+    """[count, sum] of the bets on each color, in WHEEL_CONFIG order (migration 0009 still uses it)"""
+    return [[0, 0] for _ in COLORS]
 
 
 class GameRound(models.Model):
     """Represents a single 10-second roulette round"""
 
     STATUS_CHOICES = [
+        ('SCHEDULED', 'Scheduled'),
         ('BETTING', 'Betting Phase'),
         ('SPINNING', 'Spinning Phase'),
         ('COMPLETED', 'Completed'),
+        ('REFUNDED', 'Refunded'),
     ]
 
+    # Phases only move forward; COMPLETED and REFUNDED are final
+    TRANSITIONS = {
+        'SCHEDULED': ('BETTING',),
+        'BETTING': ('SPINNING', 'REFUNDED'),
+        'SPINNING': ('COMPLETED',),
+        'COMPLETED': (),
+        'REFUNDED': (),
+    }
+
+    # Rounds a crashed worker can leave behind
+    OPEN_STATUSES = ('BETTING', 'SPINNING')
+
     COLOR_CHOICES = [
         ('GRAY', 'Gray'),
         ('RED', 'Red'),
@@ -20,18 +46,122 @@ class GameRound(models.Model):
     ]
 
     id = models.AutoField(primary_key=True)
-    round_number = models.IntegerField(unique=True)
+    room = models.CharField(max_length=32, default='table-1')
+    round_number = models.IntegerField()
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='BETTING')
     winning_color = models.CharField(max_length=4, choices=COLOR_CHOICES, null=True, blank=True)
     winning_slot = models.IntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     spin_time = models.DateTimeField(null=True, blank=True)
+    # Planned phase deadlines, set when the round is scheduled
+    betting_ends_at = models.DateTimeField(null=True, blank=True)
+    spin_ends_at = models.DateTimeField(null=True, blank=True)
+    bets_flushed_at = models.DateTimeField(null=True, blank=True)
+    # Per-color bet counts and sums, stored from the Bet rows when betting closes
+    gray_count = models.BigIntegerField(default=0)
+    gray_total = models.BigIntegerField(default=0)
+    red_count = models.BigIntegerField(default=0)
+    red_total = models.BigIntegerField(default=0)
+    blue_count = models.BigIntegerField(default=0)
+    blue_total = models.BigIntegerField(default=0)
+    gold_count = models.BigIntegerField(default=0)
+    gold_total = models.BigIntegerField(default=0)
 
     class Meta:
         ordering = ['-round_number']
+        unique_together = ['room', 'round_number']
+        indexes = [
+            # Keyset pages of results are index-only scans (include is PostgreSQL only)
+            models.Index(
+                fields=['room', '-round_number'],
+                include=['winning_color', 'winning_slot'],
+                condition=models.Q(status='COMPLETED'),
+                name='roulette_completed_round_idx',
+            ),
+        ]
 
     def __str__(self):
-        return f"Round {self.round_number} - {self.status}"
+        return f"Round {self.round_number} ({self.room}) - {self.status}"
+
+    def advance(self, status, **fields):
+        """
+        Move the round to `status`, saving `fields` with it.
+
+        The stored status is re-read under a row lock, so a round is never
+        moved twice (e.g. by a worker and by crash recovery). Call inside a
+        transaction together with the work the phase change stands for.
+
+        Raises:
+            PhaseError: If the stored status differs from this instance's
+                or does not allow the transition
+        """
+        stored = GameRound.objects.select_for_update().values_list('status', flat=True).get(pk=self.pk)
+        if stored != self.status or status not in self.TRANSITIONS[stored]:
+            raise PhaseError(f"Round {self.round_number} ({self.room}): {stored} -> {status} not allowed")
+        if stored == 'BETTING':
+            # Bets still checking the round hold a share lock, so all of them are committed by now
+            fields = {**self.count_bets(), **fields}
+        self.status = status
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.save(update_fields=['status', *fields])
+
+    @property
+    def balance_ref(self):
+        """game_ref of the round's balance transactions"""
+        return f"roulette:{self.room}:{self.round_number}"
+
+    def accepts_bets(self):
+        """
+        Whether the round is still BETTING, share-locking its row until commit.
+
+        Bets do not block each other on the lock, but advance() waits for it,
+        so a bet that sees BETTING here is counted when betting closes.
+        SQLite has no row locks; its writers are serialized anyway.
+        """
+        rows = GameRound.objects.filter(pk=self.pk, status='BETTING')
+        if connection.vendor != 'postgresql':
+            return rows.select_for_update().exists()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT 1 FROM {connection.ops.quote_name(self._meta.db_table)} "
+                "WHERE id = %s AND status = %s FOR SHARE",
+                [self.pk, 'BETTING'],
+            )
+            return cursor.fetchone() is not None
+
+    def count_bets(self):
+        """Color counter fields computed from the round's Bet rows, in one grouped query"""
+        counters = {}
+        for color in COLORS:
+            counters[f'{color.lower()}_count'] = 0
+            counters[f'{color.lower()}_total'] = 0
+        rows = self.bets.order_by().values('color').annotate(n=models.Count('id'), total=models.Sum('amount'))
+        for row in rows:
+            counters[f"{row['color'].lower()}_count"] = row['n']
+            counters[f"{row['color'].lower()}_total"] = row['total']
+        return counters
+
+    def aggregates(self):
+        """
+        Bet count, per-color counts, totals and liability.
+
+        Closed rounds read their stored counters; a round still taking bets
+        groups its Bet rows instead, as its counters are only stored at close.
+        """
+        if self.status in ('SCHEDULED', 'BETTING'):
+            counters = self.count_bets()
+        else:
+            counters = {f'{color.lower()}_{kind}': getattr(self, f'{color.lower()}_{kind}')
+                        for color in COLORS for kind in ('count', 'total')}
+        counts = {color: counters[f'{color.lower()}_count'] for color in COLORS}
+        totals = {color: counters[f'{color.lower()}_total'] for color in COLORS}
+        return {
+            'total_bets': sum(counts.values()),
+            'counts': counts,
+            'totals': totals,
+            'liability': color_liability(totals),
+        }
 
 
 class Bet(models.Model):
@@ -51,6 +181,8 @@ class Bet(models.Model):
     amount = models.BigIntegerField()
     payout = models.BigIntegerField(default=0)
     placed_at = models.DateTimeField(auto_now_add=True)
+    # Set once the bet was paid out or refunded; settlement skips it afterwards
+    settled_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-placed_at']
@@ -60,6 +192,21 @@ class Bet(models.Model):
         return f"{self.user.username} - ${self.amount} on {self.color} (Round {self.round.round_number})"
 
 
+class WorkerLease(models.Model):
+    """Renewable lease electing the one active roulette game-loop worker"""
+
+    name = models.CharField(max_length=50, unique=True)
+    holder = models.CharField(max_length=100, blank=True)
+    acquired_at = models.DateTimeField(null=True, blank=True)
+    renewed_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+    # Seconds between the previous holder's last renewal and the latest takeover
+    takeover_latency = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder or 'nobody'} until {self.expires_at}"
+
+
 # Register models for audit logging
 auditlog.register(GameRound)
 auditlog.register(Bet)
@@ -0,0 +1,146 @@
+"""
+Per-socket outbound flow control for roulette WebSockets.
+
+ASGI gives a consumer no signal that a client's socket is draining, so a few
+clients on bad links could pile up unbounded buffered frames in Daphne.
+Clients therefore acknowledge what they received: an ack carries the number
+of frames received so far. Frames go out while the unacknowledged ones stay
+within the in-flight budget (frames and bytes); beyond it they wait in a
+bounded queue. A queued bets_delta or round_state is dropped once a newer
+frame of the same type is queued, since the newer one carries the full
+totals or state. Phase changes, payouts and errors are never dropped.
+
+A socket is slow when its queue overflows or stays blocked longer than the
+slow timeout; the consumer then closes it with a resume hint.
+
+The window only applies from a socket's first ack on. Clients that never ack
+(an old cached roulette.js, bots, third-party clients) get every frame sent
+straight away, as before flow control existed, and are never closed as slow.
+"""
+
+import time
+import weakref
+from collections import deque
+from django.conf import settings
+from casino.utils.metrics import counter, gauge, histogram
+
+# Frame types a newer frame of the same type makes obsolete
+SUPERSEDED = frozenset({'bets_delta', 'round_state'})
+
+QUEUE_DEPTH = histogram(
+    'roulette_socket_queue_depth', 'Frames waiting in a socket outbound queue when one is queued',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+FRAMES_DROPPED = counter(
+    'roulette_socket_frames_dropped_total', 'Queued frames dropped as superseded', labels=('type',),
+)
+FRAMES_SENT = counter(
+    'roulette_messages_out_total', 'Frames sent to clients', labels=('type',),
+)
+SLOW_DISCONNECTS = counter(
+    'roulette_socket_slow_disconnects_total', 'Sockets closed for not keeping up', labels=('reason',),
+)
+
+_queues = weakref.WeakSet()
+gauge('roulette_socket_queued_frames', 'Frames waiting in all outbound queues of this process') \
+    .set_function(lambda: sum(len(queue.queue) for queue in list(_queues)))
+gauge('roulette_socket_max_queue_depth', 'Deepest outbound queue of this process') \
+    .set_function(lambda: max((len(queue.queue) for queue in list(_queues)), default=0))
+
+
+class OutboundQueue:
+    """
+    Flow-controlled outbound frames of one socket.
+
+    Args:
+        send: Coroutine function taking the frame text
+        max_frames / max_bytes: Unacknowledged frames / bytes allowed in flight
+            (frame sizes are counted in characters of the frame text)
+        max_queued: Frames allowed to wait before the socket counts as slow
+        slow_timeout: Seconds the queue may stay blocked before the socket counts as slow
+        clock: Monotonic time source
+    """
+
+    def __init__(self, send, max_frames=None, max_bytes=None, max_queued=None, slow_timeout=None,
+                 clock=time.monotonic):
+        self.send = send
+        self.max_frames = max_frames or settings.ROULETTE_SOCKET_MAX_INFLIGHT_FRAMES
+        self.max_bytes = max_bytes or settings.ROULETTE_SOCKET_MAX_INFLIGHT_BYTES
+        self.max_queued = max_queued or settings.ROULETTE_SOCKET_MAX_QUEUED
+        self.slow_timeout = slow_timeout or settings.ROULETTE_SOCKET_SLOW_TIMEOUT
+        self.clock = clock
+        self.sent = 0
+        self.acked = 0
+        # Set by the first ack: the client is known to ack, so its frames are windowed
+        self.windowed = False
+        self.in_flight = deque()
+        self.in_flight_bytes = 0
+        self.queue = deque()
+        self.blocked_since = None
+        self.slow = None
+        _queues.add(self)
+
+    def has_budget(self, size):
+        if not self.in_flight:
+            # A frame larger than max_bytes still goes out on an idle socket
+            return True
+        return len(self.in_flight) < self.max_frames and self.in_flight_bytes + size <= self.max_bytes
+
+    async def push(self, frame_type, text):
+        """
+        Send a frame now or queue it.
+
+        Returns False once the socket is slow (the reason is in self.slow).
+        """
+        if self.slow:
+            return False
+        if not self.windowed or (not self.queue and self.has_budget(len(text))):
+            await self.transmit(frame_type, text)
+            return True
+
+        if frame_type in SUPERSEDED:
+            for queued in [q for q in self.queue if q[0] == frame_type]:
+                self.queue.remove(queued)
+                FRAMES_DROPPED.inc(type=frame_type)
+        self.queue.append((frame_type, text))
+        QUEUE_DEPTH.observe(len(self.queue))
+        if self.blocked_since is None:
+            self.blocked_since = self.clock()
+        return self.check()
+
+    async def ack(self, received):
+        """The client has received `received` frames in total; send what now fits"""
+        if not isinstance(received, int) or not self.acked < received <= self.sent:
+            return not self.slow
+        if self.windowed:
+            for _ in range(received - self.acked):
+                self.in_flight_bytes -= self.in_flight.popleft()
+        else:
+            # Frames sent before the first ack were not tracked; the window starts empty
+            self.windowed = True
+        self.acked = received
+
+        while self.queue and self.has_budget(len(self.queue[0][1])) and not self.slow:
+            await self.transmit(*self.queue.popleft())
+        if not self.queue:
+            self.blocked_since = None
+        return self.check()
+
+    async def transmit(self, frame_type, text):
+        await self.send(text)
+        FRAMES_SENT.inc(type=frame_type)
+        self.sent += 1
+        if self.windowed:
+            self.in_flight.append(len(text))
+            self.in_flight_bytes += len(text)
+
+    def check(self):
+        if self.slow is None:
+            if len(self.queue) > self.max_queued:
+                self.slow = 'overflow'
+            elif self.blocked_since is not None and self.clock() - self.blocked_since > self.slow_timeout:
+                self.slow = 'timeout'
+            if self.slow:
+                SLOW_DISCONNECTS.inc(reason=self.slow)
+                self.queue.clear()
+        return self.slow is None
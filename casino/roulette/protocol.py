@@ -0,0 +1,145 @@
+"""
+Wire codecs for the roulette WebSocket.
+
+Clients pick a codec through the WebSocket subprotocol:
+
+    (none)                  json    - {"type": ..., ...} objects (default)
+    roulette.compact.v1     compact - positional arrays with integer codes
+
+A compact frame is [event_code, field_1, field_2, ...] with fields in the
+order of EVENT_FIELDS; colors and round statuses are sent as their index in
+COLORS / STATUSES. New fields and events are only ever appended. static/js/roulette.js
+mirrors these tables.
+"""
+
+import json
+from .game_logic import WHEEL_CONFIG
+
+COMPACT_SUBPROTOCOL = 'roulette.compact.v1'
+
+COLORS = list(WHEEL_CONFIG)
+STATUSES = ['BETTING', 'SPINNING', 'COMPLETED']
+
+# Message type -> field order; the event code is the position in this table
+EVENT_FIELDS = {
+    # Server -> client
+    'round_state': ('round_number', 'status', 'time_remaining', 'total_bets', 'totals', 'history', 'bets',
+                    'betting_ends_at', 'spin_ends_at', 'counts', 'liability'),
+    'round_starting': ('round_number', 'time_remaining', 'betting_ends_at', 'spin_ends_at'),
+    'bets_delta': ('round_number', 'totals', 'bets'),
+    'round_spinning': ('round_number', 'winning_color', 'winning_slot', 'spin_ends_at'),
+    'round_result': ('round_number', 'winning_color', 'winning_slot'),
+    'round_payout': ('round_number', 'your_payout', 'your_balance'),
+    'balance_update': ('balance',),
+    'error': ('message',),
+    # Client -> server
+    'place_bet': ('color', 'amount'),
+    'get_state': (),
+    # Paged bet list of a round (round_state only carries the largest bets)
+    'get_bets': ('round_number', 'after'),
+    'round_bets': ('round_number', 'bets', 'next'),
+    # Outbound flow control: frames received so far, and the slow-socket close notice
+    'ack': ('seq',),
+    'slow_consumer': ('retry_after',),
+}
+EVENTS = list(EVENT_FIELDS)
+EVENT_CODES = {name: code for code, name in enumerate(EVENTS)}
+
+
+def _pack_color(color):
+    return COLORS.index(color) if color in COLORS else None
+
+
+def _unpack_color(code):
+    return COLORS[code] if isinstance(code, int) and 0 <= code < len(COLORS) else None
+
+
+def _pack_per_color(values):
+    return [values[c] for c in COLORS]
+
+
+def _unpack_per_color(values):
+    return dict(zip(COLORS, values))
+
+
+def _pack_bets(bets):
+    return [[bet['username'], _pack_color(bet['color']), bet['amount']] for bet in bets]
+
+
+def _unpack_bets(bets):
+    return [{'username': u, 'color': _unpack_color(c), 'amount': a} for u, c, a in bets]
+
+
+# Fields with a compact representation: name -> (pack, unpack)
+FIELD_CODECS = {
+    'status': (STATUSES.index, STATUSES.__getitem__),
+    'color': (_pack_color, _unpack_color),
+    'winning_color': (_pack_color, _unpack_color),
+    'history': (lambda h: [_pack_color(c) for c in h], lambda h: [_unpack_color(c) for c in h]),
+    'totals': (_pack_per_color, _unpack_per_color),
+    'counts': (_pack_per_color, _unpack_per_color),
+    'liability': (_pack_per_color, _unpack_per_color),
+    'bets': (_pack_bets, _unpack_bets),
+}
+
+
+class JsonCodec:
+    """Self-describing JSON objects; what clients get unless they ask otherwise"""
+
+    name = 'json'
+    subprotocol = None
+
+    def encode(self, message):
+        return json.dumps(message)
+
+    def decode(self, text):
+        return json.loads(text)
+
+
+class CompactCodec:
+    """Positional arrays with integer event, color and status codes"""
+
+    name = 'compact'
+    subprotocol = COMPACT_SUBPROTOCOL
+
+    def encode(self, message):
+        fields = EVENT_FIELDS[message['type']]
+        values = [EVENT_CODES[message['type']]]
+        for field in fields:
+            value = message.get(field)
+            if value is not None and field in FIELD_CODECS:
+                value = FIELD_CODECS[field][0](value)
+            values.append(value)
+        return json.dumps(values, separators=(',', ':'))
+
+    def decode(self, text):
+        values = json.loads(text)
+        if (not isinstance(values, list) or not values or not isinstance(values[0], int)
+                or not 0 <= values[0] < len(EVENTS)):
+            return {'type': None}
+
+        message_type = EVENTS[values[0]]
+        message = {'type': message_type}
+        for field, value in zip(EVENT_FIELDS[message_type], values[1:]):
+            if value is not None and field in FIELD_CODECS:
+                value = FIELD_CODECS[field][1](value)
+            message[field] = value
+        return message
+
+
+JSON = JsonCodec()
+COMPACT = CompactCodec()
+CODECS = [JSON, COMPACT]
+
+
+def select_codec(subprotocols):
+    """Pick the codec for the subprotocols a client offered (JSON by default)"""
+    for codec in CODECS:
+        if codec.subprotocol is not None and codec.subprotocol in subprotocols:
+            return codec
+    return JSON
+
+
+def encode_frames(message):
+    """Serialize a broadcast once per codec: {codec name: frame text}"""
+    return {codec.name: codec.encode(message) for codec in CODECS}
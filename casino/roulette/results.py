@@ -0,0 +1,90 @@
+"""
+Recent round results of each room, for history scrolling.
+
+The game loop keeps the last ROULETTE_RESULTS_BUFFER results of every room
+in a ring buffer, appends to it when a round settles and publishes it to the
+Django cache. /api/roulette/rounds/ pages through it with a round_number
+cursor and only reads the database for older rounds, with a keyset query
+served by the covering index on completed rounds.
+"""
+
+from collections import deque
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from .models import GameRound
+
+RESULTS_KEY = 'roulette:results:{}'
+RESULT_FIELDS = ('round_number', 'winning_color', 'winning_slot')
+
+
+def completed_rounds(room):
+    return GameRound.objects.filter(room=room, status='COMPLETED')
+
+
+def query_results(room, before=None, limit=None):
+    """Newest completed rounds of a room below round `before`, straight from the database"""
+    rounds = completed_rounds(room)
+    if before is not None:
+        rounds = rounds.filter(round_number__lt=before)
+    return list(rounds.order_by('-round_number').values(*RESULT_FIELDS)[:limit])
+
+
+class ResultBuffer:
+    """
+    Ring buffer of a room's latest results, newest first.
+
+    Only the game loop writes to it; the API reads the published dict.
+    """
+
+    def __init__(self, room, results=(), size=None):
+        self.room = room
+        self.size = size or settings.ROULETTE_RESULTS_BUFFER
+        self.results = deque(results, maxlen=self.size)
+
+    def add(self, round_number, winning_color, winning_slot):
+        self.results.appendleft({
+            'round_number': round_number,
+            'winning_color': winning_color,
+            'winning_slot': winning_slot,
+        })
+
+    def colors(self, count):
+        return [result['winning_color'] for result in list(self.results)[:count]]
+
+    def as_dict(self):
+        return {
+            'results': list(self.results),
+            # Until the buffer fills up it holds every completed round
+            'complete': len(self.results) < self.size,
+        }
+
+    async def publish(self):
+        """Store the buffer in the shared cache without serializing rooms"""
+        await sync_to_async(cache.set, thread_sensitive=False)(
+            RESULTS_KEY.format(self.room), self.as_dict(), None
+        )
+
+
+def buffered_page(published, before, limit):
+    """
+    A page of results from a published buffer, or None if the page reaches
+    past the rounds it holds.
+    """
+    page = []
+    for result in published['results']:
+        if before is None or result['round_number'] < before:
+            page.append(result)
+            if len(page) == limit:
+                return page
+    return page if published['complete'] else None
+
+
+def get_results_page(room, before=None, limit=50):
+    """Up to `limit` completed rounds of a room below round `before`, newest first"""
+    published = cache.get(RESULTS_KEY.format(room))
+    if published is not None:
+        page = buffered_page(published, before, limit)
+        if page is not None:
+            return page
+    return query_results(room, before, limit)
@@ -0,0 +1,71 @@
+"""
+Monte Carlo risk model of the roulette wheel.
+
+Real rounds are replayed as bet mixes: the total stake on each color of one
+round. The simulator draws mixes and spins from WHEEL in vectorized batches
+and sums the house result per hour of play. NumPy is imported lazily, so the
+game itself never depends on it.
+"""
+
+from django.db.models import Sum
+from .game_logic import WHEEL, WHEEL_CONFIG
+from .models import Bet
+
+COLORS = list(WHEEL_CONFIG)
+
+
+def load_bet_mix(since):
+    """Per-color stakes ([GRAY, RED, BLUE, GOLD]) of every completed round with bets placed since `since`"""
+    rows = (
+        Bet.objects.filter(placed_at__gte=since, round__status='COMPLETED')
+        .values('round_id', 'color')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    mix = {}
+    for row in rows:
+        mix.setdefault(row['round_id'], [0] * len(COLORS))[COLORS.index(row['color'])] += row['total']
+    return list(mix.values())
+
+
+def theoretical_rtp():
+    """Return to player of a single bet on each color"""
+    return {
+        color: WHEEL.count(color) / len(WHEEL) * config['multiplier']
+        for color, config in WHEEL_CONFIG.items()
+    }
+
+
+def worst_case_liability(mix):
+    """Largest amount the house can lose on one round of `mix`: the costliest color hitting"""
+    multipliers = [WHEEL_CONFIG[color]['multiplier'] for color in COLORS]
+    return max(
+        (max(int(stake * multiplier) for stake, multiplier in zip(stakes, multipliers)) - sum(stakes)
+         for stakes in mix),
+        default=0,
+    )
+
+
+def simulate_batch(mix, rounds, rounds_per_hour, seed):
+    """
+    Play `rounds` rounds (a multiple of rounds_per_hour) drawn from `mix`.
+
+    Runs in a worker process when the simulation is spread over a pool, so
+    it only takes and returns picklable values.
+
+    Returns:
+        tuple: (total wagered, total paid out, house result of every hour)
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    stakes = np.asarray(mix, dtype=np.int64)
+    wheel = np.array([COLORS.index(color) for color in WHEEL])
+    multipliers = np.array([WHEEL_CONFIG[color]['multiplier'] for color in COLORS], dtype=np.int64)
+
+    sampled = stakes[rng.integers(0, len(stakes), rounds)]
+    colors = wheel[rng.integers(0, len(wheel), rounds)]
+    wagered = sampled.sum(axis=1)
+    paid = sampled[np.arange(rounds), colors] * multipliers[colors]
+    hourly = (wagered - paid).reshape(-1, rounds_per_hour).sum(axis=1)
+    return int(wagered.sum()), int(paid.sum()), hourly
@@ -0,0 +1,174 @@
+"""
+Roulette room registry and player placement.
+
+Every room is an independent table with its own rounds, channel-layer group
+and snapshot. The game loop publishes the list of rooms it hosts; pages and
+consumers place each user on a room with a consistent-hash ring, so opening
+a room moves only about 1/n of the players. Consumers keep per-room
+connection counts that the game loop uses to open new rooms.
+
+Each web process counts its own sockets and writes its count into the room's
+entry with an expiry, refreshed by a heartbeat while it has sockets open.
+A process that dies without closing its sockets stops refreshing, so its
+count drops out after CONNECTIONS_TTL instead of inflating the room forever.
+Entries are read, changed and written back, so a write racing another
+process can lose that process's count until its next heartbeat.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import time
+from bisect import bisect
+from collections import Counter
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+ROOMS_KEY = 'roulette:rooms'
+# {process id: (open sockets, expiry as Unix time)} per room
+CONNECTIONS_KEY = 'roulette:connections:{}'
+CONNECTIONS_TTL = 30
+CONNECTIONS_HEARTBEAT = 10
+RING_REPLICAS = 100
+
+PROCESS_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+# Rooms are named table-1, table-2, ... and the route accepts only such slugs
+ROOM_PREFIX = 'table-'
+ROOM_PATTERN = r'[a-z0-9-]{1,32}'
+
+
+def room_group_name(room):
+    """Channel-layer group of a room's sockets"""
+    return f'roulette_{room}'
+
+
+def initial_rooms():
+    return list(settings.ROULETTE_ROOMS)
+
+
+def next_room_name(rooms):
+    """First table-N name not in use"""
+    n = 1
+    while f'{ROOM_PREFIX}{n}' in rooms:
+        n += 1
+    return f'{ROOM_PREFIX}{n}'
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring with RING_REPLICAS virtual nodes per room"""
+
+    def __init__(self, rooms):
+        points = sorted(
+            (_hash(f'{room}#{i}'), room) for room in rooms for i in range(RING_REPLICAS)
+        )
+        self.hashes = [h for h, _ in points]
+        self.rooms = [room for _, room in points]
+
+    def room_for(self, key):
+        index = bisect(self.hashes, _hash(str(key))) % len(self.hashes)
+        return self.rooms[index]
+
+
+@lru_cache(maxsize=32)
+def _ring(rooms):
+    return HashRing(rooms)
+
+
+def assign_room(user_id, rooms):
+    """The room a user plays in, given the active rooms"""
+    return _ring(tuple(sorted(rooms))).room_for(user_id)
+
+
+def get_active_rooms():
+    """Rooms the game loop currently hosts (the configured ones until it publishes)"""
+    return cache.get(ROOMS_KEY) or initial_rooms()
+
+
+async def aget_active_rooms():
+    return await cache.aget(ROOMS_KEY) or initial_rooms()
+
+
+def publish_rooms(rooms):
+    cache.set(ROOMS_KEY, list(rooms), None)
+
+
+# Sockets of this process per room, and the task refreshing their entries
+_local_connections = Counter()
+_heartbeat = None
+
+
+async def connection_opened(room):
+    global _heartbeat
+    _local_connections[room] += 1
+    if _heartbeat is None or _heartbeat.done() or _heartbeat.get_loop() is not asyncio.get_running_loop():
+        _heartbeat = asyncio.create_task(_refresh_connections())
+    await publish_connections(room)
+
+
+async def connection_closed(room):
+    _local_connections[room] = max(_local_connections[room] - 1, 0)
+    await publish_connections(room)
+    if not any(_local_connections.values()) and _heartbeat is not None:
+        _local_connections.clear()
+        _heartbeat.cancel()
+
+
+async def publish_connections(room):
+    """Write this process's socket count into the room's entry, dropping expired counts"""
+    key = CONNECTIONS_KEY.format(room)
+    now = time.time()
+    entries = {
+        process: entry for process, entry in (await cache.aget(key) or {}).items()
+        if entry[1] > now and process != PROCESS_ID
+    }
+    if _local_connections[room]:
+        entries[PROCESS_ID] = (_local_connections[room], now + CONNECTIONS_TTL)
+    await cache.aset(key, entries, CONNECTIONS_TTL)
+
+
+async def _refresh_connections():
+    while True:
+        await asyncio.sleep(CONNECTIONS_HEARTBEAT)
+        for room in list(_local_connections):
+            try:
+                await publish_connections(room)
+            except Exception:
+                logger.exception('Could not refresh the connection count of %s', room)
+
+
+def connection_counts(rooms):
+    """Open sockets per room, as counted by the live processes"""
+    keys = {room: CONNECTIONS_KEY.format(room) for room in rooms}
+    entries = cache.get_many(list(keys.values()))
+    now = time.time()
+    return {
+        room: sum(count for count, expires in entries.get(key, {}).values() if expires > now)
+        for room, key in keys.items()
+    }
+
+
+def room_to_open(rooms):
+    """
+    Name of a room to open, or None.
+
+    A room opens once one of `rooms` passes ROULETTE_ROOM_CAPACITY
+    connections, unless some room is still under half of it (a recently
+    opened room that is filling up), up to ROULETTE_MAX_ROOMS rooms.
+    """
+    if len(rooms) >= settings.ROULETTE_MAX_ROOMS:
+        return None
+    counts = connection_counts(rooms).values()
+    capacity = settings.ROULETTE_ROOM_CAPACITY
+    if max(counts, default=0) < capacity or min(counts, default=0) < capacity // 2:
+        return None
+    return next_room_name(rooms)
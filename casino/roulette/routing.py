@@ -5,7 +5,10 @@ Maps ws:// connections to the appropriate consumer.
 
 from django.urls import re_path
 from . import consumers
+from .rooms import ROOM_PATTERN
 
 websocket_urlpatterns = [
+    re_path(rf'ws/roulette/(?P<room>{ROOM_PATTERN})/$', consumers.RouletteConsumer.as_asgi()),
+    # No room given: the consumer assigns one
     re_path(r'ws/roulette/$', consumers.RouletteConsumer.as_asgi()),
 ]
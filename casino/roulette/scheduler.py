@@ -0,0 +1,141 @@
+"""
+Drift-free timer scheduling for the roulette game loop.
+
+All deadlines are absolute values on the monotonic clock, so time spent on
+database writes and broadcasts never pushes later phases back. A single
+hashed timing wheel serves every room hosted by the process.
+"""
+
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle:
+    """A callback scheduled on a TimerWheel"""
+
+    __slots__ = ('deadline', 'tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, tick, callback, args):
+        self.deadline = deadline
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel keyed on monotonic deadlines.
+
+    Timers land in slot (tick % size) and fire on the first tick at or after
+    their deadline. The wheel itself sleeps towards absolute tick times, so its
+    own scheduling error never accumulates either.
+
+    Args:
+        tick: Wheel resolution in seconds
+        size: Number of slots
+        clock: Monotonic clock function (injectable for tests)
+    """
+
+    def __init__(self, tick=0.02, size=512, clock=time.monotonic):
+        self.tick = tick
+        self.size = size
+        self.clock = clock
+        self.origin = clock()
+        self.current_tick = 0
+        self.slots = [[] for _ in range(size)]
+        self.pending = 0
+        self.max_lateness = 0.0
+        # Tasks of coroutine callbacks until they finish (the loop only keeps weak references)
+        self.tasks = set()
+        self._stopped = None
+
+    def now(self):
+        return self.clock()
+
+    def call_at(self, deadline, callback, *args):
+        """
+        Schedule callback(*args) at an absolute monotonic deadline.
+
+        Coroutine results are wrapped in a task, whose failure is logged.
+        Returns a TimerHandle.
+        """
+        tick = max(math.ceil((deadline - self.origin) / self.tick - 1e-9), self.current_tick + 1)
+        handle = TimerHandle(deadline, tick, callback, args)
+        self.slots[tick % self.size].append(handle)
+        self.pending += 1
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    async def sleep_until(self, deadline):
+        """Suspend the caller until the wheel reaches `deadline`"""
+        future = asyncio.get_running_loop().create_future()
+        handle = self.call_at(deadline, _resolve, future)
+        try:
+            await future
+        finally:
+            handle.cancel()
+
+    def process(self, now):
+        """Fire every timer due up to `now`; returns the number fired"""
+        target = math.floor((now - self.origin) / self.tick + 1e-9)
+        fired = 0
+        while self.current_tick < target:
+            self.current_tick += 1
+            fired += self._fire_slot(self.current_tick, now)
+        return fired
+
+    def _fire_slot(self, tick, now):
+        slot = self.slots[tick % self.size]
+        if not slot:
+            return 0
+
+        due = [h for h in slot if h.tick <= tick]
+        slot[:] = [h for h in slot if h.tick > tick]
+        self.pending -= len(due)
+
+        fired = 0
+        for handle in due:
+            if handle.cancelled:
+                continue
+            self.max_lateness = max(self.max_lateness, now - handle.deadline)
+            result = handle.callback(*handle.args)
+            if asyncio.iscoroutine(result):
+                task = asyncio.get_running_loop().create_task(result)
+                self.tasks.add(task)
+                task.add_done_callback(self._task_done)
+            fired += 1
+        return fired
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Timer callback %s failed', task.get_coro().__qualname__, exc_info=task.exception())
+
+    async def run(self):
+        """Drive the wheel until stop() is called"""
+        self._stopped = asyncio.Event()
+        while not self._stopped.is_set():
+            next_at = self.origin + (self.current_tick + 1) * self.tick
+            delay = next_at - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.process(self.clock())
+
+    def stop(self):
+        if self._stopped is not None:
+            self._stopped.set()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,133 @@
+"""
+Set-based settlement for roulette rounds.
+
+A round is settled with a fixed number of statements no matter how many bets
+it holds: winning bets get their payout in one UPDATE, winners' balances are
+credited through the balance service (one UPDATE ... RETURNING per
+TRANSACTION_BATCH_SIZE winners) and History rows are bulk-inserted.
+
+Settlement is idempotent: every bet gets settled_at when it is paid out or
+refunded, and only bets without it are touched, so running it again for a
+round (e.g. during crash recovery) never pays anyone twice.
+"""
+
+import logging
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from casino.base.models import History
+from casino.login.models import User
+from casino.utils.balance_tracker import apply_balance_changes
+from casino.utils.user_stats import ensure_stats, record_bets_of, record_wins_of
+from .game_logic import WHEEL_CONFIG
+from .models import Bet
+
+logger = logging.getLogger('auditlog')
+
+HISTORY_BATCH_SIZE = 1000
+
+
+def settle_round(round_obj, winning_color):
+    """
+    Pay out every bet of a round in one transaction.
+
+    Args:
+        round_obj: The GameRound being settled
+        winning_color: Color that won the spin
+
+    Returns:
+        Dict with 'total_bets', 'total_payout', 'winners' (list of
+        (user_id, payout) tuples) and 'payouts', mapping every bettor's
+        user_id to {'payout', 'balance'} after settlement. Bets settled
+        by an earlier call are counted but not paid again.
+    """
+    # Wheel multipliers are whole numbers, so payouts stay integral in SQL
+    multiplier = int(WHEEL_CONFIG[winning_color]['multiplier'])
+
+    with transaction.atomic():
+        round_bets = Bet.objects.filter(round=round_obj)
+        open_bets = round_bets.filter(settled_at__isnull=True)
+        winning_bets = open_bets.filter(color=winning_color)
+
+        # Stats rows first: History rows older than a stats row are left to the backfill
+        ensure_stats(winning_bets.values_list('user_id', flat=True))
+        now = timezone.now()
+
+        winning_bets.update(payout=F('amount') * multiplier)
+
+        # One bet per (user, round, color), so each winner has a single payout row
+        winners = list(winning_bets.values_list('user_id', 'payout'))
+        apply_balance_changes(dict(winners), 'roulette_win', round_obj.balance_ref)
+        record_wins_of(winning_bets)
+        History.objects.bulk_create(
+            [
+                History(u_id_id=user_id, amount=amount, cashout_time=now)
+                for user_id, amount in winners
+            ],
+            batch_size=HISTORY_BATCH_SIZE,
+        )
+        open_bets.update(settled_at=now)
+
+        total_bets = round_bets.count()
+
+        # Everything the game loop needs to notify bettors without further queries
+        payouts = {
+            row['user_id']: {'payout': row['total'], 'balance': None}
+            for row in round_bets.order_by().values('user_id').annotate(total=Sum('payout'))
+        }
+        bettors = User.objects.filter(pk__in=round_bets.values('user_id'))
+        for user_id, balance in bettors.values_list('pk', 'balance'):
+            payouts[user_id]['balance'] = balance
+
+    total_payout = sum(amount for _, amount in winners)
+    if winners:
+        logger.info(
+            f"[BALANCE] roulette round {round_obj.round_number}: credited "
+            f"{len(winners)} winners (+{total_payout}) | "
+            f"Reason: roulette_win_round_{round_obj.round_number}_{winning_color}"
+        )
+
+    return {
+        'total_bets': total_bets,
+        'total_payout': total_payout,
+        'winners': winners,
+        'payouts': payouts,
+    }
+
+
+def refund_round(round_obj):
+    """
+    Return the stakes of a round that never spun, in one transaction.
+
+    Only bets not settled yet are refunded, each bettor's balance is
+    credited once with their total stake. Refunds leave payout at 0.
+
+    Returns:
+        Dict with 'total_bets', 'total_refund' and 'refunds', mapping every
+        refunded user_id to the amount returned
+    """
+    now = timezone.now()
+
+    with transaction.atomic():
+        open_bets = Bet.objects.filter(round=round_obj, settled_at__isnull=True)
+        stakes = open_bets.order_by().values('user_id').annotate(total=Sum('amount'))
+
+        refunds = {row['user_id']: row['total'] for row in stakes}
+        apply_balance_changes(refunds, 'roulette_refund', round_obj.balance_ref)
+        # A refunded bet never happened as far as the stats are concerned
+        record_bets_of(open_bets, 'roulette', sign=-1)
+        total_bets = open_bets.update(settled_at=now)
+
+    total_refund = sum(refunds.values())
+    if refunds:
+        logger.info(
+            f"[BALANCE] roulette round {round_obj.round_number}: refunded "
+            f"{len(refunds)} bettors (+{total_refund}) | "
+            f"Reason: roulette_refund_round_{round_obj.round_number}"
+        )
+
+    return {
+        'total_bets': total_bets,
+        'total_refund': total_refund,
+        'refunds': refunds,
+    }
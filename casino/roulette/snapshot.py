@@ -0,0 +1,143 @@
+"""
+Live round snapshot shared between the game loop and the consumers.
+
+The game loop owns one RoundSnapshot per room and publishes it to the Django
+cache (Redis in production) whenever it changes. Consumers build round_state
+messages from the published copy, so connects and get_state requests run no
+database queries. Its size does not grow with the round: per-color counts and
+totals plus the TOP_BETS largest bets; clients page through the rest with
+get_bets.
+"""
+
+import heapq
+import itertools
+import time
+from collections import deque
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from .game_logic import WHEEL_CONFIG, color_liability
+
+SNAPSHOT_KEY = 'roulette:snapshot:{}'
+SNAPSHOT_TTL = 60 * 60
+TOP_BETS = 50
+HISTORY_SIZE = 10
+
+# Consumers of one process share a short-lived copy to absorb reconnect storms
+LOCAL_COPY_TTL = 0.25
+_local_copies = {}
+
+
+class RoundSnapshot:
+    """
+    Authoritative in-memory state of a room's current round.
+
+    Only the game loop writes to it; consumers read the published dict.
+    """
+
+    def __init__(self, room, history=()):
+        self.room = room
+        self.history = deque(history, maxlen=HISTORY_SIZE)
+        self.round_number = None
+        self.status = None
+        self.betting_ends_at = None
+        self.spin_ends_at = None
+        self.reset_bets()
+
+    def reset_bets(self):
+        self.totals = dict.fromkeys(WHEEL_CONFIG, 0)
+        self.counts = dict.fromkeys(WHEEL_CONFIG, 0)
+        self.total_bets = 0
+        # Min-heap of (amount, arrival, bet): the smallest of the top bets is evicted first
+        self.top_bets = []
+        self.arrivals = itertools.count()
+
+    def start_round(self, round_number, betting_ends_at, spin_ends_at=None):
+        """Open a new BETTING round with wall-clock phase deadlines"""
+        self.round_number = round_number
+        self.status = 'BETTING'
+        self.betting_ends_at = betting_ends_at
+        self.spin_ends_at = spin_ends_at
+        self.reset_bets()
+
+    def add_bet(self, round_number, username, color, amount):
+        """Record a bet; returns False if it belongs to another round"""
+        if round_number != self.round_number or color not in self.totals:
+            return False
+        self.totals[color] += amount
+        self.counts[color] += 1
+        self.total_bets += 1
+        entry = (amount, next(self.arrivals), {'username': username, 'color': color, 'amount': amount})
+        if len(self.top_bets) < TOP_BETS:
+            heapq.heappush(self.top_bets, entry)
+        else:
+            heapq.heappushpop(self.top_bets, entry)
+        return True
+
+    def start_spin(self):
+        self.status = 'SPINNING'
+
+    def complete(self, winning_color):
+        self.status = 'COMPLETED'
+        self.history.appendleft(winning_color)
+
+    def as_dict(self):
+        return {
+            'round_number': self.round_number,
+            'status': self.status,
+            'betting_ends_at': self.betting_ends_at,
+            'spin_ends_at': self.spin_ends_at,
+            'total_bets': self.total_bets,
+            'totals': dict(self.totals),
+            'counts': dict(self.counts),
+            'bets': [bet for _, _, bet in sorted(self.top_bets, reverse=True)],
+            'history': list(self.history),
+        }
+
+    async def publish(self):
+        """Store the snapshot in the shared cache without serializing rooms"""
+        await sync_to_async(cache.set, thread_sensitive=False)(
+            SNAPSHOT_KEY.format(self.room), self.as_dict(), SNAPSHOT_TTL
+        )
+
+
+async def load_snapshot(room):
+    """
+    Get the published snapshot of a room, or None if the game loop has not
+    published one yet.
+    """
+    now = time.monotonic()
+    local = _local_copies.get(room)
+    if local and local[0] > now:
+        return local[1]
+
+    snapshot = await cache.aget(SNAPSHOT_KEY.format(room))
+    if snapshot is not None:
+        _local_copies[room] = (now + LOCAL_COPY_TTL, snapshot)
+    return snapshot
+
+
+def invalidate_local_copy(room):
+    """Drop this process's copy, e.g. when a phase change is broadcast"""
+    _local_copies.pop(room, None)
+
+
+def round_state_message(snapshot):
+    """Build the round_state payload from a published snapshot"""
+    time_remaining = 0
+    if snapshot['status'] == 'BETTING' and snapshot['betting_ends_at']:
+        time_remaining = max(0, snapshot['betting_ends_at'] - time.time())
+
+    return {
+        'type': 'round_state',
+        'round_number': snapshot['round_number'],
+        'status': snapshot['status'],
+        'time_remaining': time_remaining,
+        'total_bets': snapshot['total_bets'],
+        'totals': snapshot['totals'],
+        'history': snapshot['history'],
+        'bets': snapshot['bets'],
+        'betting_ends_at': snapshot['betting_ends_at'],
+        'spin_ends_at': snapshot.get('spin_ends_at'),
+        'counts': snapshot.get('counts'),
+        'liability': color_liability(snapshot['totals']),
+    }
@@ -0,0 +1,2087 @@
+import asyncio
+import importlib.util
+import json
+import socket
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from asgiref.sync import async_to_sync
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from casino.base.models import History, UserStats
+from casino.login.models import User
+from casino.roulette.models import GameRound, Bet, PhaseError, WorkerLease
+from casino.roulette.outbound import OutboundQueue
+from casino.roulette.consumers import RouletteConsumer
+from casino.roulette.engine import RouletteRoom, frame_event, run_rooms, user_group_name
+from casino.roulette.leader import LeaderElection, acquire_lease, release_lease
+from casino.roulette.ledger import (
+    INSUFFICIENT_FUNDS, ROUND_CLOSED, LocalBetLedger, flush_entries, get_ledger,
+)
+from casino.roulette.protocol import (
+    COMPACT, COMPACT_SUBPROTOCOL, EVENT_FIELDS, JSON, encode_frames, select_codec,
+)
+from casino.roulette.rooms import (
+    CONNECTIONS_KEY, HashRing, assign_room, connection_counts, get_active_rooms, publish_rooms, room_to_open,
+)
+from casino.roulette.risk import load_bet_mix, simulate_batch, theoretical_rtp, worst_case_liability
+from casino.roulette.results import RESULTS_KEY, ResultBuffer, buffered_page
+from casino.roulette.scheduler import TimerWheel
+from casino.utils import metrics
+from casino.utils.session_cache import is_session_valid, revoke_session
+from casino.roulette.settlement import refund_round, settle_round
+from casino.roulette.snapshot import RoundSnapshot, TOP_BETS, invalidate_local_copy, round_state_message
+
+
+class SettleRoundTests(TestCase):
+    """Tests for set-based round settlement"""
+
+    def setUp(self):
+        self.round = GameRound.objects.create(round_number=1, status='SPINNING')
+        self.winner = User.objects.create_user(username="winner", password="testpass")  # nosec
+        self.loser = User.objects.create_user(username="loser", password="testpass")  # nosec
+
+    def place(self, user, color, amount):
+        return Bet.objects.create(user=user, round=self.round, color=color, amount=amount)
+
+    def test_winning_bets_get_payout(self):
+        """Test payout is amount times the color multiplier"""
+        win = self.place(self.winner, 'RED', 100)
+        lose = self.place(self.loser, 'GRAY', 100)
+
+        settle_round(self.round, 'RED')
+
+        win.refresh_from_db()
+        lose.refresh_from_db()
+        self.assertEqual(win.payout, 300)
+        self.assertEqual(lose.payout, 0)
+
+    def test_winners_credited_losers_untouched(self):
+        """Test only winners' balances change"""
+        self.place(self.winner, 'GOLD', 10)
+        self.place(self.loser, 'BLUE', 10)
+
+        settle_round(self.round, 'GOLD')
+
+        self.winner.refresh_from_db()
+        self.loser.refresh_from_db()
+        self.assertEqual(self.winner.balance, 500)
+        self.assertEqual(self.loser.balance, 0)
+
+    def test_user_with_several_colors_credited_once(self):
+        """Test a user betting on several colors only gets the winning payout"""
+        self.place(self.winner, 'GRAY', 50)
+        self.place(self.winner, 'RED', 50)
+
+        settle_round(self.round, 'GRAY')
+
+        self.winner.refresh_from_db()
+        self.assertEqual(self.winner.balance, 100)
+
+    def test_history_rows_only_for_winners(self):
+        """Test a History row is written per winning bet"""
+        self.place(self.winner, 'BLUE', 20)
+        self.place(self.loser, 'RED', 20)
+
+        settle_round(self.round, 'BLUE')
+
+        self.assertEqual(History.objects.filter(u_id=self.winner).get().amount, 100)
+        self.assertFalse(History.objects.filter(u_id=self.loser).exists())
+
+    def test_result_summary(self):
+        """Test the returned summary matches the round"""
+        self.place(self.winner, 'RED', 100)
+        self.place(self.loser, 'GRAY', 100)
+
+        result = settle_round(self.round, 'RED')
+
+        self.assertEqual(result['total_bets'], 2)
+        self.assertEqual(result['total_payout'], 300)
+        self.assertEqual(result['winners'], [(self.winner.pk, 300)])
+
+    def test_empty_round(self):
+        """Test settling a round without bets"""
+        result = settle_round(self.round, 'GRAY')
+
+        self.assertEqual(result['total_bets'], 0)
+        self.assertEqual(result['winners'], [])
+
+    def test_payout_map_covers_every_bettor(self):
+        """Test the payout map holds each bettor's payout and new balance"""
+        self.place(self.winner, 'RED', 100)
+        self.place(self.winner, 'GRAY', 20)
+        self.place(self.loser, 'GRAY', 100)
+
+        result = settle_round(self.round, 'RED')
+
+        self.assertEqual(result['payouts'], {
+            self.winner.pk: {'payout': 300, 'balance': 300},
+            self.loser.pk: {'payout': 0, 'balance': 0},
+        })
+
+    def test_query_count_independent_of_bet_count(self):
+        """Test settlement runs the same number of queries for 1 or 50 bets"""
+        self.place(self.winner, 'GRAY', 10)
+        with CaptureQueriesContext(connection) as small:
+            settle_round(self.round, 'GRAY')
+
+        other = GameRound.objects.create(round_number=2, status='SPINNING')
+        users = User.objects.bulk_create([User(username=f"u{i}") for i in range(50)])
+        Bet.objects.bulk_create([Bet(user=u, round=other, color='GRAY', amount=10) for u in users])
+        with CaptureQueriesContext(connection) as large:
+            settle_round(other, 'GRAY')
+
+        self.assertEqual(len(small), len(large))
+
+    def test_settling_twice_pays_once(self):
+        """Test a second settlement of the same round credits nobody again"""
+        self.place(self.winner, 'RED', 100)
+
+        settle_round(self.round, 'RED')
+        result = settle_round(self.round, 'RED')
+
+        self.winner.refresh_from_db()
+        self.assertEqual(self.winner.balance, 300)
+        self.assertEqual(result['winners'], [])
+        self.assertEqual(History.objects.filter(u_id=self.winner).count(), 1)
+        self.assertFalse(Bet.objects.filter(settled_at__isnull=True).exists())
+
+    def test_winner_stats_updated(self):
+        """Test settlement adds each win to the winner's stats"""
+        self.place(self.winner, 'RED', 100)
+        self.place(self.loser, 'GRAY', 100)
+
+        settle_round(self.round, 'RED')
+        settle_round(self.round, 'RED')
+
+        stats = UserStats.objects.get(user=self.winner)
+        self.assertEqual((stats.total_won, stats.biggest_win), (300, 300))
+        self.assertFalse(UserStats.objects.filter(user=self.loser, total_won__gt=0).exists())
+
+    def test_refund_takes_bets_out_of_stats(self):
+        """Test refunded bets no longer count as wagered"""
+        self.place(self.winner, 'RED', 100)
+        UserStats.objects.create(user=self.winner, total_wagered=100, roulette_bets=1)
+
+        refund_round(self.round)
+
+        stats = UserStats.objects.get(user=self.winner)
+        self.assertEqual((stats.total_wagered, stats.roulette_bets), (0, 0))
+
+    def test_refund_returns_stakes_once(self):
+        """Test a refund credits each bettor's total stake a single time"""
+        self.place(self.winner, 'RED', 100)
+        self.place(self.winner, 'GRAY', 20)
+        self.place(self.loser, 'GOLD', 5)
+
+        result = refund_round(self.round)
+        refund_round(self.round)
+
+        self.winner.refresh_from_db()
+        self.loser.refresh_from_db()
+        self.assertEqual((self.winner.balance, self.loser.balance), (120, 5))
+        self.assertEqual(result['refunds'], {self.winner.pk: 120, self.loser.pk: 5})
+        self.assertFalse(History.objects.exists())
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TimerWheelTests(SimpleTestCase):
+    """Tests for the hashed timing wheel"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.wheel = TimerWheel(tick=0.1, size=8, clock=self.clock)
+        self.fired = []
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        return self.wheel.process(self.clock.now)
+
+    def test_fires_at_deadline_in_order(self):
+        """Test timers fire on the first tick at or after their deadline"""
+        self.wheel.call_later(0.35, self.fired.append, 'b')
+        self.wheel.call_later(0.15, self.fired.append, 'a')
+
+        self.advance(0.1)
+        self.assertEqual(self.fired, [])
+        self.advance(0.1)
+        self.assertEqual(self.fired, ['a'])
+        self.advance(0.2)
+        self.assertEqual(self.fired, ['a', 'b'])
+
+    def test_cancelled_timer_does_not_fire(self):
+        """Test cancelled handles are skipped"""
+        handle = self.wheel.call_later(0.1, self.fired.append, 'x')
+        handle.cancel()
+
+        self.advance(1)
+
+        self.assertEqual(self.fired, [])
+        self.assertEqual(self.wheel.pending, 0)
+
+    def test_deadline_beyond_wheel_span(self):
+        """Test timers further out than one wheel revolution wait their turn"""
+        self.wheel.call_later(2.0, self.fired.append, 'late')
+
+        self.advance(0.8)
+        self.advance(0.8)
+        self.assertEqual(self.fired, [])
+        self.advance(0.5)
+        self.assertEqual(self.fired, ['late'])
+
+    def test_past_deadline_fires_next_tick(self):
+        """Test a deadline already in the past fires on the next tick"""
+        self.wheel.call_at(self.clock.now - 5, self.fired.append, 'now')
+
+        self.advance(0.1)
+
+        self.assertEqual(self.fired, ['now'])
+
+    async def test_coroutine_callback_kept_and_failure_logged(self):
+        """Test coroutine callbacks run as tasks held by the wheel, and their errors are logged"""
+        release = asyncio.Event()
+
+        async def wait():
+            await release.wait()
+
+        async def fail():
+            raise RuntimeError('publish failed')
+
+        self.wheel.call_later(0.1, wait)
+        self.wheel.call_later(0.1, fail)
+        self.advance(0.1)
+        self.assertEqual(len(self.wheel.tasks), 2)
+
+        with self.assertLogs('casino.roulette.scheduler', 'ERROR') as logs:
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+        self.assertIn('fail failed', logs.output[0])
+        self.assertIn('RuntimeError: publish failed', logs.output[0])
+        self.assertEqual(len(self.wheel.tasks), 1)
+
+        release.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        self.assertEqual(self.wheel.tasks, set())
+
+
+class StubRoom(RouletteRoom):
+    """RouletteRoom with slow, in-memory persistence instead of the ORM"""
+
+    BETTING_TIME = 0.1
+    SPIN_ANIMATION_TIME = 0.05
+    DB_LATENCY = 0.03
+
+    class FakeRound:
+        def __init__(self, number):
+            self.round_number = number
+            self.betting_ends_at = self.spin_ends_at = timezone.now()
+
+        def delete(self):
+            pass
+
+    def __init__(self, *args, rounds=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rounds_left = rounds
+        self.round_starts = []
+        self.broadcasts = []
+
+    def get_last_round(self):
+        return None
+
+    def get_results(self):
+        return []
+
+    def recover_rounds(self):
+        return []
+
+    def create_new_round(self, round_start):
+        time.sleep(self.DB_LATENCY)
+        return self.FakeRound(self.current_round_number)
+
+    def open_betting(self, round_obj):
+        time.sleep(self.DB_LATENCY)
+        self.round_starts.append(self.wheel.now())
+        self.rounds_left -= 1
+        if self.rounds_left == 0:
+            self.stop()
+
+    def start_spin(self, round_obj, winning_color, winning_slot, entries=None):
+        time.sleep(self.DB_LATENCY)
+
+    def complete_round(self, round_obj, winning_color):
+        time.sleep(self.DB_LATENCY)
+        return {'total_bets': 0, 'total_payout': 0, 'winners': [], 'payouts': {}}
+
+    async def broadcast_message(self, message_type, data):
+        self.broadcasts.append((message_type, data))
+        await asyncio.sleep(0)
+
+
+class SlowSettlementRoom(StubRoom):
+    SETTLE_TIME = 0.1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.settled = []
+
+    def complete_round(self, round_obj, winning_color):
+        time.sleep(self.SETTLE_TIME)
+        self.settled.append(self.wheel.now())
+        return super().complete_round(round_obj, winning_color)
+
+
+class RouletteRoomSchedulingTests(SimpleTestCase):
+    """Tests for deadline-based round scheduling"""
+
+    async def test_next_round_opens_while_previous_settles(self):
+        """Test a slow settlement neither delays nor shortens the next betting phase"""
+        wheel = TimerWheel(tick=0.005)
+        room = SlowSettlementRoom('room', wheel, None, rounds=2)
+
+        await run_rooms(wheel, [room])
+
+        period = room.BETTING_TIME + room.SPIN_ANIMATION_TIME
+        self.assertLess(room.round_starts[1], room.settled[0])
+        self.assertLess(room.round_starts[1] - room.round_starts[0], period + 2 * room.DB_LATENCY)
+        self.assertEqual(len(room.settled), 2)
+
+    async def test_rounds_do_not_drift(self):
+        """Test slow persistence does not push later rounds back"""
+        wheel = TimerWheel(tick=0.005)
+        room = StubRoom('room', wheel, None, rounds=4)
+
+        await run_rooms(wheel, [room])
+
+        period = room.BETTING_TIME + room.SPIN_ANIMATION_TIME
+        first = room.round_starts[0]
+        for i, start in enumerate(room.round_starts):
+            # A drifting loop would fall 3 * DB_LATENCY further behind every round
+            self.assertLess(start - (first + i * period), 2 * room.DB_LATENCY)
+
+    async def test_many_rooms_share_one_wheel(self):
+        """Test hundreds of rooms run concurrently on one wheel"""
+        wheel = TimerWheel(tick=0.005)
+        StubRoom.DB_LATENCY = 0
+        try:
+            rooms = [StubRoom(f'room_{i}', wheel, None, rounds=2) for i in range(200)]
+            started = time.monotonic()
+
+            await run_rooms(wheel, rooms)
+
+            elapsed = time.monotonic() - started
+        finally:
+            StubRoom.DB_LATENCY = 0.03
+
+        # Rooms run side by side: sequentially this would take 200x one room's time
+        one_room = 2 * (StubRoom.BETTING_TIME + StubRoom.SPIN_ANIMATION_TIME)
+        self.assertTrue(all(room.rounds_left == 0 for room in rooms))
+        self.assertLess(elapsed, 10 * one_room)
+
+
+class RoundSnapshotTests(SimpleTestCase):
+    """Tests for the game loop's live round snapshot"""
+
+    def setUp(self):
+        self.snapshot = RoundSnapshot('room', history=['RED', 'GRAY'])
+        self.snapshot.start_round(7, time.time() + 10)
+
+    def test_bets_update_totals(self):
+        """Test per-color totals and bet count follow accepted bets"""
+        self.snapshot.add_bet(7, 'alice', 'RED', 100)
+        self.snapshot.add_bet(7, 'bob', 'RED', 50)
+        self.snapshot.add_bet(7, 'bob', 'GOLD', 5)
+
+        data = self.snapshot.as_dict()
+        self.assertEqual(data['totals'], {'GRAY': 0, 'RED': 150, 'BLUE': 0, 'GOLD': 5})
+        self.assertEqual(data['total_bets'], 3)
+
+    def test_bet_for_other_round_ignored(self):
+        """Test late bets from a previous round are not counted"""
+        self.assertFalse(self.snapshot.add_bet(6, 'alice', 'RED', 100))
+        self.assertEqual(self.snapshot.total_bets, 0)
+
+    def test_top_bets_bounded(self):
+        """Test the bet list keeps only the largest bets, largest first"""
+        for i in range(TOP_BETS + 5):
+            self.snapshot.add_bet(7, f'user{i}', 'GRAY', i + 1)
+
+        data = self.snapshot.as_dict()
+        self.assertEqual(len(data['bets']), TOP_BETS)
+        self.assertEqual(data['bets'][0]['username'], f'user{TOP_BETS + 4}')
+        self.assertEqual(data['bets'][-1]['amount'], 6)
+        self.assertEqual(data['total_bets'], TOP_BETS + 5)
+
+    def test_round_state_carries_aggregates(self):
+        """Test round_state sends per-color counts and liability"""
+        self.snapshot.add_bet(7, 'alice', 'RED', 100)
+        self.snapshot.add_bet(7, 'bob', 'RED', 50)
+        self.snapshot.add_bet(7, 'bob', 'GOLD', 5)
+
+        message = round_state_message(self.snapshot.as_dict())
+        self.assertEqual(message['counts'], {'GRAY': 0, 'RED': 2, 'BLUE': 0, 'GOLD': 1})
+        self.assertEqual(message['liability'], {'GRAY': 0, 'RED': 450, 'BLUE': 0, 'GOLD': 250})
+
+    def test_new_round_resets_bets(self):
+        """Test starting a round clears bets but keeps history"""
+        self.snapshot.add_bet(7, 'alice', 'RED', 100)
+        self.snapshot.complete('BLUE')
+        self.snapshot.start_round(8, time.time() + 10)
+
+        data = self.snapshot.as_dict()
+        self.assertEqual(data['total_bets'], 0)
+        self.assertEqual(data['history'], ['BLUE', 'RED', 'GRAY'])
+
+
+class RouletteConsumerSnapshotTests(SimpleTestCase):
+    """Tests that round_state is served from the snapshot (SimpleTestCase forbids queries)"""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_local_copy('table-1')
+        self.user = SimpleNamespace(is_authenticated=True, pk=1, username='alice')
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(RouletteConsumer.as_asgi(), '/ws/roulette/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_connect_serves_snapshot_without_queries(self):
+        """Test connect sends round_state straight from the published snapshot"""
+        snapshot = RoundSnapshot('table-1', history=['GOLD'])
+        snapshot.start_round(3, time.time() + 10)
+        snapshot.add_bet(3, 'bob', 'BLUE', 40)
+        await snapshot.publish()
+
+        communicator = await self.connect()
+        message = await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        self.assertEqual(message['type'], 'round_state')
+        self.assertEqual(message['round_number'], 3)
+        self.assertEqual(message['status'], 'BETTING')
+        self.assertEqual(message['totals']['BLUE'], 40)
+        self.assertEqual(message['history'], ['GOLD'])
+        self.assertGreater(message['time_remaining'], 0)
+
+    async def test_get_state_serves_snapshot_without_queries(self):
+        """Test get_state requests are answered from the snapshot"""
+        snapshot = RoundSnapshot('table-1')
+        snapshot.start_round(4, time.time() + 10)
+        snapshot.start_spin()
+        await snapshot.publish()
+
+        communicator = await self.connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'get_state'})
+        message = await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        self.assertEqual(message['status'], 'SPINNING')
+        self.assertEqual(message['time_remaining'], 0)
+
+
+class RouletteRoomSnapshotTests(SimpleTestCase):
+    """Tests for snapshot maintenance by the game loop"""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_local_copy('room')
+
+    async def test_reported_bets_published(self):
+        """Test bets reported by consumers reach the published snapshot"""
+        wheel = TimerWheel(tick=0.005)
+        room = StubRoom('room', wheel, None)
+        room.snapshot.start_round(1, time.time() + 10)
+        wheel_task = asyncio.create_task(wheel.run())
+        try:
+            room.on_bet({'round_number': 1, 'username': 'a', 'color': 'RED', 'amount': 10})
+            room.on_bet({'round_number': 1, 'username': 'b', 'color': 'RED', 'amount': 15})
+            await asyncio.sleep(room.bets_flush_interval + 0.05)
+        finally:
+            wheel.stop()
+            wheel_task.cancel()
+
+        published = await cache.aget('roulette:snapshot:room')
+        self.assertEqual(published['totals']['RED'], 25)
+        self.assertEqual(published['total_bets'], 2)
+
+    async def test_bets_coalesced_into_one_delta(self):
+        """Test bets within one flush interval go out as a single bets_delta"""
+        wheel = TimerWheel(tick=0.005)
+        room = StubRoom('room', wheel, None)
+        room.snapshot.start_round(1, time.time() + 10)
+        wheel_task = asyncio.create_task(wheel.run())
+        try:
+            for i in range(50):
+                room.on_bet({'round_number': 1, 'username': f'u{i}', 'color': 'BLUE', 'amount': 2})
+            room.on_bet({'round_number': 0, 'username': 'late', 'color': 'RED', 'amount': 5})
+            await asyncio.sleep(room.bets_flush_interval + 0.05)
+        finally:
+            wheel.stop()
+            wheel_task.cancel()
+
+        self.assertEqual(len(room.broadcasts), 1)
+        message_type, data = room.broadcasts[0]
+        self.assertEqual(message_type, 'bets_delta')
+        self.assertEqual(data['round_number'], 1)
+        self.assertEqual(data['totals']['BLUE'], 100)
+        self.assertEqual(len(data['bets']), 50)
+
+    @override_settings(ROULETTE_BETS_FLUSH_INTERVAL=0.5)
+    def test_flush_interval_configurable(self):
+        """Test the flush interval comes from settings"""
+        room = StubRoom('room', TimerWheel(), None)
+
+        self.assertEqual(room.bets_flush_interval, 0.5)
+
+
+class ResultBufferTests(SimpleTestCase):
+    """Tests for the ring buffer of recent round results"""
+
+    def setUp(self):
+        cache.clear()
+
+    def filled(self, size, count):
+        buffer = ResultBuffer('room', size=size)
+        for n in range(1, count + 1):
+            buffer.add(n, 'RED', n)
+        return buffer
+
+    def numbers(self, page):
+        return [result['round_number'] for result in page]
+
+    def test_keeps_latest_results(self):
+        """Test the buffer drops the oldest result once full"""
+        buffer = self.filled(size=3, count=5)
+
+        self.assertEqual(self.numbers(buffer.results), [5, 4, 3])
+
+    def test_page_past_full_buffer_needs_database(self):
+        """Test a page reaching below a full buffer is not served from it"""
+        published = self.filled(size=3, count=5).as_dict()
+
+        self.assertEqual(self.numbers(buffered_page(published, 5, 2)), [4, 3])
+        self.assertIsNone(buffered_page(published, 5, 3))
+
+    def test_partial_buffer_holds_everything(self):
+        """Test a buffer that never filled up answers every page"""
+        published = self.filled(size=10, count=3).as_dict()
+
+        self.assertEqual(self.numbers(buffered_page(published, 3, 5)), [2, 1])
+        self.assertEqual(buffered_page(published, 1, 5), [])
+
+    async def test_settled_rounds_published(self):
+        """Test the game loop publishes each result when its round settles"""
+        wheel = TimerWheel(tick=0.005)
+        room = StubRoom('room', wheel, None, rounds=2)
+
+        await run_rooms(wheel, [room])
+
+        published = await cache.aget(RESULTS_KEY.format('room'))
+        self.assertEqual(self.numbers(published['results']), [2, 1])
+
+
+class RoundResultBroadcastTests(SimpleTestCase):
+    """Tests for pushing round results to the room and to bettors"""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_local_copy('table-1')
+        # A finished round: connecting sends nothing and needs no database
+        snapshot = RoundSnapshot('table-1')
+        snapshot.complete('RED')
+        async_to_sync(snapshot.publish)()
+
+    async def connect(self, pk, username):
+        communicator = WebsocketCommunicator(RouletteConsumer.as_asgi(), '/ws/roulette/')
+        communicator.scope['user'] = SimpleNamespace(is_authenticated=True, pk=pk, username=username)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_bettors_get_payout_spectators_shared_frame(self):
+        """Test only bettors receive a round_payout, without any queries"""
+        room = RouletteRoom('table-1', TimerWheel(), get_channel_layer())
+        bettor = await self.connect(1, 'alice')
+        spectator = await self.connect(2, 'bob')
+
+        await room.broadcast_result(5, 'RED', 7)
+        await room.send_payouts(5, {1: {'payout': 300, 'balance': 1300}})
+
+        for communicator in (bettor, spectator):
+            result = await communicator.receive_json_from()
+            self.assertEqual(result, {
+                'type': 'round_result', 'round_number': 5, 'winning_color': 'RED', 'winning_slot': 7,
+            })
+        payout = await bettor.receive_json_from()
+        self.assertEqual(payout, {
+            'type': 'round_payout', 'round_number': 5, 'your_payout': 300, 'your_balance': 1300,
+        })
+        self.assertTrue(await spectator.receive_nothing())
+
+        await bettor.disconnect()
+        await spectator.disconnect()
+
+    async def test_frames_forwarded_verbatim(self):
+        """Test consumers write the producer's serialized frame without re-encoding"""
+        bettor = await self.connect(1, 'alice')
+        event = frame_event('round_spinning', {'round_number': 5, 'winning_color': 'GOLD', 'winning_slot': 0})
+
+        await get_channel_layer().group_send('roulette_table-1', event)
+
+        self.assertEqual(await bettor.receive_from(), event['frames']['json'])
+        await bettor.disconnect()
+
+    async def test_user_group_is_per_room(self):
+        """Test user groups are scoped to their room"""
+        self.assertNotEqual(user_group_name('room_a', 1), user_group_name('room_b', 1))
+
+
+class ProtocolTests(SimpleTestCase):
+    """Tests for the roulette wire codecs"""
+
+    MESSAGES = [
+        {'type': 'round_state', 'round_number': 3, 'status': 'BETTING', 'time_remaining': 4.5,
+         'total_bets': 1, 'totals': {'GRAY': 0, 'RED': 5, 'BLUE': 0, 'GOLD': 0},
+         'history': ['GOLD', 'RED'], 'bets': [{'username': 'ann', 'color': 'RED', 'amount': 5}],
+         'betting_ends_at': 1700000004.5, 'spin_ends_at': 1700000007.5,
+         'counts': {'GRAY': 0, 'RED': 1, 'BLUE': 0, 'GOLD': 0},
+         'liability': {'GRAY': 0, 'RED': 15, 'BLUE': 0, 'GOLD': 0}},
+        {'type': 'round_starting', 'round_number': 4, 'time_remaining': 15,
+         'betting_ends_at': 1700000022.5, 'spin_ends_at': 1700000025.5},
+        {'type': 'bets_delta', 'round_number': 4, 'totals': {'GRAY': 1, 'RED': 2, 'BLUE': 3, 'GOLD': 4},
+         'bets': [{'username': 'bob', 'color': 'GOLD', 'amount': 4}]},
+        {'type': 'round_spinning', 'round_number': 4, 'winning_color': 'BLUE', 'winning_slot': 9,
+         'spin_ends_at': 1700000025.5},
+        {'type': 'round_result', 'round_number': 4, 'winning_color': 'BLUE', 'winning_slot': 9},
+        {'type': 'round_payout', 'round_number': 4, 'your_payout': 0, 'your_balance': 95},
+        {'type': 'balance_update', 'balance': 95},
+        {'type': 'error', 'message': 'Invalid color'},
+        {'type': 'place_bet', 'color': 'GRAY', 'amount': 10},
+        {'type': 'get_state'},
+        {'type': 'get_bets', 'round_number': 4, 'after': 120},
+        {'type': 'round_bets', 'round_number': 4, 'bets': [{'username': 'bob', 'color': 'GOLD', 'amount': 4}],
+         'next': None},
+        {'type': 'ack', 'seq': 16},
+        {'type': 'slow_consumer', 'retry_after': 5},
+    ]
+
+    def test_every_message_type_covered(self):
+        """Test the round trip below exercises every message type"""
+        self.assertEqual({m['type'] for m in self.MESSAGES}, set(EVENT_FIELDS))
+
+    def test_compact_round_trip(self):
+        """Test compact frames decode back to the original messages"""
+        for message in self.MESSAGES:
+            self.assertEqual(COMPACT.decode(COMPACT.encode(message)), message)
+
+    def test_compact_uses_integer_codes(self):
+        """Test colors and events travel as small integers"""
+        frame = COMPACT.encode({'type': 'place_bet', 'color': 'GOLD', 'amount': 10})
+
+        self.assertEqual(frame, '[8,3,10]')
+
+    def test_compact_rejects_unknown_frames(self):
+        """Test malformed compact frames decode to an unknown message type"""
+        for text in ('{}', '[]', '[99]', '["place_bet"]'):
+            self.assertIsNone(COMPACT.decode(text)['type'])
+
+    def test_json_is_default(self):
+        """Test clients get JSON unless they offer the compact subprotocol"""
+        self.assertIs(select_codec([]), JSON)
+        self.assertIs(select_codec(['other']), JSON)
+        self.assertIs(select_codec(['other', COMPACT_SUBPROTOCOL]), COMPACT)
+
+    def test_frames_encoded_for_every_codec(self):
+        """Test broadcasts carry one ready frame per codec"""
+        message = self.MESSAGES[3]
+
+        self.assertEqual(encode_frames(message), {'json': JSON.encode(message), 'compact': COMPACT.encode(message)})
+
+
+class CompactProtocolConsumerTests(SimpleTestCase):
+    """Tests for subprotocol negotiation in RouletteConsumer"""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_local_copy('table-1')
+        snapshot = RoundSnapshot('table-1', history=['RED'])
+        snapshot.start_round(8, time.time() + 10)
+        async_to_sync(snapshot.publish)()
+
+    async def connect(self, subprotocols):
+        communicator = WebsocketCommunicator(
+            RouletteConsumer.as_asgi(), '/ws/roulette/', subprotocols=subprotocols
+        )
+        communicator.scope['user'] = SimpleNamespace(is_authenticated=True, pk=1, username='alice')
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, subprotocol
+
+    async def test_compact_negotiated(self):
+        """Test offering the subprotocol switches the socket to compact frames"""
+        communicator, subprotocol = await self.connect([COMPACT_SUBPROTOCOL])
+        state = COMPACT.decode(await communicator.receive_from())
+
+        await communicator.send_to(text_data=COMPACT.encode({'type': 'get_state'}))
+        again = COMPACT.decode(await communicator.receive_from())
+        await communicator.disconnect()
+
+        self.assertEqual(subprotocol, COMPACT_SUBPROTOCOL)
+        self.assertEqual(state['round_number'], 8)
+        self.assertEqual(state['history'], ['RED'])
+        self.assertEqual(again['type'], 'round_state')
+
+    async def test_json_without_subprotocol(self):
+        """Test clients that offer nothing keep the JSON protocol"""
+        communicator, subprotocol = await self.connect([])
+        state = await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        self.assertIsNone(subprotocol)
+        self.assertEqual(state['type'], 'round_state')
+
+    async def test_broadcast_frame_matches_codec(self):
+        """Test each socket gets the broadcast copy for its own codec"""
+        compact, _ = await self.connect([COMPACT_SUBPROTOCOL])
+        plain, _ = await self.connect([])
+        await compact.receive_from()
+        await plain.receive_from()
+        event = frame_event('round_spinning', {'round_number': 8, 'winning_color': 'GOLD', 'winning_slot': 0})
+
+        await get_channel_layer().group_send('roulette_table-1', event)
+
+        self.assertEqual(await compact.receive_from(), event['frames']['compact'])
+        self.assertEqual(await plain.receive_from(), event['frames']['json'])
+        await compact.disconnect()
+        await plain.disconnect()
+
+
+class RoomAssignmentTests(SimpleTestCase):
+    """Tests for consistent-hash room placement and auto-opening"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_assignment_is_stable(self):
+        """Test a user always lands in the same room for the same room list"""
+        rooms = ['table-1', 'table-2', 'table-3']
+
+        self.assertEqual(assign_room(42, rooms), assign_room(42, list(reversed(rooms))))
+
+    def test_new_room_moves_few_users(self):
+        """Test opening a room only moves users onto the new room"""
+        before = HashRing(['table-1', 'table-2', 'table-3'])
+        after = HashRing(['table-1', 'table-2', 'table-3', 'table-4'])
+
+        moved = [uid for uid in range(4000) if before.room_for(uid) != after.room_for(uid)]
+
+        self.assertTrue(all(after.room_for(uid) == 'table-4' for uid in moved))
+        # About a quarter of the users should move, never most of them
+        self.assertLess(len(moved), 4000 * 0.4)
+        self.assertGreater(len(moved), 4000 * 0.1)
+
+    def test_configured_rooms_until_published(self):
+        """Test the room list falls back to ROULETTE_ROOMS"""
+        self.assertEqual(get_active_rooms(), ['table-1'])
+
+        publish_rooms(['table-1', 'table-2'])
+
+        self.assertEqual(get_active_rooms(), ['table-1', 'table-2'])
+
+    @override_settings(ROULETTE_ROOM_CAPACITY=10, ROULETTE_MAX_ROOMS=3)
+    def test_room_opened_when_full(self):
+        """Test a room opens once a room passes capacity and none is still filling"""
+        def connections(counts):
+            expires = time.time() + 60
+            cache.set_many({CONNECTIONS_KEY.format(room): {'web-1': (n, expires)} for room, n in counts.items()})
+
+        connections({'table-1': 9})
+        self.assertIsNone(room_to_open(['table-1']))
+        connections({'table-1': 10})
+        self.assertEqual(room_to_open(['table-1']), 'table-2')
+        connections({'table-1': 12, 'table-2': 3})
+        self.assertIsNone(room_to_open(['table-1', 'table-2']))
+        connections({'table-1': 12, 'table-2': 6})
+        self.assertEqual(room_to_open(['table-1', 'table-2']), 'table-3')
+        connections({'table-3': 20})
+        self.assertIsNone(room_to_open(['table-1', 'table-2', 'table-3']))
+
+    def test_connection_counts_of_dead_processes_expire(self):
+        """Test counts summed over processes, without those that stopped refreshing"""
+        now = time.time()
+        cache.set(CONNECTIONS_KEY.format('table-1'), {
+            'web-1': (4, now + 20), 'web-2': (3, now + 20), 'killed': (500, now - 1),
+        })
+
+        self.assertEqual(connection_counts(['table-1', 'table-2']), {'table-1': 7, 'table-2': 0})
+
+    @override_settings(ROULETTE_ROOM_CAPACITY=1)
+    async def test_run_rooms_opens_rooms(self):
+        """Test the game loop starts and publishes rooms opened on demand"""
+        wheel = TimerWheel(tick=0.005)
+        await cache.aset(CONNECTIONS_KEY.format('table-1'), {'web-1': (5, time.time() + 60)})
+        opened = []
+
+        def factory(name):
+            opened.append(name)
+            return StubRoom(name, wheel, None, rounds=1)
+
+        await run_rooms(wheel, [StubRoom('table-1', wheel, None, rounds=1)],
+                        room_factory=factory, balance_interval=0.01)
+
+        self.assertEqual(opened[0], 'table-2')
+        self.assertIn('table-2', await cache.aget('roulette:rooms'))
+
+
+class RoomConsumerTests(SimpleTestCase):
+    """Tests for room selection in RouletteConsumer"""
+
+    def setUp(self):
+        cache.clear()
+        publish_rooms(['table-1', 'table-2'])
+        for room in ('table-1', 'table-2'):
+            invalidate_local_copy(room)
+            snapshot = RoundSnapshot(room)
+            snapshot.start_round(int(room[-1]), time.time() + 10)
+            async_to_sync(snapshot.publish)()
+
+    async def connect(self, path, route_kwargs=None):
+        communicator = WebsocketCommunicator(RouletteConsumer.as_asgi(), path)
+        communicator.scope['user'] = SimpleNamespace(is_authenticated=True, pk=7, username='dave')
+        if route_kwargs is not None:
+            communicator.scope['url_route'] = {'args': (), 'kwargs': route_kwargs}
+        return communicator, await communicator.connect()
+
+    async def test_explicit_room(self):
+        """Test ws/roulette/<room>/ joins that room and counts the connection"""
+        communicator, (connected, _) = await self.connect('/ws/roulette/table-2/', {'room': 'table-2'})
+        state = await communicator.receive_json_from()
+        count = await database_sync_to_async(connection_counts)(['table-2'])
+        await communicator.disconnect()
+
+        self.assertTrue(connected)
+        self.assertEqual(state['round_number'], 2)
+        self.assertEqual(count, {'table-2': 1})
+        self.assertEqual(await database_sync_to_async(connection_counts)(['table-2']), {'table-2': 0})
+
+    async def test_connection_count_refreshed(self):
+        """Test an open socket's count is rewritten by the heartbeat before it expires"""
+        with patch('casino.roulette.rooms.CONNECTIONS_HEARTBEAT', 0.01):
+            communicator, _ = await self.connect('/ws/roulette/table-2/', {'room': 'table-2'})
+            await communicator.receive_json_from()
+            key = CONNECTIONS_KEY.format('table-2')
+            (first,) = (await cache.aget(key)).values()
+            await asyncio.sleep(0.05)
+            (refreshed,) = (await cache.aget(key)).values()
+            await communicator.disconnect()
+
+        self.assertEqual(refreshed[0], 1)
+        self.assertGreater(refreshed[1], first[1])
+
+    async def test_unknown_room_rejected(self):
+        """Test rooms the game loop does not host are refused with ROOM_CLOSED"""
+        communicator, (connected, code) = await self.connect('/ws/roulette/table-9/', {'room': 'table-9'})
+
+        self.assertFalse(connected)
+        self.assertEqual(code, RouletteConsumer.ROOM_CLOSED)
+
+    async def test_room_assigned_without_route(self):
+        """Test ws/roulette/ places the user with consistent hashing"""
+        communicator, (connected, _) = await self.connect('/ws/roulette/')
+        state = await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        expected = assign_room(7, ['table-1', 'table-2'])
+        self.assertEqual(state['round_number'], int(expected[-1]))
+
+
+class RoomScopedRoundTests(TestCase):
+    """Tests that rounds are numbered per room"""
+
+    def test_round_numbers_per_room(self):
+        """Test two rooms can both have a round 1"""
+        GameRound.objects.create(room='table-1', round_number=1)
+        GameRound.objects.create(room='table-2', round_number=1)
+
+        self.assertEqual(GameRound.objects.filter(round_number=1).count(), 2)
+
+
+class LocalBetLedgerTests(SimpleTestCase):
+    """Tests for the in-process write-behind bet ledger"""
+
+    def setUp(self):
+        self.ledger = LocalBetLedger()
+        self.reserve = async_to_sync(self.ledger.reserve)
+
+    def test_reserve_returns_remaining_balance(self):
+        """Test reservations accumulate against the user's balance"""
+        self.assertEqual(self.reserve('room', 1, 5, 'alice', 'RED', 30, 100), 70)
+        self.assertEqual(self.reserve('room', 1, 5, 'alice', 'GRAY', 50, 100), 20)
+
+    def test_reserve_rejects_insufficient_funds(self):
+        """Test a user cannot reserve more than their balance in one round"""
+        self.reserve('room', 1, 5, 'alice', 'RED', 80, 100)
+
+        self.assertEqual(self.reserve('room', 1, 5, 'alice', 'RED', 30, 100), INSUFFICIENT_FUNDS)
+
+    def test_sealed_round_rejects_bets(self):
+        """Test bets arriving after the flush started are refused"""
+        self.reserve('room', 1, 5, 'alice', 'RED', 10, 100)
+        async_to_sync(self.ledger.seal)('room', 1)
+
+        self.assertEqual(self.reserve('room', 1, 5, 'alice', 'RED', 10, 100), ROUND_CLOSED)
+
+    def test_seal_aggregates_per_user_and_color(self):
+        """Test repeated bets on one color become a single entry"""
+        self.reserve('room', 1, 5, 'alice', 'RED', 10, 100)
+        self.reserve('room', 1, 5, 'alice', 'RED', 15, 100)
+        self.reserve('room', 1, 6, 'bob', 'GOLD', 1, 100)
+
+        entries = async_to_sync(self.ledger.seal)('room', 1)
+
+        self.assertCountEqual(entries, [
+            {'user_id': 5, 'username': 'alice', 'color': 'RED', 'amount': 25},
+            {'user_id': 6, 'username': 'bob', 'color': 'GOLD', 'amount': 1},
+        ])
+
+    def test_discard_removes_round(self):
+        """Test discarded rounds no longer show up as open"""
+        self.reserve('room', 1, 5, 'alice', 'RED', 10, 100)
+        self.reserve('room', 2, 5, 'alice', 'RED', 10, 100)
+        async_to_sync(self.ledger.discard)('room', 1)
+
+        self.assertEqual(async_to_sync(self.ledger.open_rounds)('room'), [2])
+
+
+class LedgerFlushTests(TestCase):
+    """Tests for flushing sealed ledger entries to the database"""
+
+    def setUp(self):
+        self.round = GameRound.objects.create(round_number=1, status='BETTING')
+        self.alice = User.objects.create(username='alice', balance=100)
+        self.bob = User.objects.create(username='bob', balance=5)
+
+    def flush(self, entries):
+        with transaction.atomic():
+            result = flush_entries(self.round, entries)
+            self.round.save()
+        return result
+
+    def test_flush_debits_and_creates_bets(self):
+        """Test each bettor is debited their total stake and bets are stored"""
+        self.flush([
+            {'user_id': self.alice.pk, 'username': 'alice', 'color': 'RED', 'amount': 30},
+            {'user_id': self.alice.pk, 'username': 'alice', 'color': 'GRAY', 'amount': 20},
+        ])
+
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.balance, 50)
+        self.assertEqual(
+            dict(Bet.objects.filter(round=self.round).values_list('color', 'amount')),
+            {'RED': 30, 'GRAY': 20},
+        )
+
+    def test_flush_drops_bettors_without_funds(self):
+        """Test users who spent their reserved funds elsewhere are skipped"""
+        flushed, dropped = self.flush([
+            {'user_id': self.alice.pk, 'username': 'alice', 'color': 'RED', 'amount': 30},
+            {'user_id': self.bob.pk, 'username': 'bob', 'color': 'RED', 'amount': 10},
+        ])
+
+        self.bob.refresh_from_db()
+        self.assertEqual(self.bob.balance, 5)
+        self.assertEqual([e['username'] for e in dropped], ['bob'])
+        self.assertFalse(Bet.objects.filter(user=self.bob).exists())
+
+    def test_flush_records_stats(self):
+        """Test flushed bets count towards their bettors' stats"""
+        self.flush([
+            {'user_id': self.alice.pk, 'username': 'alice', 'color': 'RED', 'amount': 30},
+            {'user_id': self.alice.pk, 'username': 'alice', 'color': 'GRAY', 'amount': 20},
+        ])
+
+        stats = UserStats.objects.get(user=self.alice)
+        self.assertEqual((stats.total_wagered, stats.roulette_bets), (50, 2))
+
+    def test_flush_sets_color_counters(self):
+        """Test the round's per-color aggregates cover exactly the flushed bets"""
+        self.flush([
+            {'user_id': self.alice.pk, 'username': 'alice', 'color': 'RED', 'amount': 30},
+            {'user_id': self.bob.pk, 'username': 'bob', 'color': 'RED', 'amount': 10},
+        ])
+
+        self.round.refresh_from_db()
+        self.assertEqual(self.round.aggregates()['totals'], {'GRAY': 0, 'RED': 30, 'BLUE': 0, 'GOLD': 0})
+        self.assertEqual(self.round.aggregates()['total_bets'], 1)
+
+    def test_flush_sets_marker(self):
+        """Test the round records that its ledger bets were flushed"""
+        self.flush([])
+
+        self.round.refresh_from_db()
+        self.assertIsNotNone(self.round.bets_flushed_at)
+
+
+@override_settings(ROULETTE_BET_INTAKE='ledger')
+class LedgerReconciliationTests(TransactionTestCase):
+    """Tests for startup reconciliation of leftover ledger rounds (the engine queries from worker threads)"""
+
+    def test_leftover_rounds_are_discarded(self):
+        """Test flushed and never-spun ledger rounds are both cleared"""
+        ledger = get_ledger()
+        reserve = async_to_sync(ledger.reserve)
+        GameRound.objects.create(round_number=1, status='SPINNING', bets_flushed_at=timezone.now())
+        GameRound.objects.create(round_number=2, status='BETTING')
+        reserve('table-1', 1, 5, 'alice', 'RED', 10, 100)
+        reserve('table-1', 2, 5, 'alice', 'RED', 10, 100)
+        room = RouletteRoom('table-1', TimerWheel(), None)
+
+        async_to_sync(room.reconcile_ledger)()
+
+        self.assertEqual(async_to_sync(ledger.open_rounds)('table-1'), [])
+
+
+@override_settings(ROULETTE_BET_INTAKE='ledger')
+class LedgerIntakeConsumerTests(SimpleTestCase):
+    """Tests for the consumer's ledger intake path (no database access)"""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_local_copy('table-1')
+        self.consumer = RouletteConsumer()
+        self.consumer.room = 'table-1'
+        self.user = SimpleNamespace(pk=9, username='carol', balance=100)
+
+    def tearDown(self):
+        async_to_sync(get_ledger().discard)('table-1', 12)
+
+    def publish(self, status='BETTING', ends_in=10):
+        snapshot = RoundSnapshot('table-1')
+        snapshot.start_round(12, time.time() + ends_in)
+        snapshot.status = status
+        async_to_sync(snapshot.publish)()
+
+    def test_reserve_bet_success(self):
+        """Test a bet is accepted and the reduced balance returned"""
+        self.publish()
+
+        result = async_to_sync(self.consumer.reserve_bet)(self.user, 'RED', 40.0)
+
+        self.assertEqual(result, {'success': True, 'round_number': 12, 'new_balance': 60})
+
+    def test_reserve_bet_after_deadline(self):
+        """Test bets after the betting deadline are refused"""
+        self.publish(ends_in=-1)
+
+        result = async_to_sync(self.consumer.reserve_bet)(self.user, 'RED', 40)
+
+        self.assertEqual(result['error'], 'No active betting round')
+
+    def test_reserve_bet_insufficient_balance(self):
+        """Test reservations cannot exceed the balance"""
+        self.publish()
+
+        result = async_to_sync(self.consumer.reserve_bet)(self.user, 'RED', 400)
+
+        self.assertEqual(result['error'], 'Insufficient balance')
+
+
+class SessionCacheTests(TestCase):
+    """Tests for the cached session validity used by consumers"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="alice", password="testpass")  # nosec
+        self.client.login(username="alice", password="testpass")  # nosec
+        self.session_key = self.client.session.session_key
+
+    def test_valid_session_cached(self):
+        """Test repeated checks hit the cache, not the database"""
+        self.assertTrue(is_session_valid(self.session_key))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(is_session_valid(self.session_key))
+
+    def test_logout_revokes(self):
+        """Test logging out revokes a cached session"""
+        is_session_valid(self.session_key)
+
+        self.client.logout()
+
+        with self.assertNumQueries(0):
+            self.assertFalse(is_session_valid(self.session_key))
+
+    def test_session_delete_revokes(self):
+        """Test deleting session rows (admin, clearsessions) revokes them"""
+        is_session_valid(self.session_key)
+
+        Session.objects.filter(session_key=self.session_key).delete()
+
+        self.assertFalse(is_session_valid(self.session_key))
+
+    def test_revocation_not_overwritten(self):
+        """Test a lookup racing a logout cannot restore the session"""
+        revoke_session(self.session_key)
+
+        # The row still exists, as if read just before the logout's delete
+        self.assertFalse(is_session_valid(self.session_key))
+
+    def test_missing_session(self):
+        """Test unknown or empty session keys are invalid"""
+        self.assertFalse(is_session_valid('missing'))
+        self.assertFalse(is_session_valid(None))
+
+
+class BetAmountTests(TransactionTestCase):
+    """Tests for the validation of socket bet amounts"""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_local_copy('table-1')
+        self.user = User.objects.create_user(username="alice", password="testpass", balance=1000)  # nosec
+        GameRound.objects.create(round_number=1, status='BETTING')
+        self.client.login(username="alice", password="testpass")  # nosec
+
+    def bet(self, amount):
+        async def scenario():
+            communicator = WebsocketCommunicator(RouletteConsumer.as_asgi(), '/ws/roulette/')
+            communicator.scope['user'] = self.user
+            communicator.scope['session'] = SessionStore(session_key=self.client.session.session_key)
+            await communicator.connect()
+            await communicator.receive_json_from()
+            await communicator.send_json_to({'type': 'place_bet', 'color': 'RED', 'amount': amount})
+            reply = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return reply
+        return async_to_sync(scenario)()
+
+    def test_fraction_refused(self):
+        """Test fractional stakes are refused instead of debiting a rounded amount"""
+        reply = self.bet(10.4)
+
+        self.assertEqual(reply['message'], 'Bet amount must be a whole number')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 1000)
+        self.assertFalse(Bet.objects.exists())
+
+    def test_whole_float_stored_as_int(self):
+        """Test 10.0 is accepted as a bet of 10"""
+        self.assertEqual(self.bet(10.0), {'type': 'balance_update', 'balance': 990})
+        self.assertEqual(Bet.objects.get().amount, 10)
+        self.assertIsInstance(User.objects.values_list('balance', flat=True).get(pk=self.user.pk), int)
+
+    def test_not_finite_refused(self):
+        """Test amounts that are not numbers at all are invalid"""
+        self.assertEqual(self.bet('inf')['message'], 'Invalid bet amount')
+
+
+class LogoutHonoredTests(TransactionTestCase):
+    """Tests that a logout elsewhere stops the very next bet"""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_local_copy('table-1')
+        self.user = User.objects.create_user(username="alice", password="testpass", balance=1000)  # nosec
+        GameRound.objects.create(round_number=1, status='BETTING')
+        self.client.login(username="alice", password="testpass")  # nosec
+        self.session_key = self.client.session.session_key
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(RouletteConsumer.as_asgi(), '/ws/roulette/')
+        communicator.scope['user'] = self.user
+        communicator.scope['session'] = SessionStore(session_key=self.session_key)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        return communicator
+
+    async def bet(self, communicator):
+        await communicator.send_json_to({'type': 'place_bet', 'color': 'RED', 'amount': 10})
+        return await communicator.receive_json_from()
+
+    def test_logout_in_other_tab(self):
+        """Test the first bet after logout is refused and the socket closed"""
+        async def scenario():
+            communicator = await self.connect()
+            before = await self.bet(communicator)
+            await database_sync_to_async(self.client.logout)()
+            after = await self.bet(communicator)
+            closed = await communicator.receive_output()
+            return before, after, closed
+
+        before, after, closed = async_to_sync(scenario)()
+
+        self.assertEqual(before, {'type': 'balance_update', 'balance': 990})
+        self.assertEqual(after['message'], 'Session expired - please refresh the page')
+        self.assertEqual(closed['type'], 'websocket.close')
+        self.assertEqual(Bet.objects.get().amount, 10)
+
+    def test_session_deleted(self):
+        """Test deleting the session row is honored on the next bet"""
+        async def scenario():
+            communicator = await self.connect()
+            await self.bet(communicator)
+            await database_sync_to_async(Session.objects.filter(session_key=self.session_key).delete)()
+            after = await self.bet(communicator)
+            await communicator.disconnect()
+            return after
+
+        after = async_to_sync(scenario)()
+
+        self.assertEqual(after['message'], 'Session expired - please refresh the page')
+
+
+class LeaseTests(TestCase):
+    """Tests for the worker lease row"""
+
+    def test_single_holder(self):
+        """Test only one process holds a valid lease"""
+        self.assertIsNotNone(acquire_lease('loop', 'a', 10))
+        self.assertIsNone(acquire_lease('loop', 'b', 10))
+        self.assertIsNotNone(acquire_lease('loop', 'a', 10))
+
+    def test_takeover_after_expiry(self):
+        """Test an expired lease passes on with the takeover latency recorded"""
+        acquire_lease('loop', 'a', 10)
+        WorkerLease.objects.update(
+            renewed_at=timezone.now() - timezone.timedelta(seconds=12),
+            expires_at=timezone.now() - timezone.timedelta(seconds=2),
+        )
+
+        lease = acquire_lease('loop', 'b', 10)
+
+        self.assertEqual(lease.holder, 'b')
+        self.assertAlmostEqual(lease.takeover_latency, 12, delta=1)
+
+    def test_release_hands_over(self):
+        """Test a released lease can be taken at once"""
+        acquire_lease('loop', 'a', 10)
+        release_lease('loop', 'a')
+
+        self.assertEqual(acquire_lease('loop', 'b', 10).holder, 'b')
+
+
+class FastElection(LeaderElection):
+    LEASE_TTL = 0.4
+    RENEW_INTERVAL = 0.1
+
+
+class LeaderElectionTests(TransactionTestCase):
+    """Tests for leader election between game-loop processes (leases are taken from worker threads)"""
+
+    def test_standby_takes_over_dead_leader(self):
+        """Test a standby leads within LEASE_TTL + RENEW_INTERVAL after the leader dies, and exports the latency"""
+        before = dict(metrics.LEADER_TAKEOVER.collect()).get(('loop',), {'count': 0, 'sum': 0})
+
+        async def scenario():
+            leader, standby = FastElection('loop', 'a'), FastElection('loop', 'b')
+            led = asyncio.Event()
+
+            async def lead():
+                led.set()
+                await asyncio.Event().wait()
+
+            crashed = asyncio.create_task(leader.run(lead))
+            await led.wait()
+            standby_task = asyncio.create_task(standby.run(lead))
+            await asyncio.sleep(0.3)
+            self.assertFalse(standby.is_leader)
+
+            # Simulate a hung leader: it never renews or releases again
+            async def hang():
+                await asyncio.Event().wait()
+
+            led.clear()
+            leader.acquire = hang
+            started = time.monotonic()
+            await asyncio.wait_for(led.wait(), timeout=2)
+            elapsed = time.monotonic() - started
+
+            crashed.cancel()
+            standby_task.cancel()
+            await asyncio.gather(crashed, standby_task, return_exceptions=True)
+            return standby, elapsed
+
+        standby, elapsed = async_to_sync(scenario)()
+
+        self.assertLess(elapsed, FastElection.LEASE_TTL + FastElection.RENEW_INTERVAL + 0.3)
+        takeovers = dict(metrics.LEADER_TAKEOVER.collect())[(standby.name,)]
+        self.assertEqual(takeovers['count'] - before['count'], 1)
+        self.assertLess(takeovers['sum'] - before['sum'], FastElection.LEASE_TTL + FastElection.RENEW_INTERVAL + 0.3)
+        self.assertIn('roulette_leader_takeover_seconds_count{lease="loop"}', metrics.render())
+
+    def test_leader_stops_when_lease_lost(self):
+        """Test a leader whose lease was taken cancels its work and stands by"""
+        async def scenario():
+            election = FastElection('loop', 'a')
+            cancelled = asyncio.Event()
+
+            async def lead():
+                try:
+                    await asyncio.Event().wait()
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+
+            task = asyncio.create_task(election.run(lead))
+            await asyncio.sleep(0.05)
+            await database_sync_to_async(WorkerLease.objects.update)(
+                holder='b', expires_at=timezone.now() + timezone.timedelta(seconds=60)
+            )
+            await asyncio.wait_for(cancelled.wait(), timeout=2)
+            is_leader = election.is_leader
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return is_leader
+
+        self.assertFalse(async_to_sync(scenario)())
+
+    def test_finished_leader_releases(self):
+        """Test the lease is released when the leader's work ends"""
+        async def lead():
+            pass
+
+        async_to_sync(FastElection('loop', 'a').run)(lead)
+
+        self.assertEqual(acquire_lease('loop', 'b', 10).holder, 'b')
+
+
+class RoundPhaseTests(TestCase):
+    """Tests for the persisted round phase state machine"""
+
+    def setUp(self):
+        self.round = GameRound.objects.create(round_number=1, status='BETTING')
+
+    def test_phases_move_forward(self):
+        """Test a round goes BETTING -> SPINNING -> COMPLETED with its fields saved"""
+        self.round.advance('SPINNING', winning_color='RED', winning_slot=3)
+        self.round.advance('COMPLETED')
+
+        self.round.refresh_from_db()
+        self.assertEqual((self.round.status, self.round.winning_color), ('COMPLETED', 'RED'))
+
+    def test_final_phases_cannot_be_left(self):
+        """Test completed and refunded rounds reject any further transition"""
+        self.round.advance('REFUNDED')
+
+        with self.assertRaises(PhaseError):
+            self.round.advance('SPINNING')
+
+    def test_stale_instance_cannot_advance(self):
+        """Test a round moved by someone else is not moved again from an old copy"""
+        stale = GameRound.objects.get(pk=self.round.pk)
+        self.round.advance('REFUNDED')
+
+        with self.assertRaises(PhaseError):
+            stale.advance('SPINNING')
+        self.round.refresh_from_db()
+        self.assertEqual(self.round.status, 'REFUNDED')
+
+
+class CrashingRoom(RouletteRoom):
+    BETTING_TIME = 0.05
+    SPIN_ANIMATION_TIME = 0.05
+    ERROR_BACKOFF = 0
+
+
+# In-memory SQLite cannot take a settlement and the next round's writes at once
+SERIAL_DB_CALLS = patch('casino.roulette.engine.db_call', database_sync_to_async)
+
+
+@SERIAL_DB_CALLS
+@patch('casino.roulette.engine.spin_wheel', return_value=('RED', 7))
+class CrashRecoveryTests(TransactionTestCase):
+    """Fault-injection tests: a worker dies between phases and a new one recovers the round"""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice', balance=100)
+        self.bob = User.objects.create(username='bob', balance=100)
+
+    def make_room(self):
+        return CrashingRoom('table-1', TimerWheel(tick=0.005), get_channel_layer())
+
+    def run_round(self, room, **faults):
+        """
+        Run one real round with bets from alice (RED, the winning color) and
+        bob (GRAY), up to the end of its settlement. `faults` replaces room
+        methods by functions that raise.
+        """
+        real_open = room.open_betting
+
+        def open_with_bets(round_obj):
+            real_open(round_obj)
+            for user, color in ((self.alice, 'RED'), (self.bob, 'GRAY')):
+                User.objects.filter(pk=user.pk).update(balance=F('balance') - 10)
+                Bet.objects.create(user=user, round=round_obj, color=color, amount=10)
+
+        room.open_betting = open_with_bets
+        for name, fault in faults.items():
+            setattr(room, name, fault)
+
+        async def scenario():
+            await room.prepare()
+            wheel_task = asyncio.create_task(room.wheel.run())
+            try:
+                await room.run_game_round(room.wheel.now())
+                await room.finish_settlement()
+            finally:
+                wheel_task.cancel()
+
+        async_to_sync(scenario)()
+
+    def crash(self, *args, **kwargs):
+        raise RuntimeError('worker killed')
+
+    def restart(self):
+        """A fresh worker starting up on the same room"""
+        async_to_sync(self.make_room().recover)()
+
+    def balances(self):
+        return dict(User.objects.values_list('username', 'balance'))
+
+    def status(self, round_number=1):
+        return GameRound.objects.get(round_number=round_number).status
+
+    def test_recovery_reports_settlement_error(self, spin):
+        """Test the error of a settlement still running when a round failed is written out"""
+        stdout = StringIO()
+        room = CrashingRoom('table-1', TimerWheel(tick=0.005), get_channel_layer(), stdout=stdout)
+
+        async def scenario():
+            async def settle():
+                raise RuntimeError('database went away')
+            room.settlement = asyncio.create_task(settle())
+            await room.recover_after_error()
+
+        async_to_sync(scenario)()
+
+        self.assertIn('[table-1] Settlement failed: database went away', stdout.getvalue())
+        self.assertIsNone(room.settlement)
+
+    def test_crash_between_spin_and_payout(self, spin):
+        """Test a round left SPINNING is settled on restart"""
+        with self.assertRaises(RuntimeError):
+            self.run_round(self.make_room(), complete_round=self.crash)
+        self.assertEqual(self.status(), 'SPINNING')
+        self.assertEqual(self.balances(), {'alice': 90, 'bob': 90})
+
+        self.restart()
+
+        self.assertEqual(self.status(), 'COMPLETED')
+        self.assertEqual(self.balances(), {'alice': 120, 'bob': 90})
+
+    def test_crash_inside_settlement_rolls_back(self, spin):
+        """Test a settlement interrupted half way leaves nothing paid, then pays once"""
+        with patch('casino.roulette.settlement.History.objects.bulk_create', side_effect=self.crash):
+            with self.assertRaises(RuntimeError):
+                self.run_round(self.make_room())
+        self.assertEqual(self.status(), 'SPINNING')
+        self.assertEqual(self.balances(), {'alice': 90, 'bob': 90})
+        self.assertFalse(Bet.objects.filter(settled_at__isnull=False).exists())
+
+        self.restart()
+
+        self.assertEqual(self.balances(), {'alice': 120, 'bob': 90})
+        self.assertEqual(History.objects.count(), 1)
+
+    def test_crash_during_betting_refunds(self, spin):
+        """Test a round that never spun is refunded on restart"""
+        with self.assertRaises(RuntimeError):
+            self.run_round(self.make_room(), start_spin=self.crash)
+        self.assertEqual(self.status(), 'BETTING')
+
+        self.restart()
+
+        self.assertEqual(self.status(), 'REFUNDED')
+        self.assertEqual(self.balances(), {'alice': 100, 'bob': 100})
+
+    def test_repeated_recovery_is_harmless(self, spin):
+        """Test restarting again after recovery changes nothing"""
+        with self.assertRaises(RuntimeError):
+            self.run_round(self.make_room(), complete_round=self.crash)
+
+        self.restart()
+        self.restart()
+
+        self.assertEqual(self.balances(), {'alice': 120, 'bob': 90})
+        self.assertEqual(History.objects.count(), 1)
+
+    def test_orphan_recovered_before_first_round(self, spin):
+        """Test a starting room closes old rounds before it numbers and runs new ones"""
+        with self.assertRaises(RuntimeError):
+            self.run_round(self.make_room(), start_spin=self.crash)
+        room = self.make_room()
+        room.open_betting = lambda round_obj: room.stop() or RouletteRoom.open_betting(room, round_obj)
+
+        async_to_sync(run_rooms)(room.wheel, [room])
+
+        self.assertEqual(
+            list(GameRound.objects.order_by('round_number').values_list('round_number', 'status')),
+            [(1, 'REFUNDED'), (2, 'COMPLETED')],
+        )
+
+    def test_game_loop_recovers_failed_round(self, spin):
+        """Test the running loop settles a round whose payout step failed before going on"""
+        room = self.make_room()
+        real_complete = room.complete_round
+        calls = []
+
+        def flaky_complete(round_obj, winning_color):
+            calls.append(round_obj.round_number)
+            if len(calls) == 1:
+                raise RuntimeError('database went away')
+            room.stop()
+            return real_complete(round_obj, winning_color)
+
+        room.complete_round = flaky_complete
+
+        async_to_sync(run_rooms)(room.wheel, [room])
+
+        # Round 1's failure surfaces when round 2 is done; both are then settled
+        self.assertEqual(calls, [1, 1, 2])
+        self.assertEqual(
+            list(GameRound.objects.order_by('round_number').values_list('status', flat=True)),
+            ['COMPLETED', 'COMPLETED'],
+        )
+
+
+@SERIAL_DB_CALLS
+class PipelinedRoundTests(TransactionTestCase):
+    """Tests for rounds scheduled ahead with explicit deadlines (the engine queries from worker threads)"""
+
+    def setUp(self):
+        cache.clear()
+
+    def run_rounds(self, rounds):
+        room = CrashingRoom('table-1', TimerWheel(tick=0.005), get_channel_layer())
+        room.broadcasts = []
+        real_broadcast = room.broadcast_message
+
+        async def record(message_type, data):
+            room.broadcasts.append((message_type, data))
+            await real_broadcast(message_type, data)
+
+        def open_betting(round_obj):
+            if round_obj.round_number == rounds:
+                room.stop()
+            RouletteRoom.open_betting(room, round_obj)
+
+        room.broadcast_message = record
+        room.open_betting = open_betting
+        async_to_sync(run_rooms)(room.wheel, [room])
+        return room
+
+    def test_rounds_are_back_to_back(self):
+        """Test each round's betting opens when the previous spin ends"""
+        self.run_rounds(3)
+
+        rounds = list(GameRound.objects.order_by('round_number'))
+        self.assertEqual([r.status for r in rounds], ['COMPLETED'] * 3)
+        for previous, current in zip(rounds, rounds[1:]):
+            opens_at = current.betting_ends_at - timezone.timedelta(seconds=CrashingRoom.BETTING_TIME)
+            self.assertAlmostEqual((opens_at - previous.spin_ends_at).total_seconds(), 0, delta=0.01)
+
+    def test_deadlines_broadcast(self):
+        """Test round_starting and round_spinning carry the stored deadlines"""
+        room = self.run_rounds(1)
+
+        round_obj = GameRound.objects.get()
+        messages = dict(room.broadcasts)
+        self.assertEqual(messages['round_starting']['betting_ends_at'], round_obj.betting_ends_at.timestamp())
+        self.assertEqual(messages['round_starting']['spin_ends_at'], round_obj.spin_ends_at.timestamp())
+        self.assertEqual(messages['round_spinning']['spin_ends_at'], round_obj.spin_ends_at.timestamp())
+
+    def test_stopping_drops_scheduled_round(self):
+        """Test a round scheduled for after the last one is not left behind"""
+        self.run_rounds(2)
+
+        self.assertFalse(GameRound.objects.filter(status='SCHEDULED').exists())
+
+    def test_phases_instrumented(self):
+        """Test every round records its phase lengths and schedule drift"""
+        def count(name, **labels):
+            return (metrics.get_value(name, **labels) or {'count': 0})['count']
+
+        before = {phase: count('roulette_phase_seconds', phase=phase) for phase in ('betting', 'spinning')}
+        drift = count('roulette_schedule_drift_seconds', transition='spin')
+        self.run_rounds(2)
+
+        for phase in ('betting', 'spinning'):
+            self.assertEqual(count('roulette_phase_seconds', phase=phase), before[phase] + 2)
+        self.assertEqual(count('roulette_schedule_drift_seconds', transition='spin'), drift + 2)
+        state = metrics.get_value('roulette_phase_seconds', phase='betting')
+        self.assertGreaterEqual(state['sum'], 2 * CrashingRoom.BETTING_TIME * 0.9)
+
+
+class RiskModelTests(TestCase):
+    """Tests for the bet-mix replay behind simulate_roulette_risk"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", password="testpass")  # nosec
+        self.bob = User.objects.create_user(username="bob", password="testpass")  # nosec
+        done = GameRound.objects.create(round_number=1, status='COMPLETED')
+        Bet.objects.create(user=self.alice, round=done, color='GRAY', amount=100)
+        Bet.objects.create(user=self.bob, round=done, color='GRAY', amount=50)
+        Bet.objects.create(user=self.bob, round=done, color='GOLD', amount=10)
+        refunded = GameRound.objects.create(round_number=2, status='REFUNDED')
+        Bet.objects.create(user=self.alice, round=refunded, color='RED', amount=1000)
+
+    def test_bet_mix_sums_stakes_per_color_of_completed_rounds(self):
+        mix = load_bet_mix(timezone.now() - timedelta(days=1))
+        self.assertEqual(mix, [[150, 0, 0, 10]])
+
+    def test_bet_mix_respects_window(self):
+        self.assertEqual(load_bet_mix(timezone.now() + timedelta(seconds=1)), [])
+
+    def test_theoretical_rtp(self):
+        rtp = theoretical_rtp()
+        self.assertAlmostEqual(rtp['GRAY'], 26 / 54 * 2)
+        self.assertAlmostEqual(rtp['GOLD'], 50 / 54)
+        self.assertTrue(all(value < 1 for value in rtp.values()))
+
+    def test_worst_case_liability_is_costliest_color(self):
+        # GOLD hitting pays 500 on 160 wagered
+        self.assertEqual(worst_case_liability([[150, 0, 0, 10], [100, 0, 0, 0]]), 340)
+        self.assertEqual(worst_case_liability([]), 0)
+
+    def test_command_requires_numpy(self):
+        with patch.dict(sys.modules, {'numpy': None}):
+            with self.assertRaisesMessage(CommandError, 'requires NumPy'):
+                call_command('simulate_roulette_risk')
+
+    @skipUnless(importlib.util.find_spec('numpy'), 'NumPy is not installed')
+    def test_simulated_rtp_converges(self):
+        wagered, paid, hourly = simulate_batch([[100, 100, 100, 100]], 200_000, 200, seed=1)
+        self.assertEqual(wagered, 200_000 * 400)
+        self.assertEqual(len(hourly), 1000)
+        self.assertEqual(int(hourly.sum()), wagered - paid)
+        expected = sum(theoretical_rtp().values()) / 4
+        self.assertAlmostEqual(paid / wagered, expected, delta=0.02)
+
+
+class RoundAggregateTests(TestCase):
+    """Tests for the per-round aggregates that replace counting and listing Bet rows"""
+
+    def setUp(self):
+        self.round = GameRound.objects.create(round_number=1, status='BETTING')
+        self.users = [
+            User.objects.create(username=f'player{i}', balance=1000) for i in range(5)
+        ]
+        self.consumer = RouletteConsumer()
+        self.consumer.room = 'table-1'
+
+    async def bet(self, user, color, amount):
+        result = await self.consumer.place_bet(user, color, amount)
+        self.assertTrue(result['success'], result)
+
+    async def test_aggregates_follow_bet_rows(self):
+        """Test an open round's aggregates count its Bet rows and their sums"""
+        await self.bet(self.users[0], 'RED', 100)
+        await self.bet(self.users[0], 'RED', 50)
+        await self.bet(self.users[1], 'GOLD', 5)
+
+        await self.round.arefresh_from_db()
+        self.assertEqual(await database_sync_to_async(self.round.aggregates)(), {
+            'total_bets': 2,
+            'counts': {'GRAY': 0, 'RED': 1, 'BLUE': 0, 'GOLD': 1},
+            'totals': {'GRAY': 0, 'RED': 150, 'BLUE': 0, 'GOLD': 5},
+            'liability': {'GRAY': 0, 'RED': 450, 'BLUE': 0, 'GOLD': 250},
+        })
+
+    async def test_bets_leave_round_row_alone(self):
+        """Test bets do not write the round row; closing betting stores its counters"""
+        await self.bet(self.users[0], 'RED', 100)
+        await self.bet(self.users[1], 'RED', 30)
+
+        stored = GameRound.objects.values_list('red_count', 'red_total')
+        self.assertEqual(await stored.aget(pk=self.round.pk), (0, 0))
+
+        await database_sync_to_async(transaction.atomic()(self.round.advance))('SPINNING')
+
+        self.assertEqual(await stored.aget(pk=self.round.pk), (2, 130))
+
+    async def test_merged_bets_counted_once(self):
+        """Test bets merged into one Bet row count as one bet, so a refund takes them all back out"""
+        for amount in (10, 20, 30):
+            await self.bet(self.users[0], 'RED', amount)
+
+        stats = await UserStats.objects.aget(user=self.users[0])
+        self.assertEqual((stats.total_wagered, stats.roulette_bets), (60, 1))
+
+        await database_sync_to_async(refund_round)(self.round)
+
+        stats = await UserStats.objects.aget(user=self.users[0])
+        self.assertEqual((stats.total_wagered, stats.roulette_bets), (0, 0))
+
+    async def test_phase_change_counts_late_bets(self):
+        """Test advancing a stale copy of the round counts bets placed after it was read"""
+        stale = await GameRound.objects.aget(pk=self.round.pk)
+        await self.bet(self.users[0], 'BLUE', 20)
+
+        await database_sync_to_async(transaction.atomic()(stale.advance))('SPINNING')
+
+        await self.round.arefresh_from_db()
+        self.assertEqual((await database_sync_to_async(self.round.aggregates)())['totals']['BLUE'], 20)
+
+    async def test_bet_racing_spin_rolled_back(self):
+        """Test a bet whose round stops taking bets before it commits changes nothing"""
+        def spin_meanwhile(*args, **kwargs):
+            GameRound.objects.filter(pk=self.round.pk).update(status='SPINNING')
+
+        with patch('casino.roulette.consumers.record_bets', side_effect=spin_meanwhile):
+            result = await self.consumer.place_bet(self.users[0], 'RED', 100)
+
+        self.assertEqual(result['error'], 'No active betting round')
+        await self.users[0].arefresh_from_db()
+        self.assertEqual(self.users[0].balance, 1000)
+        self.assertFalse(await Bet.objects.filter(round=self.round).aexists())
+        await self.round.arefresh_from_db()
+        self.assertEqual((await database_sync_to_async(self.round.aggregates)())['total_bets'], 0)
+
+    async def test_rejected_bet_changes_nothing(self):
+        """Test bets over the balance or from disabled accounts leave balance and round alone"""
+        disabled = self.users[1]
+        await User.objects.filter(pk=disabled.pk).aupdate(is_active=False)
+
+        short = await self.consumer.place_bet(self.users[0], 'RED', 1001)
+        inactive = await self.consumer.place_bet(disabled, 'RED', 10)
+
+        self.assertEqual(short['error'], 'Insufficient balance')
+        self.assertEqual(inactive['error'], 'Account is disabled')
+        await self.round.arefresh_from_db()
+        self.assertEqual((await database_sync_to_async(self.round.aggregates)())['total_bets'], 0)
+        self.assertFalse(await Bet.objects.filter(round=self.round).aexists())
+        self.assertEqual(
+            [user.balance async for user in User.objects.filter(pk__in=[u.pk for u in self.users[:2]])],
+            [1000, 1000],
+        )
+
+    async def test_current_round_reads_constant_rows(self):
+        """Test the database round_state sends aggregates and at most TOP_BETS bets"""
+        for i, user in enumerate(self.users):
+            await self.bet(user, 'GRAY', 10 + i)
+
+        with patch('casino.roulette.consumers.TOP_BETS', 2):
+            state = await self.consumer.get_current_round()
+
+        self.assertEqual(state['total_bets'], 5)
+        self.assertEqual(state['totals']['GRAY'], 60)
+        self.assertEqual([bet['amount'] for bet in state['bets']], [14, 13])
+
+    async def test_bets_paginated(self):
+        """Test get_bets pages cover every bet exactly once"""
+        for user in self.users:
+            await self.bet(user, 'GRAY', 10)
+        self.consumer.BETS_PAGE_SIZE = 2
+
+        seen, after = [], 0
+        while after is not None:
+            bets, after = await self.consumer.get_bets_page(1, after)
+            seen += [bet['username'] for bet in bets]
+
+        self.assertEqual(seen, [user.username for user in self.users])
+
+
+class OutboundQueueTests(SimpleTestCase):
+    """Tests for per-socket outbound flow control"""
+
+    def setUp(self):
+        self.sent = []
+        self.clock = FakeClock()
+        self.queue = OutboundQueue(self.send, max_frames=2, max_bytes=100, max_queued=3,
+                                   slow_timeout=5, clock=self.clock)
+        # The client acks its first frame, which turns flow control on
+        self.push('round_state', 'first')
+        self.ack(1)
+        self.sent.clear()
+
+    async def send(self, text):
+        self.sent.append(text)
+
+    def push(self, frame_type, text):
+        return async_to_sync(self.queue.push)(frame_type, text)
+
+    def ack(self, received):
+        return async_to_sync(self.queue.ack)(received)
+
+    def test_client_without_acks_not_limited(self):
+        """Test frames to a client that never acked go straight out and never make it slow"""
+        queue = OutboundQueue(self.send, max_frames=2, max_bytes=100, max_queued=3,
+                              slow_timeout=5, clock=self.clock)
+        results = [async_to_sync(queue.push)('round_result', str(i)) for i in range(10)]
+        self.clock.now += 60
+
+        self.assertEqual(results, [True] * 10)
+        self.assertTrue(async_to_sync(queue.push)('round_payout', 'late'))
+        self.assertEqual(len(self.sent), 11)
+        self.assertIsNone(queue.slow)
+        self.assertEqual(len(queue.in_flight), 0)
+
+    def test_sends_within_budget(self):
+        """Test frames go straight out while the client keeps up"""
+        self.assertTrue(self.push('round_starting', 'a'))
+        self.assertTrue(self.push('round_spinning', 'b'))
+        self.assertEqual(self.sent, ['a', 'b'])
+
+    def test_queues_until_acked(self):
+        """Test frames past the in-flight budget wait for an ack and keep their order"""
+        for text in 'abcd':
+            self.push('round_result', text)
+        self.assertEqual(self.sent, ['a', 'b'])
+
+        self.assertTrue(self.ack(3))
+        self.assertEqual(self.sent, ['a', 'b', 'c', 'd'])
+        self.assertIsNone(self.queue.blocked_since)
+
+    def test_byte_budget(self):
+        """Test a large unacknowledged frame holds back the next one"""
+        self.push('round_state', 'x' * 90)
+        self.push('round_result', 'y' * 20)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_superseded_frames_dropped(self):
+        """Test only the newest queued bets_delta survives, phase frames are kept"""
+        dropped = metrics.get_value('roulette_socket_frames_dropped_total', type='bets_delta') or 0
+        self.push('round_starting', 'a')
+        self.push('round_starting', 'b')
+        self.push('bets_delta', 'delta1')
+        self.push('round_spinning', 'spin')
+        self.push('bets_delta', 'delta2')
+
+        self.assertEqual([text for _, text in self.queue.queue], ['spin', 'delta2'])
+        self.assertEqual(metrics.get_value('roulette_socket_frames_dropped_total', type='bets_delta'), dropped + 1)
+
+    def test_overflow_marks_slow(self):
+        """Test a queue past max_queued makes the socket slow"""
+        results = [self.push('round_result', str(i)) for i in range(6)]
+
+        self.assertEqual(results, [True] * 5 + [False])
+        self.assertEqual(self.queue.slow, 'overflow')
+        self.assertFalse(self.push('round_result', 'late'))
+
+    def test_blocked_too_long_marks_slow(self):
+        """Test a queue blocked past slow_timeout makes the socket slow"""
+        for text in 'abc':
+            self.push('round_result', text)
+        self.clock.now += 6
+
+        self.assertFalse(self.push('round_payout', 'd'))
+        self.assertEqual(self.queue.slow, 'timeout')
+
+    def test_invalid_acks_ignored(self):
+        """Test acks for frames never sent or already acknowledged change nothing"""
+        for text in 'abc':
+            self.push('round_result', text)
+        self.assertTrue(self.ack(5))
+        self.assertTrue(self.ack('2'))
+        self.assertEqual(self.sent, ['a', 'b'])
+
+
+@override_settings(ROULETTE_SOCKET_MAX_INFLIGHT_FRAMES=1, ROULETTE_SOCKET_MAX_QUEUED=1)
+class SlowConsumerTests(SimpleTestCase):
+    """Tests that RouletteConsumer applies flow control and closes slow sockets"""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_local_copy('table-1')
+        snapshot = RoundSnapshot('table-1')
+        snapshot.start_round(5, time.time() + 10)
+        async_to_sync(snapshot.publish)()
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(RouletteConsumer.as_asgi(), '/ws/roulette/')
+        communicator.scope['user'] = SimpleNamespace(is_authenticated=True, pk=1, username='alice')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'round_state')
+        return communicator
+
+    async def test_ack_releases_queued_frames(self):
+        """Test a frame held back by the budget is sent once the client acks"""
+        communicator = await self.connect()
+        await communicator.send_json_to({'type': 'ack', 'seq': 1})
+        await communicator.send_json_to({'type': 'bogus'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+        await communicator.send_json_to({'type': 'bogus'})
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.send_json_to({'type': 'ack', 'seq': 2})
+        message = await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        self.assertEqual(message, {'type': 'error', 'message': 'Unknown message type'})
+
+    async def test_slow_socket_closed_with_resume_hint(self):
+        """Test a socket that stops acking is told when to reconnect and closed"""
+        communicator = await self.connect()
+        await communicator.send_json_to({'type': 'ack', 'seq': 1})
+        for _ in range(3):
+            await communicator.send_json_to({'type': 'bogus'})
+
+        self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+        message = await communicator.receive_json_from()
+        closed = await communicator.receive_output()
+
+        self.assertEqual(message, {'type': 'slow_consumer', 'retry_after': RouletteConsumer.SLOW_RETRY_AFTER})
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': RouletteConsumer.SLOW_CONSUMER})
+
+    async def test_client_without_acks_kept(self):
+        """Test a client that never acks keeps getting every frame instead of being closed"""
+        communicator = await self.connect()
+        for _ in range(5):
+            await communicator.send_json_to({'type': 'bogus'})
+
+        messages = [await communicator.receive_json_from() for _ in range(5)]
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+        self.assertEqual({message['type'] for message in messages}, {'error'})
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    """Tests for the in-process metrics registry"""
+
+    def test_counter_with_labels(self):
+        """Test counters add up per label set"""
+        requests = metrics.counter('test_requests_total', 'Requests', labels=('path',))
+        requests.inc(path='/a')
+        requests.inc(2, path='/a')
+
+        self.assertEqual(metrics.get_value('test_requests_total', path='/a'), 3)
+        self.assertIs(metrics.counter('test_requests_total', 'Requests', labels=('path',)), requests)
+        with self.assertRaises(ValueError):
+            requests.inc(other='x')
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test an observation counts in every bucket at or above it"""
+        latency = metrics.histogram('test_latency_seconds', 'Latency', buckets=(0.1, 1))
+        latency.observe(0.5)
+        latency.observe(0.05)
+
+        [(_, state)] = latency.collect()
+        self.assertEqual(state['buckets'], [1, 2])
+        self.assertEqual(state['count'], 2)
+
+    def test_gauge_function(self):
+        """Test a computed gauge is evaluated when read"""
+        depth = metrics.gauge('test_depth', 'Depth')
+        depth.set_function(lambda: 7)
+
+        self.assertEqual(metrics.get_value('test_depth'), 7)
+
+    def test_render_prometheus_text(self):
+        """Test render() writes HELP/TYPE lines, labels and histogram series"""
+        metrics.counter('test_render_total', 'Rendered "things"', labels=('kind',)).inc(kind='a"b')
+        metrics.histogram('test_render_seconds', 'Render time', buckets=(1,)).observe(0.5)
+
+        text = metrics.render()
+
+        self.assertIn('# TYPE test_render_total counter\n', text)
+        self.assertIn('test_render_total{kind="a\\"b"} 1\n', text)
+        self.assertIn('test_render_seconds_bucket{le="1"} 1\n', text)
+        self.assertIn('test_render_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn('test_render_seconds_count 1\n', text)
+
+    def test_measured_database_sync_to_async(self):
+        """Test the wrapper returns the result and records the thread wait"""
+        def lookup(value):
+            return value * 2
+
+        call = metrics.measured_database_sync_to_async(lookup)
+
+        self.assertEqual(async_to_sync(call)(21), 42)
+        state = metrics.get_value('db_sync_to_async_wait_seconds', function=lookup.__qualname__)
+        self.assertEqual(state['count'], 1)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_sidecar_requires_token(self):
+        """Test the worker's metrics server answers only an authorized GET /metrics"""
+        async def get(path, token=None):
+            server = asyncio.create_task(metrics.serve_metrics('127.0.0.1', port))
+            for _ in range(100):
+                try:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    break
+                except OSError:
+                    await asyncio.sleep(0.01)
+            headers = f'Authorization: Bearer {token}\r\n' if token else ''
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: test\r\n{headers}\r\n'.encode())
+            response = (await reader.read()).decode()
+            writer.close()
+            server.cancel()
+            return response
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+
+        self.assertTrue(async_to_sync(get)('/metrics').startswith('HTTP/1.1 401'))
+        self.assertTrue(async_to_sync(get)('/metrics', 'wrong').startswith('HTTP/1.1 401'))
+        self.assertTrue(async_to_sync(get)('/other', 'secret').startswith('HTTP/1.1 404'))
+        response = async_to_sync(get)('/metrics', 'secret')
+        self.assertTrue(response.startswith('HTTP/1.1 200'))
+        self.assertIn('# TYPE db_sync_to_async_wait_seconds histogram', response)
+
+
+class LoadTestCommandTests(TransactionTestCase):
+    """Smoke tests for the loadtest_roulette command"""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_local_copy('table-1')
+
+    def test_in_process_report(self):
+        """Test a short in-process run connects every client and reports every phase"""
+        # Two rounds: clients may join after the first betting phase closed
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            call_command(
+                'loadtest_roulette', clients=3, rounds=2, betting_time=0.5, spin_time=0.3,
+                bet_probability=1, seed=1, timeout=10, output=output.name, stdout=StringIO(),
+            )
+            report = json.load(output)
+
+        self.assertEqual(report['config']['target'], 'in-process')
+        self.assertEqual(report['connected'], 3)
+        self.assertEqual(report['connect']['count'], 3)
+        self.assertEqual(report['first_state']['count'], 3)
+        self.assertGreaterEqual(report['bet_ack']['count'], 1)
+        self.assertEqual(set(report['fanout']), {
+            'round_starting', 'round_spinning', 'round_result', 'round_payout',
+        })
+        self.assertGreaterEqual(report['fanout']['round_result']['count'], 3)
+        self.assertEqual(report['errors'], {})
+
+    def test_url_mode_needs_shared_database(self):
+        """Test --url refuses to run against a database the server cannot see"""
+        with self.assertRaisesMessage(CommandError, 'in-memory database is not shared'):
+            call_command('loadtest_roulette', url='ws://127.0.0.1:8000', clients=1)
+        with self.assertRaisesMessage(CommandError, '--url must look like'):
+            call_command('loadtest_roulette', url='http://127.0.0.1:8000', clients=1)
@@ -2,26 +2,28 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import render
 from .models import GameRound, Bet
 from .game_logic import WHEEL_CONFIG, get_color_probabilities
+from .rooms import assign_room, get_active_rooms
+from casino.utils.user_stats import get_stats
 
 
 @login_required(login_url='/login/')
 def roulette(request):
     user = request.user
+    room = assign_room(user.pk, get_active_rooms())
 
     current_round = GameRound.objects.filter(
+        room=room,
         status__in=['BETTING', 'SPINNING']
     ).order_by('-round_number').first()
 
     recent_bets = Bet.objects.filter(user=user).select_related('round')[:10]
 
-    from casino.base.models import History
-    total_winnings = sum(
-        h.amount for h in History.objects.filter(u_id=user)
-    )
+    total_winnings = get_stats(user).total_won
 
     context = {
         'balance': user.balance,
         'username': user.username,
+        'room': room,
         'current_round': current_round,
         'recent_bets': recent_bets,
         'total_winnings': total_winnings,
@@ -190,10 +190,63 @@ CHANNEL_LAYERS = {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
             "hosts": [(REDIS_HOST, int(REDIS_PORT))],
+            # Bet events queue up for the roulette worker during bursts
+            "channel_capacity": {
+                "roulette.bets": 10000,
+            },
         },
     },
 }
 
+# Shared cache (live roulette snapshot); Redis DB 1 keeps it apart from channels
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/1',
+    },
+}
+
+# Most spins one request to /api/spin/batch/ may play
+SLOTS_BATCH_MAX_SPINS = int(os.getenv("SLOTS_BATCH_MAX_SPINS", "10000"))
+
+# Roulette bet intake: 'direct' writes every bet to the database, 'ledger'
+# reserves funds in the bet ledger and flushes the round when it spins
+ROULETTE_BET_INTAKE = os.getenv("ROULETTE_BET_INTAKE", "direct")
+ROULETTE_LEDGER_BACKEND = os.getenv("ROULETTE_LEDGER_BACKEND", "redis")
+ROULETTE_LEDGER_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}/2'
+
+# Roulette rooms (tables): the game loop starts with ROULETTE_ROOMS and opens
+# another room when one passes ROULETTE_ROOM_CAPACITY connections
+ROULETTE_ROOMS = os.getenv("ROULETTE_ROOMS", "table-1").split(",")
+ROULETTE_ROOM_CAPACITY = int(os.getenv("ROULETTE_ROOM_CAPACITY", "1000"))
+ROULETTE_MAX_ROOMS = int(os.getenv("ROULETTE_MAX_ROOMS", "8"))
+
+# Seconds between coalesced bets_delta frames sent to roulette clients
+ROULETTE_BETS_FLUSH_INTERVAL = float(os.getenv("ROULETTE_BETS_FLUSH_INTERVAL", "0.1"))
+
+# Latest round results per room kept in memory for /api/roulette/rounds/
+ROULETTE_RESULTS_BUFFER = int(os.getenv("ROULETTE_RESULTS_BUFFER", "500"))
+
+# Outbound flow control per roulette socket: frames and bytes a client may
+# leave unacknowledged, frames queued beyond that, and seconds the queue may
+# stay blocked before the socket is closed as slow
+ROULETTE_SOCKET_MAX_INFLIGHT_FRAMES = int(os.getenv("ROULETTE_SOCKET_MAX_INFLIGHT_FRAMES", "64"))
+ROULETTE_SOCKET_MAX_INFLIGHT_BYTES = int(os.getenv("ROULETTE_SOCKET_MAX_INFLIGHT_BYTES", str(256 * 1024)))
+ROULETTE_SOCKET_MAX_QUEUED = int(os.getenv("ROULETTE_SOCKET_MAX_QUEUED", "32"))
+ROULETTE_SOCKET_SLOW_TIMEOUT = float(os.getenv("ROULETTE_SOCKET_SLOW_TIMEOUT", "10"))
+
+# Audit log entries are inserted in batches after commit (casino.utils.audit_writer);
+# with AUDIT_LOG_ASYNC a background thread does the inserts and log formatting
+AUDIT_LOG_ASYNC = os.getenv("AUDIT_LOG_ASYNC", "1") == "1"
+AUDIT_LOG_QUEUE_SIZE = int(os.getenv("AUDIT_LOG_QUEUE_SIZE", "10000"))
+AUDIT_LOG_BATCH_SIZE = int(os.getenv("AUDIT_LOG_BATCH_SIZE", "500"))
+
+# Prometheus metrics: bearer token required by /api/metrics/ and the roulette
+# worker's sidecar (both are off while it is empty), and the sidecar's address
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+ROULETTE_METRICS_HOST = os.getenv("ROULETTE_METRICS_HOST", "127.0.0.1")
+ROULETTE_METRICS_PORT = int(os.getenv("ROULETTE_METRICS_PORT", "9108"))
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
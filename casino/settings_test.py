@@ -22,6 +22,19 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Use local-memory cache for tests (no Redis needed)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Keep the roulette bet ledger in-process for tests
+ROULETTE_LEDGER_BACKEND = 'local'
+
+# Write audit log entries in the committing thread (no second connection to the in-memory database)
+AUDIT_LOG_ASYNC = False
+
 # Set required environment variables for testing
 SECRET_KEY = 'test-secret-key-for-ci-testing-only'  #nosec B105
 
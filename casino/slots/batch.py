@@ -0,0 +1,35 @@
+"""
+Batch spins for bots and autoplay.
+
+A batch draws the reel stops of all its spins from a few os.urandom() calls
+and looks each spin up in the outcome table (outcomes.OUTCOMES) instead of
+building an emoji grid per spin. Callers get the stops and win multiplier
+of every spin; a client can rebuild any grid from REELS and the stops.
+"""
+import os
+from .outcomes import LENGTHS, OUTCOMES, STRIKE_BITS
+
+
+def draw_stops(count, reel_length):
+    """`count` uniform stops in range(reel_length); bytes past the last full multiple are rejected to avoid bias"""
+    limit = 256 - 256 % reel_length
+    stops = []
+    while len(stops) < count:
+        missing = count - len(stops)
+        stops += [byte % reel_length for byte in os.urandom(missing * 256 // limit + 16) if byte < limit]
+    return stops[:count]
+
+
+def play_batch(count):
+    """
+    Spin `count` times.
+
+    Returns:
+        tuple: (stops of every spin as (left, middle, right), win multiplier of every spin)
+    """
+    stops = list(zip(*(draw_stops(count, length) for length in LENGTHS)))
+    middle_length, right_length = LENGTHS[1], LENGTHS[2]
+    return stops, [
+        OUTCOMES[(left * middle_length + middle) * right_length + right] >> STRIKE_BITS
+        for left, middle, right in stops
+    ]
@@ -0,0 +1,45 @@
+"""
+Benchmark the slot machine evaluators.
+
+Compares the reference rules (simulate_spin() and check_win(), which build,
+copy and scan an emoji grid per spin) with the precomputed outcome table:
+a full spin (grid, win and strikes for the API), the win alone (three draws
+and one lookup) and batch spins. No database is needed.
+
+Run with: python manage.py bench_slots_evaluator --spins 100000
+"""
+
+import time
+from django.core.management.base import BaseCommand
+from casino.slots.batch import play_batch
+from casino.slots.outcomes import draw, multiplier, spin
+from casino.slots.views import check_win, simulate_spin
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks spins per second of the reference slots evaluator against the outcome table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spins', type=int, default=100_000)
+        parser.add_argument('--bet', type=int, default=10)
+
+    def handle(self, *args, **options):
+        spins, bet = options['spins'], options['bet']
+        evaluators = [
+            ('check_win', lambda: [check_win(simulate_spin(), bet) for _ in range(spins)]),
+            ('table', lambda: [spin(bet) for _ in range(spins)]),
+            ('table win', lambda: [bet * multiplier(*draw()) for _ in range(spins)]),
+            ('batch', lambda: play_batch(spins)),
+        ]
+
+        self.stdout.write(f'{"evaluator":<10} {"spins/s":>12} {"us/spin":>8} {"speedup":>8}')
+        baseline = None
+        for name, run in evaluators:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+
+            baseline = baseline or elapsed
+            self.stdout.write(
+                f'{name:<10} {spins / elapsed:>12.0f} {elapsed / spins * 1e6:>8.2f} {baseline / elapsed:>7.1f}x'
+            )
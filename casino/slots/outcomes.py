@@ -0,0 +1,95 @@
+"""
+Outcome table of the slot machine.
+
+Three reels of 24 stops give only 24 ** 3 = 13,824 outcomes, so every one is
+evaluated at import into OUTCOMES, a flat array indexed by the three stop
+positions. An entry packs the win multiplier (sum of SYMBOL_VALUES of the
+winning lines) above a 9-bit strike mask with bit 3 * row + column set for
+every struck cell. A spin is then three random draws and one lookup.
+
+simulate_spin() and check_win() in views.py stay the reference rules; the
+tests check the table against them for every outcome.
+"""
+from array import array
+from secrets import randbelow
+from .views import REELS, SYMBOL_VALUES
+
+STRIKE_BITS = 9
+STRIKE_MASK = (1 << STRIKE_BITS) - 1
+
+# Winning lines as (row, column) cells; a line pays the value of its middle-column symbol
+LINES = (
+    ((0, 0), (0, 1), (0, 2)),
+    ((1, 0), (1, 1), (1, 2)),
+    ((2, 0), (2, 1), (2, 2)),
+    ((0, 0), (1, 1), (2, 2)),
+    ((0, 2), (1, 1), (2, 0)),
+)
+
+LENGTHS = tuple(len(reel) for reel in REELS)
+
+# WINDOWS[reel][stop]: symbols in the top, middle and bottom row when `reel` stops at `stop`
+WINDOWS = [
+    [tuple(reel[(stop + offset) % len(reel)] for offset in (-1, 0, 1)) for stop in range(len(reel))]
+    for reel in REELS
+]
+
+# STRIKES[mask]: rows of booleans of a strike mask
+STRIKES = [
+    tuple(tuple(bool(mask >> (3 * row + column) & 1) for column in range(3)) for row in range(3))
+    for mask in range(1 << STRIKE_BITS)
+]
+
+
+def index(left, middle, right):
+    """Position of the stops in OUTCOMES"""
+    return (left * LENGTHS[1] + middle) * LENGTHS[2] + right
+
+
+def grid(left, middle, right):
+    """The machine (rows of symbols) shown for the stops, as simulate_spin() builds it"""
+    return [list(row) for row in zip(WINDOWS[0][left], WINDOWS[1][middle], WINDOWS[2][right])]
+
+
+def _evaluate(columns):
+    value, mask = 0, 0
+    for line in LINES:
+        first, centre, last = (columns[column][row] for row, column in line)
+        if first == centre == last:
+            value += SYMBOL_VALUES[centre]
+            for row, column in line:
+                mask |= 1 << (3 * row + column)
+    return value << STRIKE_BITS | mask
+
+
+def _compile():
+    # 'L' holds at least 32 bits: the largest multiplier (5 lines of 7s) needs 19 with the mask
+    return array('L', (
+        _evaluate((left, middle, right))
+        for left in WINDOWS[0] for middle in WINDOWS[1] for right in WINDOWS[2]
+    ))
+
+
+OUTCOMES = _compile()
+
+
+def draw():
+    """Random stops (left, middle, right)"""
+    return randbelow(LENGTHS[0]), randbelow(LENGTHS[1]), randbelow(LENGTHS[2])
+
+
+def multiplier(left, middle, right):
+    """Win multiplier of the stops"""
+    return OUTCOMES[index(left, middle, right)] >> STRIKE_BITS
+
+
+def strikes(mask):
+    """Strike mask as the 3x3 list of booleans check_win() returns"""
+    return [list(row) for row in STRIKES[mask & STRIKE_MASK]]
+
+
+def spin(bet):
+    """One spin: (machine, win, strikes), as check_win(simulate_spin(), bet) returns"""
+    stops = draw()
+    entry = OUTCOMES[index(*stops)]
+    return grid(*stops), bet * (entry >> STRIKE_BITS), strikes(entry & STRIKE_MASK)
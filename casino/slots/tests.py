@@ -2,6 +2,8 @@ from django.test import TestCase, Client
 from django.urls import reverse
 from unittest.mock import patch
 from casino.login.models import User
+from casino.slots.batch import draw_stops, play_batch
+from casino.slots.outcomes import OUTCOMES, STRIKE_BITS, grid, index, multiplier, spin, strikes
 from casino.slots.views import simulate_spin, check_win, REELS, SYMBOL_VALUES
 
 
@@ -395,4 +397,48 @@ class SlotsIntegrationTests(TestCase):
         # With controlled randomness, we should get consistent results
         self.assertIsNotNone(machine)
         self.assertIsNotNone(value)
-        self.assertIsNotNone(strikes)
\ No newline at end of file
+        self.assertIsNotNone(strikes)
+
+
+class OutcomeTableTests(TestCase):
+    """Tests for the precomputed outcome table"""
+
+    def test_table_matches_check_win(self):
+        """Test every combination of stops has the win and strikes check_win gives its grid"""
+        self.assertEqual(len(OUTCOMES), len(REELS[0]) * len(REELS[1]) * len(REELS[2]))
+        for left in range(len(REELS[0])):
+            for middle in range(len(REELS[1])):
+                for right in range(len(REELS[2])):
+                    with patch('casino.slots.views.randbelow', side_effect=[left, middle, right]):
+                        machine = simulate_spin()
+                    self.assertEqual(grid(left, middle, right), machine)
+
+                    _, value, expected = check_win(machine, 1)
+                    entry = OUTCOMES[index(left, middle, right)]
+                    self.assertEqual(entry >> STRIKE_BITS, value)
+                    self.assertEqual(strikes(entry), expected)
+
+    @patch('casino.slots.outcomes.randbelow', side_effect=[0, 5, 10])
+    def test_spin_looks_up_stops(self, mock_randbelow):
+        """Test spin returns the grid, win and strikes of the drawn stops"""
+        machine, win, struck = spin(10)
+
+        self.assertEqual((machine, win, struck), check_win(grid(0, 5, 10), 10))
+
+
+class BatchSpinTests(TestCase):
+    """Tests for batch spins"""
+
+    def test_stops_cover_every_position(self):
+        """Test bulk draws stay on the reel and reach every stop"""
+        stops = draw_stops(5000, 24)
+
+        self.assertEqual(len(stops), 5000)
+        self.assertEqual(set(stops), set(range(24)))
+
+    def test_play_batch(self):
+        """Test a batch returns a stop triple and multiplier per spin"""
+        stops, multipliers = play_batch(100)
+
+        self.assertEqual(len(stops), 100)
+        self.assertEqual(multipliers, [multiplier(*spin) for spin in stops])
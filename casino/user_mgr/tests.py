@@ -1,2 +1,378 @@
+import queue
+import threading
+from io import StringIO
+from unittest.mock import patch
+from auditlog.context import set_actor
+from auditlog.models import LogEntry
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from casino.base.models import BalanceTransaction, Codes, History, UserStats
+from casino.login.models import User
+from casino.roulette.models import Bet, GameRound
+from casino.roulette.settlement import refund_round, settle_round
+from casino.user_mgr.views import RECENT_WINS
+from casino.utils import audit_writer
+from casino.utils.balance_tracker import apply_balance, apply_balance_changes, update_balance
+from casino.utils.user_stats import record_win
 
-# Create your tests here.
+
+class UserStatsTests(TestCase):
+    """Tests for stats recorded with each game's balance change"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="player", password="testpass")  # nosec
+        self.user.balance = 1000
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def stats(self):
+        return UserStats.objects.get(user=self.user)
+
+    @patch("casino.api.views.choice", return_value=1)
+    def test_coinflip_api_bets_and_wins(self, mock_choice):
+        """Test every flip is counted and wins add to the totals"""
+        self.client.post(reverse("coinflip_api"), {"bet": 100, "choice": 1})
+        self.client.post(reverse("coinflip_api"), {"bet": 40, "choice": 1})
+
+        stats = self.stats()
+        self.assertEqual((stats.coinflip_bets, stats.total_wagered), (2, 140))
+        self.assertEqual((stats.total_won, stats.biggest_win), (140, 100))
+
+    def test_slots_spins_counted_individually(self):
+        """Test a multi-spin request counts one bet per spin"""
+        self.client.post(reverse("spin_api"), {"bet": 10, "count": 3})
+
+        stats = self.stats()
+        self.assertEqual((stats.slots_bets, stats.total_wagered), (3, 30))
+
+    @patch("casino.coinflip.views.choice", return_value=0)
+    def test_coinflip_page_loss(self, mock_choice):
+        """Test a lost flip counts as a bet without a win"""
+        self.client.post(reverse("coinflip"), {"choice": 1, "quantity": 25})
+
+        stats = self.stats()
+        self.assertEqual((stats.coinflip_bets, stats.total_wagered, stats.total_won), (1, 25, 0))
+
+    def test_profile_shows_stats_and_recent_wins(self):
+        """Test the profile reads the stats row and only the latest wins"""
+        History.objects.bulk_create([
+            History(u_id=self.user, amount=n, cashout_time=timezone.now())
+            for n in range(RECENT_WINS + 5)
+        ])
+        record_win(self.user, 500)
+
+        response = self.client.get(reverse("profile"))
+
+        self.assertEqual(response.context["stats"].biggest_win, 500)
+        self.assertEqual(len(response.context["wins"]), RECENT_WINS)
+
+
+class BackfillUserStatsTests(TestCase):
+    """Tests for the backfill_user_stats command"""
+
+    def setUp(self):
+        self.alice = User.objects.create(username="alice", balance=0)
+        self.bob = User.objects.create(username="bob", balance=0)
+        done = GameRound.objects.create(round_number=1, status='COMPLETED', winning_color='RED')
+        refunded = GameRound.objects.create(round_number=2, status='REFUNDED')
+        Bet.objects.create(user=self.alice, round=done, color='RED', amount=30, payout=90)
+        Bet.objects.create(user=self.alice, round=done, color='GRAY', amount=20)
+        Bet.objects.create(user=self.alice, round=refunded, color='GRAY', amount=500)
+        History.objects.create(u_id=self.alice, amount=90, cashout_time=timezone.now())
+        History.objects.create(u_id=self.alice, amount=15, cashout_time=timezone.now())
+
+    def backfill(self):
+        call_command('backfill_user_stats', chunk_size=1, stdout=StringIO())
+
+    def test_adds_existing_activity(self):
+        """Test wins and roulette bets from before tracking are added"""
+        self.backfill()
+
+        stats = UserStats.objects.get(user=self.alice)
+        self.assertEqual((stats.total_won, stats.biggest_win), (105, 90))
+        self.assertEqual((stats.total_wagered, stats.roulette_bets), (50, 2))
+        self.assertTrue(UserStats.objects.get(user=self.bob).backfilled)
+
+    def test_running_again_changes_nothing(self):
+        """Test users already backfilled are skipped"""
+        self.backfill()
+        self.backfill()
+
+        self.assertEqual(UserStats.objects.get(user=self.alice).total_won, 105)
+
+    def test_tracked_activity_not_counted_twice(self):
+        """Test a win recorded incrementally is left out of the backfill"""
+        record_win(self.alice, 200)
+        History.objects.create(u_id=self.alice, amount=200, cashout_time=timezone.now())
+
+        self.backfill()
+
+        stats = UserStats.objects.get(user=self.alice)
+        self.assertEqual((stats.total_won, stats.biggest_win), (305, 200))
+
+
+class BalanceLedgerTests(TestCase):
+    """Tests for the append-only balance ledger"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="player", password="testpass")  # nosec
+        User.objects.filter(pk=self.user.pk).update(balance=1000)
+        self.user.refresh_from_db()
+        self.client.force_login(self.user)
+
+    def rows(self, user=None):
+        return list(
+            BalanceTransaction.objects.filter(user=user or self.user).order_by("id")
+            .values_list("delta", "balance_after", "reason", "game_ref")
+        )
+
+    @patch("casino.api.views.choice", return_value=1)
+    def test_game_records_each_change(self, mock_choice):
+        """Test a won flip is a bet and a win row, and leaves the audit log alone"""
+        user_entries = LogEntry.objects.get_for_object(self.user)
+        audit_entries = user_entries.count()
+
+        self.client.post(reverse("coinflip_api"), {"bet": 100, "choice": 1})
+
+        self.assertEqual(self.rows(), [
+            (-100, 900, "coinflip_bet", "coinflip:api"),
+            (200, 1100, "coinflip_win", "coinflip:api"),
+        ])
+        self.assertEqual(user_entries.count(), audit_entries)
+
+    def test_rows_add_up_to_balance(self):
+        """Test the deltas since the ledger started sum to the balance change"""
+        self.client.post(reverse("spin_api"), {"bet": 10, "count": 3})
+        self.user.refresh_from_db()
+        update_balance(self.user, 100, "debug_button")
+
+        self.user.refresh_from_db()
+        total = sum(delta for delta, *_ in self.rows())
+        self.assertEqual(self.user.balance, 1000 + total)
+        self.assertEqual(self.rows()[-1][1], self.user.balance)
+
+    def test_admin_edit_recorded_as_adjustment(self):
+        """Test a balance edit in the admin is recorded as the difference to the balance at save time"""
+        admin = User.objects.create_user(username="admin", password="adminpass", is_staff=True)  # nosec
+        self.client.force_login(admin)
+        url = reverse("admin:login_user_change", args=[self.user.pk])
+        User.objects.filter(pk=self.user.pk).update(balance=900)  # a bet lands meanwhile
+
+        self.client.post(url, {
+            "password": self.user.password, "username": "player", "balance": 1500, "initial-balance": 1000,
+            "is_active": "on",
+        })
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 1500)
+        self.assertEqual(self.rows(), [(600, 1500, "admin_adjustment", "admin:admin")])
+
+    def test_admin_edit_keeps_concurrent_change(self):
+        """Test saving the user form without editing the balance keeps a bet that landed meanwhile"""
+        admin = User.objects.create_user(username="admin", password="adminpass", is_staff=True)  # nosec
+        self.client.force_login(admin)
+        url = reverse("admin:login_user_change", args=[self.user.pk])
+        form = self.client.get(url).content.decode()
+        self.assertIn('name="initial-balance" value="1000"', form)
+        update_balance(self.user, -100, "roulette_bet")
+
+        self.client.post(url, {
+            "password": self.user.password, "username": "player", "is_staff": "on",
+            "balance": 1000, "initial-balance": 1000, "is_active": "on",
+        })
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_staff)
+        self.assertEqual(self.user.balance, 900)
+        self.assertEqual(self.rows(), [(-100, 900, "roulette_bet", "")])
+
+    def test_unknown_reason_rejected(self):
+        """Test free-form reasons are not accepted"""
+        with self.assertRaises(ValueError):
+            update_balance(self.user, 10, "because")
+        self.assertEqual(self.rows(), [])
+
+    def test_fractional_amount_rejected(self):
+        """Test balance changes are whole numbers: fractions raise, whole floats become ints"""
+        with self.assertRaises(ValueError):
+            update_balance(self.user, -10.4, "roulette_bet")
+        with self.assertRaises(ValueError):
+            apply_balance_changes({self.user.pk: 0.5}, "roulette_win")
+
+        self.assertEqual(update_balance(self.user, -10.0, "roulette_bet"), 990)
+        self.assertEqual(self.rows(), [(-10, 990, "roulette_bet", "")])
+        self.assertIsInstance(self.rows()[0][0], int)
+
+    def test_uncovered_debit_not_applied(self):
+        """Test a debit larger than the balance changes nothing and records nothing"""
+        self.assertIsNone(update_balance(self.user, -1001, "debug_button"))
+
+        response = self.client.post(reverse("spin_api"), {"bet": 500, "count": 3}).json()
+
+        self.assertEqual(response["error"], "Insufficient balance")
+        self.assertEqual(response["balance"], 1000)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 1000)
+        self.assertEqual(self.rows(), [])
+
+    def test_sequence_applied_in_one_update(self):
+        """Test a bet and its win need only the stake and record the balance after each step"""
+        User.objects.filter(pk=self.user.pk).update(balance=100)
+
+        balance = apply_balance(self.user, [(-100, "slots_bet"), (250, "slots_win")], game_ref="slots:1x100")
+
+        self.assertEqual(balance, 250)
+        self.assertEqual(self.user.balance, 250)
+        self.assertEqual(self.rows(), [
+            (-100, 0, "slots_bet", "slots:1x100"),
+            (250, 250, "slots_win", "slots:1x100"),
+        ])
+
+    def test_bulk_changes_skip_uncovered_debits(self):
+        """Test apply_balance_changes debits only the users who can cover it"""
+        poor = User.objects.create(username="poor", balance=5)
+        rich = User.objects.create(username="rich", balance=50)
+
+        balances = apply_balance_changes(
+            {poor.pk: -10, rich.pk: -10, self.user.pk: 20}, "roulette_bet", "roulette:table-1:1",
+        )
+
+        self.assertEqual(balances, {rich.pk: 40, self.user.pk: 1020})
+        poor.refresh_from_db()
+        self.assertEqual(poor.balance, 5)
+        self.assertEqual(self.rows(poor), [])
+        self.assertEqual(self.rows(rich), [(-10, 40, "roulette_bet", "roulette:table-1:1")])
+
+    def test_settlement_written_in_bulk(self):
+        """Test settling and refunding a round add one row per bettor"""
+        other = User.objects.create(username="other", balance=0)
+        spun = GameRound.objects.create(room="table-1", round_number=1, status="SPINNING")
+        Bet.objects.create(user=self.user, round=spun, color="RED", amount=10)
+        Bet.objects.create(user=other, round=spun, color="GRAY", amount=10)
+        refunded = GameRound.objects.create(room="table-1", round_number=2, status="BETTING")
+        Bet.objects.create(user=self.user, round=refunded, color="RED", amount=5)
+        Bet.objects.create(user=self.user, round=refunded, color="GOLD", amount=7)
+
+        settle_round(spun, "RED")
+        refund_round(refunded)
+
+        self.assertEqual(self.rows(), [
+            (30, 1030, "roulette_win", "roulette:table-1:1"),
+            (12, 1042, "roulette_refund", "roulette:table-1:2"),
+        ])
+        self.assertEqual(self.rows(other), [])
+
+    def test_statement_pages(self):
+        """Test the statement API pages newest first through next"""
+        for amount in range(1, 6):
+            update_balance(self.user, amount, "debug_button")
+
+        first = self.client.get(reverse("balance_statement_api"), {"limit": 3}).json()
+        second = self.client.get(reverse("balance_statement_api"), {"limit": 3, "before": first["next"]}).json()
+
+        self.assertEqual([t["delta"] for t in first["transactions"]], [5, 4, 3])
+        self.assertEqual([t["delta"] for t in second["transactions"]], [2, 1])
+        self.assertIsNone(second["next"])
+        self.assertEqual(first["transactions"][0]["balance_after"], 1015)
+
+    def test_statement_only_own_transactions(self):
+        """Test a user never sees another user's rows"""
+        other = User.objects.create(username="other", balance=0)
+        update_balance(other, 50, "debug_button")
+
+        response = self.client.get(reverse("balance_statement_api"))
+
+        self.assertEqual(response.json()["transactions"], [])
+
+
+class AuditWriterTests(TestCase):
+    """Tests for audit log entries written after commit"""
+
+    def entries(self, obj):
+        return LogEntry.objects.get_for_object(obj)
+
+    def test_written_on_commit(self):
+        """Test an audited save inserts its entry only once the transaction commits"""
+        with self.captureOnCommitCallbacks(execute=True):
+            code = Codes.objects.create(name="welcome", value=100)
+            code.value = 200
+            code.save()
+            self.assertFalse(self.entries(code).exists())
+
+        self.assertEqual(self.entries(code).count(), 2)
+
+    def test_rolled_back_savepoint_not_written(self):
+        """Test entries of a rolled-back savepoint are dropped with it"""
+        with self.captureOnCommitCallbacks(execute=True):
+            code = Codes.objects.create(name="welcome", value=100)
+            try:
+                with transaction.atomic():
+                    code.value = 200
+                    code.save()
+                    raise ValueError("abort")
+            except ValueError:
+                pass
+
+        self.assertEqual([entry.action for entry in self.entries(code)], [LogEntry.Action.CREATE])
+
+    def test_actor_taken_at_save_time(self):
+        """Test the actor is recorded although the insert happens after the context ended"""
+        admin = User.objects.create(username="admin", is_staff=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with set_actor(admin):
+                code = Codes.objects.create(name="welcome", value=100)
+
+        self.assertEqual(self.entries(code).get().actor, admin)
+
+
+class AuditWriterThreadTests(SimpleTestCase):
+    """Tests for the background audit log writer"""
+
+    @override_settings(AUDIT_LOG_ASYNC=True)
+    def test_writer_thread_writes_in_batches(self):
+        """Test committed entries are written by the writer thread"""
+        batches = []
+        entries = [LogEntry(object_repr=str(n)) for n in range(20)]
+
+        def write_batch(batch):
+            batches.append((threading.current_thread().name, batch))
+
+        with patch("casino.utils.audit_writer.write_batch", side_effect=write_batch):
+            for entry in entries:
+                audit_writer.submit(entry)
+            self.assertTrue(audit_writer.flush(timeout=5))
+
+        self.assertEqual([entry for _, batch in batches for entry in batch], entries)
+        self.assertEqual({name for name, _ in batches}, {"audit-log-writer"})
+
+    @override_settings(AUDIT_LOG_ASYNC=True)
+    def test_full_queue_written_by_caller(self):
+        """Test an entry that does not fit in the queue is written right away, not dropped"""
+        full = queue.Queue(maxsize=1)
+        full.put(LogEntry())
+        entry = LogEntry()
+
+        with patch("casino.utils.audit_writer._queue", full), \
+                patch("casino.utils.audit_writer.start_writer"), \
+                patch("casino.utils.audit_writer.write_batch") as write_batch:
+            audit_writer.submit(entry)
+
+        write_batch.assert_called_once_with([entry])
+
+    def test_writer_restart_registers_no_exit_hook(self):
+        """Test restarting a dead writer thread does not add another exit hook"""
+        dead = threading.Thread(target=lambda: None)
+        dead.start()
+        dead.join()
+
+        with patch("casino.utils.audit_writer._writer", dead), patch("atexit.register") as register:
+            audit_writer.start_writer()
+            self.assertTrue(audit_writer._writer.is_alive())
+
+        register.assert_not_called()
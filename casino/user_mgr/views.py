@@ -10,6 +10,9 @@ from casino.base.models import History
 from casino.settings import DEBUG
 from django.http import Http404
 from casino.utils.balance_tracker import update_balance
+from casino.utils.user_stats import get_stats
+
+RECENT_WINS = 50
 
 def make_challenge():
     alphabet = string.ascii_uppercase + string.digits
@@ -20,11 +23,12 @@ def make_challenge():
 @login_required(login_url='/login/')
 def profile_page(request):
     user = request.user
-    wins = History.objects.filter(u_id=user).order_by('-cashout_time')
+    wins = History.objects.filter(u_id=user).order_by('-cashout_time')[:RECENT_WINS]
     ##### placeholder
     miner_data = {
         "balance": user.balance,
-        "wins": wins
+        "wins": wins,
+        "stats": get_stats(user),
         ##### more info
     }
     return render(request, "casino/user_mgr/index.html", miner_data)
@@ -62,7 +66,7 @@ def add_money(request):
                 err = "Not enough leading zeros in hash"
                 break
             pay = payout_table[zeros][1]
-            update_balance(user, pay, f"mining_payout_{zeros}_zeros")
+            update_balance(user, pay, "mining_payout", game_ref=f"mining:{zeros}_zeros")
             request.session["chal"] = chal = make_challenge()
         break
     miner_data = {
@@ -0,0 +1,148 @@
+"""
+Buffered, batched writer for audit log entries.
+
+django-auditlog inserts a LogEntry synchronously inside the transaction of
+every audited save. BaseConfig.ready gives LogEntry a BufferedLogEntryManager
+instead, whose create() only builds the entry: the actor and remote address
+are taken from auditlog's context right away, and the entry is handed over
+when the transaction commits (entries of rolled-back transactions and
+savepoints are never written).
+
+With AUDIT_LOG_ASYNC a daemon thread drains a bounded queue, inserts the
+entries with bulk_create in batches of up to AUDIT_LOG_BATCH_SIZE and
+formats the stdout audit lines, all off the request thread. If the queue is
+full the committing thread writes its entry itself, so entries are never
+dropped. Without AUDIT_LOG_ASYNC entries are written as their transaction
+commits, in the committing thread.
+"""
+import atexit
+import logging
+import queue
+import threading
+from functools import partial
+from auditlog.models import LogEntryManager
+from django.conf import settings
+from django.db import close_old_connections, router, transaction
+from django.db.models.signals import pre_save
+from casino.utils.metrics import counter, gauge, histogram
+
+logger = logging.getLogger('auditlog')
+
+ENTRIES_WRITTEN = counter('audit_log_entries_written_total', 'Audit log entries inserted')
+QUEUE_FULL = counter('audit_log_queue_full_total', 'Audit log entries written by the committing thread (queue full)')
+WRITE_ERRORS = counter('audit_log_write_errors_total', 'Audit log batches that failed to insert')
+BATCH_SIZE = histogram(
+    'audit_log_batch_size', 'Audit log entries per bulk insert', buckets=(1, 2, 5, 10, 50, 100, 500, 1000),
+)
+
+_queue = queue.Queue(maxsize=settings.AUDIT_LOG_QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+
+gauge('audit_log_queue_depth', 'Audit log entries waiting for the writer thread').set_function(_queue.qsize)
+
+
+class BufferedLogEntryManager(LogEntryManager):
+    """
+    LogEntry manager whose create() defers the insert until the transaction
+    commits.
+
+    Unlike Manager.create(), create() (and so auditlog's log_create() and
+    log_m2m_changes()) returns an unsaved LogEntry: its pk is None, and it
+    is never saved at all if the transaction rolls back. Do not use it to
+    reference or re-read the entry; query LogEntry after the commit (and
+    flush() with AUDIT_LOG_ASYNC) instead. It is still returned, not None,
+    because auditlog only sends post_log for a returned entry.
+    """
+
+    def create(self, **kwargs):
+        """Build the entry and write it on commit; returns the unsaved entry"""
+        entry = self.model(**kwargs)
+        using = router.db_for_write(self.model)
+        # auditlog fills actor and remote address in a pre_save receiver bound to the current context
+        pre_save.send(sender=self.model, instance=entry, raw=False, using=using, update_fields=None)
+        transaction.on_commit(partial(submit, entry), using=using, robust=True)
+        return entry
+
+
+def format_entry(entry):
+    """The stdout audit line of an entry"""
+    action = entry.get_action_display()
+    actor = entry.actor.username if entry.actor else 'System'
+    model_name = entry.content_type.model if entry.content_type else 'Unknown'
+
+    msg = f"{action} on {model_name} (ID: {entry.object_id}) by {actor}"
+
+    if entry.changes:
+        changes_str = ', '.join([
+            f"{field}: {old} → {new}"
+            for field, (old, new) in entry.changes_dict.items()
+        ])
+        msg += f" | Changes: {changes_str}"
+    return msg
+
+
+def write_batch(entries):
+    """Insert committed entries in one statement and log them"""
+    type(entries[0]).objects.bulk_create(entries)
+    ENTRIES_WRITTEN.inc(len(entries))
+    BATCH_SIZE.observe(len(entries))
+    for entry in entries:
+        logger.info(format_entry(entry))
+
+
+def submit(entry):
+    """Hand a committed entry to the writer thread, or write it now"""
+    if not settings.AUDIT_LOG_ASYNC:
+        write_batch([entry])
+        return
+
+    start_writer()
+    try:
+        _queue.put_nowait(entry)
+    except queue.Full:
+        QUEUE_FULL.inc()
+        write_batch([entry])
+
+
+def start_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run, name='audit-log-writer', daemon=True)
+            _writer.start()
+
+
+def _run():
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < settings.AUDIT_LOG_BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            close_old_connections()
+            write_batch(batch)
+        except Exception:
+            WRITE_ERRORS.inc()
+            logger.exception(f"Failed to write {len(batch)} audit log entries")
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+def flush(timeout=None):
+    """
+    Wait until the writer thread has written everything queued so far.
+
+    Returns False if entries were still waiting after `timeout` seconds.
+    """
+    with _queue.all_tasks_done:
+        return _queue.all_tasks_done.wait_for(lambda: not _queue.unfinished_tasks, timeout)
+
+
+# Give the daemon writer a chance to drain the queue at exit (returns at once when it is empty)
+atexit.register(flush, timeout=5)
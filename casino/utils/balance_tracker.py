@@ -1,17 +1,29 @@
 """
-Utility for tracking balance changes with reasons.
+Balance service: every change of a balance goes through here.
+
+A change is one conditional UPDATE ... RETURNING balance that applies the
+delta only if the balance covers it, so games never lock the user row with
+SELECT ... FOR UPDATE or write a balance computed in Python. The new balance
+comes back from the same statement.
+
+Every change is also appended to casino.base.models.BalanceTransaction in
+the caller's transaction: one narrow row with the delta, the balance after
+it, a reason code and a reference to the game. Set-based game code (roulette
+settlement) changes many balances at once with apply_balance_changes().
+Balances never go through the audit log, which is left to non-monetary
+admin edits.
 """
 import logging
-from auditlog.context import set_actor
-from auditlog.models import LogEntry
-from django.db.models.signals import pre_save
-from django.dispatch import receiver
-import threading
+from django.db import connection
+from casino.base.models import BalanceTransaction
+from casino.login.models import User
 
 logger = logging.getLogger('auditlog')
 
-# Thread-local storage for balance change reasons
-_thread_locals = threading.local()
+REASONS = frozenset(code for code, _ in BalanceTransaction.REASON_CHOICES)
+
+STATEMENT_PAGE_SIZE = 50
+TRANSACTION_BATCH_SIZE = 1000
 
 
 def log_balance_change(user, old_balance, new_balance, reason, actor=None):
@@ -22,7 +34,7 @@ def log_balance_change(user, old_balance, new_balance, reason, actor=None):
         user: The User whose balance changed
         old_balance: Balance before change
         new_balance: Balance after change
-        reason: Why the balance changed (e.g., 'mining_payout', 'debug_add', 'bet_win', 'bet_loss', 'code_redeem')
+        reason: Why the balance changed (e.g., 'mining_payout', 'debug_button', 'slots_win', 'coinflip_bet')
         actor: Who triggered the change (optional, defaults to the user themselves)
     """
     amount = new_balance - old_balance
@@ -37,67 +49,154 @@ def log_balance_change(user, old_balance, new_balance, reason, actor=None):
     )
 
 
-def update_balance(user, amount, reason, actor=None, save=True):
+def whole(amount):
+    """`amount` as an int; balances are whole numbers, so fractions are rejected rather than rounded"""
+    if int(amount) != amount:
+        raise ValueError(f"Balance changes must be whole numbers, got {amount}")
+    return int(amount)
+
+
+def apply_balance(user, changes, game_ref='', actor=None, required=None, active_only=False):
     """
-    Update a user's balance and log the reason.
+    Apply a sequence of changes (e.g. a bet and its win) to a balance in one statement.
 
     Args:
-        user: The User object
-        amount: Amount to add (can be negative)
-        reason: Why the balance is changing
+        user: The User object; its balance is set to the new one on success
+        changes: [(amount, reason)] in the order they happen; reasons are
+            codes from BalanceTransaction.REASON_CHOICES
+        game_ref: What the changes belong to, e.g. 'slots:3x10'
         actor: Who triggered the change (optional)
-        save: Whether to save the user object (default: True)
+        required: Balance the user must have for the changes to apply;
+            defaults to the deepest the sequence goes below the start
+            (the stake of a bet), so a balance never goes negative
+        active_only: Only apply to an active account
 
     Returns:
-        The new balance
+        The new balance, or None if the balance did not cover the changes
+        (or the account is inactive with active_only, or an amount is beyond
+        what a balance column can hold); nothing is written then
     """
-    old_balance = user.balance
-    user.balance += amount
-
-    # Store reason in thread-local storage before save
-    _thread_locals.balance_change_reason = reason
-    _thread_locals.balance_change_user_id = user.pk
-
-    if save:
-        try:
-            if actor:
-                with set_actor(actor):
-                    user.save()
-            else:
-                user.save()
-        finally:
-            # Clean up thread-local storage
-            _thread_locals.balance_change_reason = None
-            _thread_locals.balance_change_user_id = None
+    for _, reason in changes:
+        if reason not in REASONS:
+            raise ValueError(f"Unknown balance change reason: {reason}")
+    changes = [(whole(amount), reason) for amount, reason in changes]
+
+    total, lowest = 0, 0
+    for amount, _ in changes:
+        total += amount
+        lowest = min(lowest, total)
+    if required is None:
+        required = -lowest
+    low, high = connection.ops.integer_field_range(User._meta.get_field('balance').get_internal_type())
+    if not all(low <= value <= high for value in (total, required, *(amount for amount, _ in changes))):
+        # No balance covers it, and the database could not even take the parameter
+        return None
+
+    table = connection.ops.quote_name(User._meta.db_table)
+    sql = f"UPDATE {table} SET balance = balance + %s WHERE id = %s"
+    params = [total, user.pk]
+    if required > 0:
+        sql += " AND balance >= %s"
+        params.append(required)
+    if active_only:
+        sql += " AND is_active = %s"
+        params.append(True)
+    with connection.cursor() as cursor:
+        cursor.execute(sql + " RETURNING balance", params)
+        row = cursor.fetchone()
+    if row is None:
+        return None
+
+    old_balance, user.balance = row[0] - total, row[0]
+    balance = old_balance
+    rows = []
+    for amount, reason in changes:
+        balance += amount
+        rows.append(BalanceTransaction(user_id=user.pk, delta=amount, balance_after=balance,
+                                       reason=reason, game_ref=game_ref))
+    BalanceTransaction.objects.bulk_create(rows)
 
     # Log to stdout
-    log_balance_change(user, old_balance, user.balance, reason, actor)
+    reasons = ' + '.join(reason for _, reason in changes)
+    log_balance_change(user, old_balance, user.balance, f"{reasons} {game_ref}".strip(), actor)
 
     return user.balance
 
 
-# Signal handler to add reason to audit log at creation time
-@receiver(pre_save, sender=LogEntry)
-def add_balance_change_reason(sender, instance, **kwargs):
-    """Add balance change reason to audit log entry when it's created."""
-    # Only process if this is a new log entry and we have a reason stored
-    if not instance.pk and hasattr(_thread_locals, 'balance_change_reason'):
-        reason = _thread_locals.balance_change_reason
-        user_id = getattr(_thread_locals, 'balance_change_user_id', None)
-
-        # Check if this log entry is for the user we're tracking
-        if reason and user_id and str(instance.object_id) == str(user_id):
-            # Check if balance field changed
-            if instance.changes and 'balance' in instance.changes_dict:
-                # Convert balance values to numbers for calculation
-                try:
-                    old_val = float(instance.changes_dict['balance'][0]) if instance.changes_dict['balance'][0] else 0
-                    new_val = float(instance.changes_dict['balance'][1]) if instance.changes_dict['balance'][1] else 0
-                    amount = new_val - old_val
-                except (ValueError, TypeError):
-                    amount = 0
-
-                instance.additional_data = {
-                    'balance_change_reason': reason,
-                    'amount': str(amount)
-                }
+def update_balance(user, amount, reason, actor=None, game_ref='', required=None, active_only=False):
+    """
+    Add `amount` (can be negative) to a user's balance and record it in the ledger.
+
+    A debit only applies if the balance covers it. See apply_balance() for
+    the arguments.
+
+    Returns:
+        The new balance, or None if the balance did not cover the debit
+    """
+    return apply_balance(user, [(amount, reason)], game_ref, actor, required, active_only)
+
+
+def apply_balance_changes(deltas, reason, game_ref=''):
+    """
+    Change many balances at once, TRANSACTION_BATCH_SIZE users per statement.
+
+    Each debit only applies if that user's balance covers it; credits always
+    apply. Ledger rows are written in bulk from the returned balances.
+
+    Args:
+        deltas: {user_id: amount to add}
+        reason: Reason code, one of BalanceTransaction.REASON_CHOICES
+        game_ref: What the changes belong to, e.g. 'roulette:table-1:42'
+
+    Returns:
+        {user_id: new balance} of the users whose balance changed
+    """
+    if reason not in REASONS:
+        raise ValueError(f"Unknown balance change reason: {reason}")
+    deltas = {user_id: whole(amount) for user_id, amount in deltas.items()}
+
+    table = connection.ops.quote_name(User._meta.db_table)
+    user_ids = list(deltas)
+    balances = {}
+    for start in range(0, len(user_ids), TRANSACTION_BATCH_SIZE):
+        batch = user_ids[start:start + TRANSACTION_BATCH_SIZE]
+        cases = ' '.join(['WHEN %s THEN %s'] * len(batch))
+        placeholders = ', '.join(['%s'] * len(batch))
+        sql = (
+            f"UPDATE {table} SET balance = balance + CASE id {cases} END "
+            f"WHERE id IN ({placeholders})"
+        )
+        params = [value for uid in batch for value in (uid, deltas[uid])] + batch
+        debits = [uid for uid in batch if deltas[uid] < 0]
+        if debits:
+            sql += f" AND balance >= CASE id {' '.join(['WHEN %s THEN %s'] * len(debits))} ELSE balance END"
+            params += [value for uid in debits for value in (uid, -deltas[uid])]
+        with connection.cursor() as cursor:
+            cursor.execute(sql + " RETURNING id, balance", params)
+            balances.update(cursor.fetchall())
+
+    BalanceTransaction.objects.bulk_create(
+        [
+            BalanceTransaction(user_id=user_id, delta=deltas[user_id], balance_after=balance,
+                               reason=reason, game_ref=game_ref)
+            for user_id, balance in balances.items()
+        ],
+        batch_size=TRANSACTION_BATCH_SIZE,
+    )
+    return balances
+
+
+def get_statement(user_id, before=None, limit=STATEMENT_PAGE_SIZE):
+    """
+    A page of a user's balance changes, newest first.
+
+    Pages are keyed by transaction id: pass the id of the last row of a
+    page as `before` to get the next (older) one.
+    """
+    rows = BalanceTransaction.objects.filter(user_id=user_id)
+    if before is not None:
+        rows = rows.filter(id__lt=before)
+    return list(
+        rows.order_by('-id')
+        .values('id', 'delta', 'balance_after', 'reason', 'game_ref', 'created_at')[:limit]
+    )
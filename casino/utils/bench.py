@@ -0,0 +1,41 @@
+"""
+Helpers shared by the benchmark management commands.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Run the enclosed block against a throwaway test database.
+
+    Uses the same machinery as the test runner, so benchmarks never touch
+    real data and work with both settings and settings_test. Logging is muted
+    meanwhile so console I/O does not dominate the timings.
+    """
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    logging.disable(logging.INFO)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def measure():
+    """
+    Time the enclosed block and count the queries it runs.
+
+    Yields a dict that is filled with 'ms' and 'queries' on exit.
+    """
+    stats = {}
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        yield stats
+        stats['ms'] = (time.perf_counter() - start) * 1000
+    stats['queries'] = len(queries)
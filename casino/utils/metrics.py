@@ -0,0 +1,245 @@
+"""
+In-process metrics registry and Prometheus export.
+
+Counters, gauges and histograms are kept in memory per process and are
+cheap enough for hot paths (one lock, no I/O). Metrics are declared once at
+module level with counter(), gauge() or histogram(); declaring a name again
+returns the existing metric. A gauge can also be computed when read, from a
+function set with set_function().
+
+render() produces the Prometheus text format. Web processes serve it at
+/api/metrics/, the roulette worker from a small sidecar HTTP server
+(serve_metrics); both require METRICS_TOKEN as a bearer token. Every process
+has its own registry, so each one is scraped separately.
+"""
+import asyncio
+import functools
+import hmac
+import threading
+import time
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+# Default histogram buckets (seconds), roughly Prometheus' defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+REGISTRY = {}
+
+
+class Metric:
+    """A named metric with optional labels; values are keyed by label values"""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} takes labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def collect(self):
+        """[(label values, value)] at this moment"""
+        with _lock:
+            return list(self.values.items())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.function = None
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with _lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Compute the (unlabelled) value with `function()` whenever it is read"""
+        self.function = function
+
+    def collect(self):
+        if self.function is not None:
+            return [((), self.function())]
+        return super().collect()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with _lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def collect(self):
+        with _lock:
+            return [(key, {**state, 'buckets': list(state['buckets'])}) for key, state in self.values.items()]
+
+
+def _register(cls, name, *args, **kwargs):
+    with _lock:
+        metric = REGISTRY.get(name)
+        if metric is None:
+            metric = REGISTRY[name] = cls(name, *args, **kwargs)
+    if not isinstance(metric, cls):
+        raise ValueError(f'{name} is already registered as a {metric.kind}')
+    return metric
+
+
+def counter(name, help_text, labels=()):
+    return _register(Counter, name, help_text, labels)
+
+
+def gauge(name, help_text, labels=()):
+    return _register(Gauge, name, help_text, labels)
+
+
+def histogram(name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, help_text, labels, buckets)
+
+
+def get_value(name, **labels):
+    """Current value of a counter or gauge (None if never set); for tests and debugging"""
+    metric = REGISTRY[name]
+    key = metric.key(labels)
+    return dict(metric.collect()).get(key)
+
+
+DB_WAIT = histogram(
+    'db_sync_to_async_wait_seconds', 'Time a database_sync_to_async call waited for a thread',
+    labels=('function',),
+)
+
+
+LEADER_TAKEOVER = histogram(
+    'roulette_leader_takeover_seconds', 'Time from the previous leader\'s last renewal until a standby took over',
+    labels=('lease',), buckets=(0.5, 1, 2, 4, 6, 8, 10, 15, 30, 60),
+)
+
+
+def measured_database_sync_to_async(func, thread_sensitive=True):
+    """database_sync_to_async that records in DB_WAIT how long each call queued for its thread"""
+    name = getattr(func, '__qualname__', repr(func))
+
+    def run(submitted, *args, **kwargs):
+        DB_WAIT.observe(time.perf_counter() - submitted, function=name)
+        return func(*args, **kwargs)
+
+    wrapped = database_sync_to_async(run, thread_sensitive=thread_sensitive)
+
+    @functools.wraps(func)
+    async def call(*args, **kwargs):
+        return await wrapped(time.perf_counter(), *args, **kwargs)
+
+    return call
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format (0.0.4)"""
+    lines = []
+    with _lock:
+        metrics = sorted(REGISTRY.values(), key=lambda metric: metric.name)
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for key, value in metric.collect():
+            if metric.kind != 'histogram':
+                lines.append(f'{metric.name}{_labels(metric.labels, key)} {value}')
+                continue
+            for bound, count in zip(metric.buckets, value['buckets']):
+                lines.append(f'{metric.name}_bucket{_labels(metric.labels, key, [("le", bound)])} {count}')
+            lines.append(f'{metric.name}_bucket{_labels(metric.labels, key, [("le", "+Inf")])} {value["count"]}')
+            lines.append(f'{metric.name}_sum{_labels(metric.labels, key)} {value["sum"]}')
+            lines.append(f'{metric.name}_count{_labels(metric.labels, key)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def is_authorized(authorization):
+    """True if an Authorization header carries METRICS_TOKEN (metrics are off without one)"""
+    token = settings.METRICS_TOKEN
+    if not token or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+
+
+async def serve_metrics(host, port):
+    """
+    Serve render() at GET /metrics for a process without a web server (the
+    roulette worker). Runs until cancelled.
+    """
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=5)
+            request_line, *headers = request.decode('latin-1').split('\r\n')
+            authorization = next(
+                (value.strip() for name, _, value in (h.partition(':') for h in headers)
+                 if name.lower() == 'authorization'),
+                None,
+            )
+            if not request_line.startswith('GET /metrics '):
+                status, body = '404 Not Found', ''
+            elif not is_authorized(authorization):
+                status, body = '401 Unauthorized', ''
+            else:
+                status, body = '200 OK', render()
+            payload = body.encode()
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode() + payload
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,66 @@
+"""
+Cached session validity for long-lived WebSocket connections.
+
+Consumers re-check on every action that the session they were opened with
+still exists (logout in another tab). The answer is kept in the shared
+Django cache and explicitly revoked when the session goes away: on
+user_logged_out and on every Session deletion (logout flush, admin,
+clearsessions). Revocation writes a tombstone rather than deleting the key,
+so a lookup that read the database just before the logout cannot put a
+stale "valid" back (it only ever uses cache.add).
+"""
+from django.contrib.auth.signals import user_logged_out
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+SESSION_VALID_KEY = 'session:valid:{}'
+SESSION_VALID_TTL = 5 * 60
+
+VALID = 1
+REVOKED = 0
+
+
+def is_session_valid(session_key):
+    """
+    True if the session still exists.
+
+    Served from the cache; the database is only read on a miss. Blocking,
+    call it from a sync context or through database_sync_to_async.
+    """
+    if not session_key:
+        return False
+
+    key = SESSION_VALID_KEY.format(session_key)
+    state = cache.get(key)
+    if state is not None:
+        return state == VALID
+
+    if not Session.objects.filter(session_key=session_key).exists():
+        revoke_session(session_key)
+        return False
+
+    # add() never overwrites a tombstone written by a concurrent revocation
+    cache.add(key, VALID, SESSION_VALID_TTL)
+    return cache.get(key) == VALID
+
+
+def revoke_session(session_key):
+    """Mark a session as gone for every process sharing the cache"""
+    if session_key:
+        cache.set(SESSION_VALID_KEY.format(session_key), REVOKED, SESSION_VALID_TTL)
+
+
+@receiver(user_logged_out)
+def revoke_on_logout(sender, request, user, **kwargs):
+    """Revoke the session being logged out (it is flushed right after this signal)"""
+    session = getattr(request, 'session', None)
+    if session is not None:
+        revoke_session(session.session_key)
+
+
+@receiver(post_delete, sender=Session)
+def revoke_on_session_delete(sender, instance, **kwargs):
+    """Revoke sessions deleted by flush(), the admin or clearsessions"""
+    revoke_session(instance.session_key)
@@ -0,0 +1,74 @@
+"""
+Incremental per-user statistics (casino.base.models.UserStats).
+
+Every game records its bets and wins here inside the transaction that
+changes the balance, so the totals never drift from the balance history.
+Rows are created on first use; activity from before that is added once by
+the backfill_user_stats command.
+"""
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Greatest
+from casino.base.models import UserStats
+
+GAMES = ('roulette', 'slots', 'coinflip')
+
+
+def ensure_stats(user_ids):
+    """Create missing stats rows for the given users"""
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+
+
+def record_bets(user, game, wagered, count=1):
+    """Add `count` bets on `game` totalling `wagered` to the user's stats"""
+    ensure_stats([user.pk])
+    UserStats.objects.filter(user_id=user.pk).update(**{
+        'total_wagered': F('total_wagered') + wagered,
+        f'{game}_bets': F(f'{game}_bets') + count,
+    })
+
+
+def record_win(user, amount, biggest=None):
+    """Add a win to the user's stats; `biggest` is the largest single win when `amount` sums several"""
+    if amount <= 0:
+        return
+    ensure_stats([user.pk])
+    UserStats.objects.filter(user_id=user.pk).update(
+        total_won=F('total_won') + amount,
+        biggest_win=Greatest('biggest_win', Value(amount if biggest is None else biggest)),
+    )
+
+
+def _per_user(bets, aggregate):
+    """Subquery of `aggregate` over the rows of `bets` belonging to the outer user"""
+    return Subquery(
+        bets.filter(user_id=OuterRef('pk')).order_by().values('user_id')
+        .annotate(value=aggregate).values('value')
+    )
+
+
+def record_bets_of(bets, game, sign=1):
+    """
+    Add every row of a bets queryset (user, amount) to its user's stats with
+    one UPDATE; sign=-1 takes refunded bets back out. Users without a stats
+    row (see ensure_stats) are skipped.
+    """
+    UserStats.objects.filter(user_id__in=bets.values('user_id')).update(**{
+        'total_wagered': F('total_wagered') + sign * _per_user(bets, Sum('amount')),
+        f'{game}_bets': F(f'{game}_bets') + sign * _per_user(bets, Count('pk')),
+    })
+
+
+def record_wins_of(bets):
+    """Add the payouts of a winning bets queryset (user, payout) to its users' existing stats rows with one UPDATE"""
+    UserStats.objects.filter(user_id__in=bets.values('user_id')).update(
+        total_won=F('total_won') + _per_user(bets, Sum('payout')),
+        biggest_win=Greatest('biggest_win', _per_user(bets, Max('payout'))),
+    )
+
+
+def get_stats(user):
+    """The user's stats, or an unsaved all-zero row if they have not played yet"""
+    return UserStats.objects.filter(user_id=user.pk).first() or UserStats(user_id=user.pk)
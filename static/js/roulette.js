@@ -5,17 +5,149 @@ let currentRound = null;
 let timerInterval = null;
 let roundEndTime = null;
 let currentWheelRotation = 0;
+let lastWinningColor = null;
+let serverClockOffset = 0;  // Server clock minus local clock, in seconds
 let myUsername = "";
+let myRoom = "";
 
 let myBets = { GRAY: 0, RED: 0, BLUE: 0, GOLD: 0 };
 let totalBets = { GRAY: 0, RED: 0, BLUE: 0, GOLD: 0 };
 let playerBets = { GRAY: {}, RED: {}, BLUE: {}, GOLD: {} };
+let betsPaging = false;  // Paging through the bet list of the current round
+let betsNext = null;  // Cursor of the next bet-list page, fetched only when the player asks
 let winHistory = [];
 
+/* Wire codecs - mirror of casino/roulette/protocol.py */
+
+const COMPACT_SUBPROTOCOL = 'roulette.compact.v1';
+const ROOM_CLOSED = 4004;
+const SLOW_CONSUMER = 4008;
+
+// Outbound flow control: the server only sends while enough frames are acknowledged
+const ACK_EVERY = 8;
+const ACK_DELAY = 500;
+let framesReceived = 0;
+let framesAcked = 0;
+let ackTimer = null;
+let slowRetryAfter = 5;  // Seconds; sent by the server before closing a slow socket
+const PROTOCOL_COLORS = ['GRAY', 'RED', 'BLUE', 'GOLD'];
+const PROTOCOL_STATUSES = ['BETTING', 'SPINNING', 'COMPLETED'];
+
+// [message type, field order]; the event code is the position in this list
+const PROTOCOL_EVENTS = [
+    ['round_state', ['round_number', 'status', 'time_remaining', 'total_bets', 'totals', 'history', 'bets',
+                     'betting_ends_at', 'spin_ends_at', 'counts', 'liability']],
+    ['round_starting', ['round_number', 'time_remaining', 'betting_ends_at', 'spin_ends_at']],
+    ['bets_delta', ['round_number', 'totals', 'bets']],
+    ['round_spinning', ['round_number', 'winning_color', 'winning_slot', 'spin_ends_at']],
+    ['round_result', ['round_number', 'winning_color', 'winning_slot']],
+    ['round_payout', ['round_number', 'your_payout', 'your_balance']],
+    ['balance_update', ['balance']],
+    ['error', ['message']],
+    ['place_bet', ['color', 'amount']],
+    ['get_state', []],
+    ['get_bets', ['round_number', 'after']],
+    ['round_bets', ['round_number', 'bets', 'next']],
+    ['ack', ['seq']],
+    ['slow_consumer', ['retry_after']]
+];
+
+function unpackColor(code) {
+    return PROTOCOL_COLORS[code];
+}
+
+const perColorCodec = [
+    function(values) { return PROTOCOL_COLORS.map(function(c) { return values[c]; }); },
+    function(values) {
+        const perColor = {};
+        PROTOCOL_COLORS.forEach(function(color, i) { perColor[color] = values[i]; });
+        return perColor;
+    }
+];
+
+// Fields with a compact representation: name -> [pack, unpack]
+const PROTOCOL_FIELDS = {
+    status: [
+        function(status) { return PROTOCOL_STATUSES.indexOf(status); },
+        function(code) { return PROTOCOL_STATUSES[code]; }
+    ],
+    color: [
+        function(color) { return PROTOCOL_COLORS.indexOf(color); },
+        unpackColor
+    ],
+    winning_color: [
+        function(color) { return PROTOCOL_COLORS.indexOf(color); },
+        unpackColor
+    ],
+    history: [
+        function(history) { return history.map(function(c) { return PROTOCOL_COLORS.indexOf(c); }); },
+        function(codes) { return codes.map(unpackColor); }
+    ],
+    totals: perColorCodec,
+    counts: perColorCodec,
+    liability: perColorCodec,
+    bets: [
+        function(bets) {
+            return bets.map(function(bet) {
+                return [bet.username, PROTOCOL_COLORS.indexOf(bet.color), bet.amount];
+            });
+        },
+        function(rows) {
+            return rows.map(function(row) {
+                return { username: row[0], color: unpackColor(row[1]), amount: row[2] };
+            });
+        }
+    ]
+};
+
+const jsonCodec = {
+    encode: function(message) {
+        return JSON.stringify(message);
+    },
+    decode: function(text) {
+        return JSON.parse(text);
+    }
+};
+
+const compactCodec = {
+    encode: function(message) {
+        const code = PROTOCOL_EVENTS.findIndex(function(event) { return event[0] === message.type; });
+        const values = [code];
+        PROTOCOL_EVENTS[code][1].forEach(function(field) {
+            let value = message[field];
+            if (value === undefined) {
+                value = null;
+            }
+            if (value !== null && PROTOCOL_FIELDS[field]) {
+                value = PROTOCOL_FIELDS[field][0](value);
+            }
+            values.push(value);
+        });
+        return JSON.stringify(values);
+    },
+    decode: function(text) {
+        const values = JSON.parse(text);
+        const event = PROTOCOL_EVENTS[values[0]];
+        const message = { type: event[0] };
+        event[1].forEach(function(field, i) {
+            let value = values[i + 1];
+            if (value !== null && value !== undefined && PROTOCOL_FIELDS[field]) {
+                value = PROTOCOL_FIELDS[field][1](value);
+            }
+            message[field] = value;
+        });
+        return message;
+    }
+};
+
+// Compact once the server accepts the subprotocol, JSON otherwise
+let codec = jsonCodec;
+
 function initRoulette() {
     // Get username from data attribute
     const container = document.querySelector('.roulette-container');
     myUsername = container ? container.dataset.username : '';
+    myRoom = container ? container.dataset.room : '';
 
     drawWheel();
     connectWebSocket();
@@ -47,6 +179,8 @@ function initRoulette() {
         });
     });
 
+    document.getElementById('show-all-bets').addEventListener('click', requestMoreBets);
+
     // Place bet buttons via data attributes
     document.querySelectorAll('[data-place-bet]').forEach(function(btn) {
         btn.addEventListener('click', function() {
@@ -155,19 +289,28 @@ function resetBetDisplays() {
 
 function connectWebSocket() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = protocol + '//' + window.location.host + '/ws/roulette/';
+    const wsUrl = protocol + '//' + window.location.host + '/ws/roulette/' + (myRoom ? myRoom + '/' : '');
 
-    ws = new WebSocket(wsUrl);
+    ws = new WebSocket(wsUrl, [COMPACT_SUBPROTOCOL]);
 
     ws.onopen = function(e) {
-        console.log('WebSocket connected');
-        ws.send(JSON.stringify({
+        codec = ws.protocol === COMPACT_SUBPROTOCOL ? compactCodec : jsonCodec;
+        framesReceived = 0;
+        framesAcked = 0;
+        console.log('WebSocket connected (' + (ws.protocol || 'json') + ')');
+        ws.send(codec.encode({
             type: 'get_state'
         }));
     };
 
     ws.onmessage = function(event) {
-        const data = JSON.parse(event.data);
+        framesReceived++;
+        if (framesReceived - framesAcked >= ACK_EVERY) {
+            acknowledgeFrames();
+        } else if (!ackTimer) {
+            ackTimer = setTimeout(acknowledgeFrames, ACK_DELAY);
+        }
+        const data = codec.decode(event.data);
         handleWebSocketMessage(data);
     };
 
@@ -176,11 +319,35 @@ function connectWebSocket() {
     };
 
     ws.onclose = function(event) {
-        console.log('WebSocket closed, reconnecting in 2s...');
-        setTimeout(connectWebSocket, 2000);
+        if (event.code === ROOM_CLOSED) {
+            // Our room is no longer hosted; the page assigns a new one
+            window.location.reload();
+            return;
+        }
+        if (ackTimer) {
+            clearTimeout(ackTimer);
+            ackTimer = null;
+        }
+        const delay = event.code === SLOW_CONSUMER ? slowRetryAfter * 1000 : 2000;
+        console.log('WebSocket closed, reconnecting in ' + delay / 1000 + 's...');
+        setTimeout(connectWebSocket, delay);
     };
 }
 
+function acknowledgeFrames() {
+    if (ackTimer) {
+        clearTimeout(ackTimer);
+        ackTimer = null;
+    }
+    if (framesReceived > framesAcked && ws.readyState === WebSocket.OPEN) {
+        framesAcked = framesReceived;
+        ws.send(codec.encode({
+            type: 'ack',
+            seq: framesAcked
+        }));
+    }
+}
+
 function handleWebSocketMessage(data) {
     console.log('Received:', data);
 
@@ -190,32 +357,58 @@ function handleWebSocketMessage(data) {
             break;
 
         case 'round_starting':
+            syncServerClock(data.betting_ends_at, data.time_remaining);
             startNewRound(data.round_number, data.time_remaining, data.history, data.bets);
             break;
 
-        case 'bet_placed':
-            addBetToLiveFeed(data);
+        case 'bets_delta':
+            applyBetsDelta(data);
+            break;
+
+        case 'round_bets':
+            applyBetsPage(data);
             break;
 
         case 'round_spinning':
-            enterSpinningPhase(data.winning_slot, data.winning_color);
+            enterSpinningPhase(data.winning_slot, data.winning_color, data.spin_ends_at);
             break;
 
         case 'round_result':
             displayResult(data);
             break;
 
+        case 'round_payout':
+            displayPayout(data);
+            break;
+
         case 'balance_update':
             updateBalance(data.balance);
             break;
 
+        case 'slow_consumer':
+            // The server closes this socket next; get_state on reconnect resyncs the round
+            slowRetryAfter = data.retry_after;
+            break;
+
         case 'error':
             alert('Error: ' + data.message);
             break;
     }
 }
 
+function syncServerClock(bettingEndsAt, timeRemaining) {
+    // time_remaining was measured by the server against the same deadline
+    if (bettingEndsAt && timeRemaining > 0) {
+        serverClockOffset = (bettingEndsAt - timeRemaining) - Date.now() / 1000;
+    }
+}
+
+function secondsUntil(deadline) {
+    return Math.max(0, deadline - serverClockOffset - Date.now() / 1000);
+}
+
 function syncRoundState(data) {
+    syncServerClock(data.betting_ends_at, data.time_remaining);
     currentRound = data.round_number;
     document.getElementById('round-number').textContent = data.round_number;
 
@@ -230,6 +423,13 @@ function syncRoundState(data) {
         loadBetsFromServer(data.bets);
     }
 
+    // Snapshot totals cover every bet, the bet list only the largest ones
+    if (data.totals) {
+        loadTotalsFromServer(data.totals);
+    }
+    // The rest of the list is only fetched when the player asks for it
+    showMoreBets(Boolean(data.bets) && data.total_bets > data.bets.length, null);
+
     if (data.status === 'SPINNING') {
         disableBetting();
         document.getElementById('timer').textContent = 'SPIN!';
@@ -309,7 +509,14 @@ function loadBetsFromServer(bets) {
     });
 }
 
-function enterSpinningPhase(winningSlot, winningColor) {
+function loadTotalsFromServer(totals) {
+    ['GRAY', 'RED', 'BLUE', 'GOLD'].forEach(function(color) {
+        totalBets[color] = totals[color] || 0;
+        updateTotalBetsDisplay(color);
+    });
+}
+
+function enterSpinningPhase(winningSlot, winningColor, spinEndsAt) {
     disableBetting();
 
     if (timerInterval) {
@@ -320,10 +527,12 @@ function enterSpinningPhase(winningSlot, winningColor) {
     document.getElementById('winner-display').className = 'color-display none';
     document.getElementById('winner-name').textContent = '?';
 
-    spinWheelToSlot(winningSlot);
+    // The next round opens at spin_ends_at, so the wheel must stop by then
+    const duration = spinEndsAt ? Math.max(500, secondsUntil(spinEndsAt) * 1000) : 3000;
+    spinWheelToSlot(winningSlot, duration);
 }
 
-function spinWheelToSlot(winningSlot) {
+function spinWheelToSlot(winningSlot, duration) {
     const wheel = document.getElementById('wheel');
     const degreesPerSlot = 360 / 54;
     const slotCenterAngle = winningSlot * degreesPerSlot + (degreesPerSlot / 2);
@@ -340,7 +549,7 @@ function spinWheelToSlot(winningSlot) {
         { transform: 'translateZ(0) rotate(' + currentWheelRotation + 'deg)' },
         { transform: 'translateZ(0) rotate(' + finalRotation + 'deg)' }
     ], {
-        duration: 3000,
+        duration: duration,
         easing: 'cubic-bezier(0.17, 0.67, 0.12, 0.99)',
         fill: 'forwards'
     });
@@ -356,18 +565,24 @@ function spinWheelToSlot(winningSlot) {
 function displayResult(data) {
     const resultDiv = document.getElementById('result-display');
     const colorName = data.winning_color;
-    const yourPayout = data.your_payout;
 
-    updateBalance(data.your_balance);
+    lastWinningColor = colorName;
     updateWinnerDisplay(colorName);
     addToHistory(colorName);
 
+    resultDiv.textContent = colorName + ' wins.';
+    resultDiv.className = 'result-display loser';
+}
+
+function displayPayout(data) {
+    const resultDiv = document.getElementById('result-display');
+    const yourPayout = data.your_payout;
+
+    updateBalance(data.your_balance);
+
     if (yourPayout > 0) {
-        resultDiv.textContent = colorName + ' WINS! You won $' + formatMoney(yourPayout) + '!';
+        resultDiv.textContent = lastWinningColor + ' WINS! You won $' + formatMoney(yourPayout) + '!';
         resultDiv.className = 'result-display winner';
-    } else {
-        resultDiv.textContent = colorName + ' wins.';
-        resultDiv.className = 'result-display loser';
     }
 }
 
@@ -386,38 +601,67 @@ function placeBet(color) {
 
     localStorage.setItem('roulette_bet', amount);
 
-    ws.send(JSON.stringify({
+    ws.send(codec.encode({
         type: 'place_bet',
         color: color,
         amount: amount
     }));
 }
 
-function addBetToLiveFeed(data) {
-    const color = data.color;
-    const list = document.getElementById('bets-list-' + color);
-    const username = data.username;
-    const isOwnBet = username === myUsername;
-
-    const emptyMsg = list.querySelector('.tile-bets-empty');
-    if (emptyMsg) {
-        emptyMsg.remove();
+function applyBetsDelta(data) {
+    if (data.round_number !== currentRound) {
+        return;
     }
 
-    totalBets[color] += data.amount;
-    updateTotalBetsDisplay(color);
+    loadBetsFromServer(data.bets);
+    // Server totals are authoritative and correct any frame we missed
+    loadTotalsFromServer(data.totals);
+}
 
-    if (isOwnBet) {
-        myBets[color] += data.amount;
-        updateCurrentBetDisplay(color);
+function requestBetsPage(roundNumber, after) {
+    ws.send(codec.encode({
+        type: 'get_bets',
+        round_number: roundNumber,
+        after: after
+    }));
+}
+
+function showMoreBets(more, next) {
+    const button = document.getElementById('show-all-bets');
+    betsNext = next;
+    button.hidden = !more;
+    button.disabled = false;
+    button.textContent = betsPaging ? 'Show more bets' : 'Show all bets';
+}
+
+function requestMoreBets() {
+    document.getElementById('show-all-bets').disabled = true;
+    requestBetsPage(currentRound, betsNext);
+}
+
+function applyBetsPage(data) {
+    if (data.round_number !== currentRound) {
+        return;
+    }
+    if (data.bets.length === 0) {
+        showMoreBets(false, null);
+        return;
     }
 
-    if (!playerBets[color][username]) {
-        playerBets[color][username] = 0;
+    // The first page replaces the largest bets from round_state; totals stay as the server sent them
+    if (!betsPaging) {
+        myBets = { GRAY: 0, RED: 0, BLUE: 0, GOLD: 0 };
+        ['GRAY', 'RED', 'BLUE', 'GOLD'].forEach(function(color) { playerBets[color] = {}; });
     }
-    playerBets[color][username] += data.amount;
+    betsPaging = true;
+
+    const totals = Object.assign({}, totalBets);
+    loadBetsFromServer(data.bets);
+    loadTotalsFromServer(totals);
+    ['GRAY', 'RED', 'BLUE', 'GOLD'].forEach(updateCurrentBetDisplay);
 
-    rebuildBetsList(color);
+    // One page per click: the next one waits for the player
+    showMoreBets(data.next !== null, data.next);
 }
 
 function rebuildBetsList(color) {
@@ -446,6 +690,8 @@ function rebuildBetsList(color) {
 }
 
 function clearLiveBets() {
+    betsPaging = false;
+    showMoreBets(false, null);
     ['GRAY', 'RED', 'BLUE', 'GOLD'].forEach(function(color) {
         const list = document.getElementById('bets-list-' + color);
         list.innerHTML = '<div class="tile-bets-empty">No bets yet</div>';